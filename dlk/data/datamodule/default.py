@@ -21,9 +21,10 @@ from intc import (
     cregister,
 )
 from torch.nn.utils.rnn import pad_sequence
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, RandomSampler, SequentialSampler
 
 from dlk.data.datamodule import IBaseDataModule
+from dlk.data.datamodule.sampler import LengthBucketBatchSampler
 from dlk.data.dataset.default import DefaultDataset, DefaultDatasetConfig
 from dlk.utils.register import register, register_module_name
 
@@ -54,6 +55,26 @@ class BasicDatamoduleConfig(Base):
     online_batch_size = IntField(
         value=1, minimum=1, help="the batch size of online dataloader"
     )
+    length_key = StrField(
+        value=None,
+        additions=[None],
+        suggestions=["input_ids"],
+        help="the key to get the length of every instance, if provided, the train data will be grouped by length: the instances in every `bucket_size * train_batch_size` chunk are sorted by length and cut into batches, and the batches are shuffled(if `shuffle` is True), so there is less padding in every batch",
+    )
+    bucket_size = IntField(
+        value=100,
+        minimum=1,
+        help="the number of batches in one sorted chunk, only works when the `length_key` is provided",
+    )
+    max_tokens_per_batch = IntField(
+        value=-1,
+        minimum=-1,
+        help="the max tokens(max_length * batch_size) of one batch, only works when the `length_key` is provided, -1 means use the fixed batch size",
+    )
+    sort_eval_by_length = BoolField(
+        value=False,
+        help="whether to sort the valid/test/predict data by length, only works when the `length_key` is provided. The postprocessor will restore the order by `_index`",
+    )
 
     submodule = SubModule({}, suggestions=["dataset", "data_collate"])
 
@@ -84,79 +105,125 @@ class BasicDatamodule(IBaseDataModule):
             self.config.num_workers = os.cpu_count()
         if "train" in data:
             self.train_data = self.dataset_creator(
-                self.dataset_config, data["train"], rt_config
+                self.dataset_config, data["train"], dict(rt_config, data_type="train")
             )
         if "test" in data:
             self.test_data = self.dataset_creator(
-                self.dataset_config, data["test"], rt_config
+                self.dataset_config, data["test"], dict(rt_config, data_type="test")
             )
         if "valid" in data:
             self.valid_data = self.dataset_creator(
-                self.dataset_config, data["valid"], rt_config
+                self.dataset_config, data["valid"], dict(rt_config, data_type="valid")
             )
         if "predict" in data:
             self.predict_data = self.dataset_creator(
-                self.dataset_config, data["predict"], rt_config
+                self.dataset_config,
+                data["predict"],
+                dict(rt_config, data_type="predict"),
             )
         data_collate_config = config.submodule.data_collate
         self.collate_fn = register.get(
             "data_collate", register_module_name(data_collate_config._module_name)
         )(data_collate_config)
 
+    def _dataloader(
+        self, dataset: DefaultDataset, batch_size: int, shuffle: bool, bucket: bool
+    ) -> DataLoader:
+        """create the dataloader, if `bucket` is True, the batches will be grouped by length
+
+        Args:
+            dataset: the dataset
+            batch_size: the batch size
+            shuffle: whether shuffle the data
+            bucket: whether to group the batches by length
+
+        Returns:
+            the dataloader
+
+        """
+        if not (bucket and self.config.length_key):
+            return DataLoader(
+                dataset,
+                batch_size=batch_size,
+                collate_fn=self.collate_fn,
+                pin_memory=self.config.pin_memory,
+                shuffle=shuffle,
+                num_workers=self.config.num_workers,
+            )
+        batch_sampler = LengthBucketBatchSampler(
+            RandomSampler(dataset) if shuffle else SequentialSampler(dataset),
+            batch_size=batch_size,
+            drop_last=False,
+            lengths=dataset.get_lengths(self.config.length_key),
+            # sort the whole data when do not shuffle
+            bucket_size=self.config.bucket_size if shuffle else -1,
+            max_tokens=self.config.max_tokens_per_batch,
+            shuffle=shuffle,
+        )
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.collate_fn,
+            pin_memory=self.config.pin_memory,
+            num_workers=self.config.num_workers,
+        )
+
     def train_dataloader(self):
         """get the train set dataloader"""
         if not self.train_data:
             return None
-        return DataLoader(
+        return self._dataloader(
             self.train_data,
-            batch_size=self.config.train_batch_size,
-            collate_fn=self.collate_fn,
-            pin_memory=self.config.pin_memory,
+            self.config.train_batch_size,
             shuffle=self.config.shuffle,
-            num_workers=self.config.num_workers,
+            bucket=True,
         )
 
     def predict_dataloader(self):
         """get the predict set dataloader"""
         if not self.predict_data:
             return None
-        return DataLoader(
+        return self._dataloader(
             self.predict_data,
-            batch_size=self.config.predict_batch_size,
-            collate_fn=self.collate_fn,
-            pin_memory=self.config.pin_memory,
+            self.config.predict_batch_size,
             shuffle=False,
-            num_workers=self.config.num_workers,
+            bucket=self.config.sort_eval_by_length,
         )
 
     def val_dataloader(self):
         """get the validation set dataloader"""
         if not self.valid_data:
             return None
-        return DataLoader(
+        return self._dataloader(
             self.valid_data,
-            batch_size=self.config.predict_batch_size,
-            collate_fn=self.collate_fn,
-            pin_memory=self.config.pin_memory,
+            self.config.predict_batch_size,
             shuffle=False,
-            num_workers=self.config.num_workers,
+            bucket=self.config.sort_eval_by_length,
         )
 
     def test_dataloader(self):
         """get the test set dataloader"""
         if not self.test_data:
             return None
-        return DataLoader(
+        return self._dataloader(
             self.test_data,
-            batch_size=self.config.predict_batch_size,
-            collate_fn=self.collate_fn,
-            pin_memory=self.config.pin_memory,
+            self.config.predict_batch_size,
             shuffle=False,
-            num_workers=self.config.num_workers,
+            bucket=self.config.sort_eval_by_length,
         )
 
     def online_dataloader(self, data):
-        """get the online dataloader"""
+        """get the online batches
+
+        NOTE: the online data is always small, so we collate the batches in the current process instead of creating a `DataLoader`(which will spawn the worker processes) for every request
+
+        Args:
+            data: the processed online data
+
+        Returns:
+            the generator of the collated batches
+
+        """
         if not self._online_key_type_pairs:
             self._online_key_type_pairs = self.dataset_creator.real_key_type_pairs(
                 self.dataset_config.key_type_pairs, data
@@ -164,11 +231,13 @@ class BasicDatamodule(IBaseDataModule):
         dataset = self.dataset_creator(
             self.dataset_config, data, self.rt_config, self._online_key_type_pairs
         )
-        return DataLoader(
-            dataset,
-            batch_size=self.config.predict_batch_size,
-            collate_fn=self.collate_fn,
-            pin_memory=self.config.pin_memory,
-            shuffle=False,
-            num_workers=1,
+        batch_size = self.config.predict_batch_size
+        return (
+            self.collate_fn(
+                [
+                    dataset[i]
+                    for i in range(start, min(start + batch_size, len(dataset)))
+                ]
+            )
+            for start in range(0, len(dataset), batch_size)
         )
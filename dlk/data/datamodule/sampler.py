@@ -0,0 +1,155 @@
+# Copyright the author(s) of DLK.
+#
+# This source code is licensed under the Apache license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+from typing import Iterator, List
+
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, DistributedSampler, Sampler
+
+logger = logging.getLogger(__name__)
+
+
+class LengthBucketBatchSampler(BatchSampler):
+    """Group the instances with similar length to one batch, so there is less padding in every batch
+
+    The index stream is cut to chunks of `bucket_size * batch_size` instances, the instances in every chunk are sorted by length and cut into batches.
+    If `max_tokens` > 0, one batch will be cut when `max_length * batch_size` of it will exceed `max_tokens`, otherwise the batch has `batch_size` instances.
+    When `shuffle` is True, the order of the batches will be shuffled.
+
+    When the `sampler` is a `DistributedSampler`(injected by lightning) and `shuffle` is True, the batches are generated on the whole dataset with the same seed on every rank and then sharded by rank, so every rank has the same number of batches even in the `max_tokens` mode.
+    Otherwise the indices are taken from the `sampler` directly(for valid/test/predict, the repeated dataset and the DistributedSampler already give every rank its data).
+    """
+
+    def __init__(
+        self,
+        sampler: Sampler,
+        batch_size: int,
+        drop_last: bool,
+        lengths: np.ndarray,
+        bucket_size: int = 100,
+        max_tokens: int = -1,
+        shuffle: bool = True,
+    ):
+        """
+        Args:
+            sampler: the index sampler
+            batch_size: the batch size, not used when `max_tokens` > 0
+            drop_last: drop the last incomplete batch
+            lengths: the length of every instance in the dataset
+            bucket_size: the number of batches in one sorted chunk, -1 means sort all the instances
+            max_tokens: the max tokens(max_length * batch_size) of one batch, -1 means use the fixed batch size
+            shuffle: whether to shuffle the batches
+
+        """
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.lengths = np.asarray(lengths)
+        self.bucket_size = bucket_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        # the batches generated by `__len__` will be reused by the next `__iter__` of the same epoch
+        self._cached_batches = None
+
+    def _get_indices(self, generator: torch.Generator) -> List[int]:
+        """get the indices of this epoch"""
+        if self.shuffle and isinstance(self.sampler, DistributedSampler):
+            return torch.randperm(len(self.lengths), generator=generator).tolist()
+        return list(self.sampler)
+
+    def _cut_batches(self, indices: List[int]) -> List[List[int]]:
+        """sort the indices by length within every chunk and cut them into batches
+
+        Args:
+            indices: the index stream
+
+        Returns:
+            batches
+
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.bucket_size > 0:
+            chunk_size = self.bucket_size * self.batch_size
+        else:
+            chunk_size = max(len(indices), 1)
+        sorted_indices = []
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start : start + chunk_size]
+            sorted_indices.append(chunk[np.argsort(self.lengths[chunk], kind="stable")])
+        if not sorted_indices:
+            return []
+        sorted_indices = np.concatenate(sorted_indices)
+
+        if self.max_tokens <= 0:
+            batches = [
+                sorted_indices[start : start + self.batch_size].tolist()
+                for start in range(0, len(sorted_indices), self.batch_size)
+            ]
+            if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+                batches.pop()
+            return batches
+
+        batches = []
+        batch = []
+        max_length = 0
+        for index, length in zip(
+            sorted_indices.tolist(), self.lengths[sorted_indices].tolist()
+        ):
+            max_length = max(max_length, length)
+            if batch and max_length * (len(batch) + 1) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                max_length = length
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _make_batches(self) -> List[List[int]]:
+        """make the batches of this epoch for this rank"""
+        num_replicas, rank = 1, 0
+        generator = None
+        if isinstance(self.sampler, DistributedSampler):
+            generator = torch.Generator()
+            # the same seed on every rank
+            generator.manual_seed(self.sampler.seed + self.sampler.epoch)
+            if self.shuffle:
+                num_replicas, rank = self.sampler.num_replicas, self.sampler.rank
+
+        batches = self._cut_batches(self._get_indices(generator))
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=generator).tolist()
+            batches = [batches[i] for i in order]
+        if num_replicas > 1 and batches:
+            # every rank must have the same number of batches
+            remainder = len(batches) % num_replicas
+            if remainder and self.drop_last:
+                batches = batches[: len(batches) - remainder]
+            elif remainder:
+                batches = batches + batches[: num_replicas - remainder]
+            batches = batches[rank::num_replicas]
+        return batches
+
+    def _epoch(self):
+        """the epoch of the DistributedSampler, for the other samplers return None"""
+        return getattr(self.sampler, "epoch", None)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if (
+            self._cached_batches is not None
+            and self._cached_batches[0] == self._epoch()
+        ):
+            batches = self._cached_batches[1]
+        else:
+            batches = self._make_batches()
+        self._cached_batches = None
+        yield from batches
+
+    def __len__(self) -> int:
+        if self._cached_batches is None or self._cached_batches[0] != self._epoch():
+            self._cached_batches = (self._epoch(), self._make_batches())
+        return len(self._cached_batches[1])
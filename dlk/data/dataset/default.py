@@ -7,6 +7,7 @@ import copy
 import os
 from typing import Any, Dict
 
+import numpy as np
 import pandas as pd
 import torch
 from intc import (
@@ -69,6 +70,8 @@ class DefaultDataset(Dataset):
             self.key_type_pairs = key_type_pairs
         else:
             self.key_type_pairs = self.real_key_type_pairs(config.key_type_pairs, data)
+        # NOTE: get the column values directly instead of `data.iloc[idx]`, so we will not construct a pd.Series for every instance
+        self.columns = {key: data[key].values for key in self.key_type_pairs}
 
     @staticmethod
     def real_key_type_pairs(key_type_pairs: Dict, data: pd.DataFrame):
@@ -92,6 +95,22 @@ class DefaultDataset(Dataset):
             copy_key_type_pairs.pop(key)
         return copy_key_type_pairs
 
+    def get_lengths(self, key: str) -> np.ndarray:
+        """get the length of every instance in this dataset
+
+        Args:
+            key: the length of `data[key]` is the length of the instance
+
+        Returns:
+            the lengths, the size is the same as the dataset
+
+        """
+        column = self.columns[key] if key in self.columns else self.data[key].values
+        lengths = np.fromiter(
+            (len(cell) for cell in column), dtype=np.int64, count=len(column)
+        )
+        return np.repeat(lengths, self.repeat_valid)
+
     def __len__(self):
         """return the dataset size"""
         return len(self.data) * self.repeat_valid
@@ -110,7 +129,7 @@ class DefaultDataset(Dataset):
         one_ins = {}
         for key, key_type in self.key_type_pairs.items():
             one_ins[key] = torch.tensor(
-                self.data.iloc[idx][key], dtype=self.type_map[key_type]
+                self.columns[key][idx], dtype=self.type_map[key_type]
             )
         one_ins["_index"] = torch.tensor(idx, dtype=torch.long)
         return one_ins
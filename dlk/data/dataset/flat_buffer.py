@@ -0,0 +1,189 @@
+# Copyright the author(s) of DLK.
+#
+# This source code is licensed under the Apache license found in the
+# LICENSE file in the root directory of this source tree.
+
+import builtins
+import logging
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from intc import (
+    MISSING,
+    AnyField,
+    Base,
+    BoolField,
+    DictField,
+    FloatField,
+    IntField,
+    ListField,
+    NestField,
+    StrField,
+    SubModule,
+    cregister,
+)
+
+from dlk.data.dataset.default import DefaultDataset, DefaultDatasetConfig
+from dlk.utils.register import register
+
+logger = logging.getLogger(__name__)
+
+
+@cregister("dataset", "flat_buffer")
+class FlatBufferDatasetConfig(DefaultDatasetConfig):
+    """the dataset store every key as one flat buffer"""
+
+    mmap_dir = StrField(
+        value=None,
+        additions=[None],
+        help="if set, the buffers will be dumped to `mmap_dir/<data_type>` and memory-mapped from disk, otherwise the buffers are kept in memory",
+    )
+
+
+@register("dataset", "flat_buffer")
+class FlatBufferDataset(DefaultDataset):
+    """Store every key in `key_type_pairs` as one contiguous numpy buffer with the offsets and the shape of every instance
+
+    The DataFrame will not be referenced by the dataset, so the DataLoader workers will not copy-on-write the python objects of the DataFrame.
+    The returned tensors share the memory with the buffers, you should not modify them in place.
+    """
+
+    def __init__(
+        self,
+        config: FlatBufferDatasetConfig,
+        data: pd.DataFrame,
+        rt_config: Dict,
+        key_type_pairs: Dict = None,
+    ):
+        self.config = config
+
+        self.repeat_valid = 1
+        if self.config.repeat_for_valid and rt_config.get("world_size", 1) > 1:
+            self.repeat_valid = rt_config.get("world_size", 1)
+        self.type_map = {
+            "float": np.float32,
+            "int": np.int32,
+            "bool": np.bool_,
+            "long": np.int64,
+        }
+        if key_type_pairs is not None:
+            self.key_type_pairs = key_type_pairs
+        else:
+            self.key_type_pairs = self.real_key_type_pairs(config.key_type_pairs, data)
+        self.num = len(data)
+
+        self.buffers: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for key, key_type in self.key_type_pairs.items():
+            self.buffers[key] = self.flatten(data[key], self.type_map[key_type])
+
+        data_type = rt_config.get("data_type", None)
+        if self.config.mmap_dir and data_type:
+            self.buffers = self.mmap_buffers(
+                self.buffers, os.path.join(self.config.mmap_dir, data_type)
+            )
+
+    @staticmethod
+    def flatten(
+        column: pd.Series, dtype: np.dtype
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """flatten the column to one buffer
+
+        Args:
+            column: the column of the data, every cell could be a scalar or a (nested) list/array
+            dtype: the numpy dtype of the buffer
+
+        Returns:
+            values, offsets, shapes. The `i`th instance is `values[offsets[i]: offsets[i+1]].reshape(shapes[i])`
+
+        """
+        arrays = [np.asarray(cell, dtype=dtype) for cell in column]
+        ndims = {array.ndim for array in arrays}
+        if len(ndims) > 1:
+            raise ValueError(
+                f"The column '{column.name}' has instances with different dims {ndims}, can not be flattened."
+            )
+        ndim = ndims.pop() if ndims else 1
+        shapes = np.array([array.shape for array in arrays], dtype=np.int64).reshape(
+            len(arrays), ndim
+        )
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([array.size for array in arrays], out=offsets[1:])
+        if arrays:
+            values = np.concatenate([array.reshape(-1) for array in arrays])
+        else:
+            values = np.empty(0, dtype=dtype)
+        return values, offsets, shapes
+
+    @staticmethod
+    def mmap_buffers(
+        buffers: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]], save_dir: str
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """dump the buffers to save_dir and reload them as memory-mapped arrays
+
+        Args:
+            buffers: the key -> (values, offsets, shapes) buffers
+            save_dir: the dir to dump the buffers
+
+        Returns:
+            the memory-mapped buffers
+
+        """
+        os.makedirs(save_dir, exist_ok=True)
+        mmaped = {}
+        for key, arrays in buffers.items():
+            mmaped_arrays = []
+            for name, array in zip(["values", "offsets", "shapes"], arrays):
+                path = os.path.join(save_dir, f"{key}.{name}.npy")
+                # write to a temp file first, the other processes(DDP) may be reading the same path
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with builtins.open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+                # copy-on-write mode, the pages are shared and the arrays are writable for torch.from_numpy
+                mmaped_arrays.append(np.load(path, mmap_mode="c"))
+            mmaped[key] = tuple(mmaped_arrays)
+        logger.info(f"Memory-mapped the dataset buffers at {save_dir}")
+        return mmaped
+
+    def get_lengths(self, key: str) -> np.ndarray:
+        """get the length of every instance in this dataset
+
+        Args:
+            key: the first dim of `key` is the length of the instance
+
+        Returns:
+            the lengths, the size is the same as the dataset
+
+        """
+        shapes = self.buffers[key][2]
+        if shapes.shape[1] == 0:
+            raise ValueError(f"The instances of '{key}' are scalars, have no length.")
+        return np.repeat(np.asarray(shapes[:, 0]), self.repeat_valid)
+
+    def __len__(self):
+        """return the dataset size"""
+        return self.num * self.repeat_valid
+
+    def __getitem__(self, idx: int):
+        """return one instance by index
+
+        Args:
+            idx: the index of data
+
+        Returns:
+            the slices of the buffers(as tensor) and '_index'
+
+        """
+        idx = idx // self.repeat_valid
+        one_ins = {}
+        for key, (values, offsets, shapes) in self.buffers.items():
+            one_ins[key] = torch.from_numpy(
+                np.asarray(values[offsets[idx] : offsets[idx + 1]]).reshape(
+                    tuple(shapes[idx])
+                )
+            )
+        one_ins["_index"] = torch.tensor(idx, dtype=torch.long)
+        return one_ins
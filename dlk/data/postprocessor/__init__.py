@@ -8,8 +8,9 @@ import importlib
 import json
 import logging
 import os
-from typing import Callable, Dict, List, Type, TypeVar, Union
+from typing import Callable, Dict, List, Tuple, Type, TypeVar, Union
 
+import numpy as np
 import pandas as pd
 import pyarrow.parquet as pq
 import torch
@@ -33,6 +34,13 @@ from dlk.utils.import_module import import_module_dir
 logger = logging.getLogger(__name__)
 
 
+def _json_default(obj):
+    """convert the numpy values(like the `offsets` loaded from the parquet processed data) in the predicts to python"""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 @dataclass
 class BasePostProcessorConfig(Base):
     """the base postprocessor"""
@@ -109,6 +117,85 @@ class BasePostProcessor(object):
             result[key] = data
         return result
 
+    @staticmethod
+    def ignore_label_ids(vocab) -> List[int]:
+        """the label ids which should not be a predict, like the pad and unknown label
+
+        Args:
+            vocab: the label vocab
+
+        Returns:
+            the ignored ids
+
+        """
+        return [
+            idx
+            for idx, word in vocab.idx2word.items()
+            if not word or word in {vocab.pad, vocab.unknown}
+        ]
+
+    @staticmethod
+    def gather_span_predicts(
+        span_logits: torch.Tensor,
+        word_ids: List,
+        ignore_ids: List[int],
+        upper: bool = True,
+    ) -> Tuple[List[int], List[int], List[int]]:
+        """get the predicted spans from the span logits on the logits device, so only the predicted spans are processed by python
+
+        Args:
+            span_logits: the span logits, the shape is (>=token_len, >=token_len, label_num)
+            word_ids: the word ids of the tokens, the word id of a special token is None
+            ignore_ids: the predicts of these label ids are ignored
+            upper: only gather the spans whose start <= end
+
+        Returns:
+            the starts, ends and label ids of the predicted spans, sorted by (start, end)
+
+        """
+        token_len = len(word_ids)
+        label_ids = span_logits[:token_len, :token_len].argmax(-1)
+        valid = torch.tensor(
+            [word_id is not None for word_id in word_ids],
+            dtype=torch.bool,
+            device=label_ids.device,
+        )
+        mask = valid[:, None] & valid[None, :]
+        if upper:
+            mask = torch.triu(mask)
+        if ignore_ids:
+            mask &= ~torch.isin(
+                label_ids, torch.tensor(ignore_ids, device=label_ids.device)
+            )
+        starts, ends = mask.nonzero(as_tuple=True)
+        return starts.tolist(), ends.tolist(), label_ids[starts, ends].tolist()
+
+    def restore_order(self, predicts: List, list_batch_outputs: List[Dict]) -> List:
+        """restore the order of the predicts by the `_index` of the batches, the batches may be sorted by length
+
+        Args:
+            predicts: list of predicts, one predict for one instance
+            list_batch_outputs: a list of outputs
+
+        Returns:
+            the predicts in the order of the origin data, if the predicts can not map to the instances, return the predicts directly
+
+        """
+        indexes = []
+        for outputs in list_batch_outputs:
+            if "_index" not in outputs:
+                return predicts
+            index = outputs["_index"]
+            if torch.is_tensor(index):
+                index = index.detach().reshape(-1).tolist()
+            indexes.extend(int(i) for i in index)
+        if not isinstance(predicts, list) or len(indexes) != len(predicts):
+            return predicts
+        if all(indexes[i] <= indexes[i + 1] for i in range(len(indexes) - 1)):
+            return predicts
+        order = sorted(range(len(indexes)), key=indexes.__getitem__)
+        return [predicts[i] for i in order]
+
     def average_loss(self, list_batch_outputs: List[Dict]) -> Dict[str, float]:
         """average all the loss of the list_batches
 
@@ -254,7 +341,9 @@ class BasePostProcessor(object):
                 save_file = os.path.join(save_path, "predict.json")
             logger.info(f"Save the {stage} predict data at {save_file}")
             with open(save_file, "w") as f:
-                json.dump(predicts, f, indent=4, ensure_ascii=False)
+                json.dump(
+                    predicts, f, indent=4, ensure_ascii=False, default=_json_default
+                )
 
     @property
     def without_ground_truth_stage(self) -> set:
@@ -300,6 +389,7 @@ class BasePostProcessor(object):
             for name in average_loss:
                 log_info[f"{self.loss_name_map(stage)}_{name}"] = average_loss[name]
         predicts = self.do_predict(stage, list_batch_outputs, origin_data, rt_config)
+        predicts = self.restore_order(predicts, list_batch_outputs)
         if stage not in self.without_ground_truth_stage:
             log_info.update(
                 self.do_calc_metrics(
@@ -122,6 +122,7 @@ class SeqLabPostProcessor(BasePostProcessor):
         with open(self.config.tokenizer_path, "r", encoding="utf-8") as f:
             tokenizer_str = json.dumps(json.load(f))
         self.tokenizer = Tokenizer.from_str(tokenizer_str)
+        self.bio_table = self.build_bio_table()
 
     def do_predict(
         self,
@@ -358,6 +359,97 @@ class SeqLabPostProcessor(BasePostProcessor):
         end = offset_mapping[sub_tokens_index[-1]][1]
         return {"start": start, "end": end, "labels": [label]}
 
+    def build_bio_table(self) -> Tuple[int, np.ndarray, np.ndarray, List[str]]:
+        """the label id indexed table for the bio decode
+
+        Returns:
+            the min label id, the label types(-1 for the missing id, 0 for the ignore label, 1 for the invalid label, 2 for the "B" label, 3 for the others), the tail ids and the tail names
+
+        """
+        ids = list(self.label_vocab.idx2word.keys())
+        min_id = min(ids)
+        label_types = np.full(max(ids) - min_id + 1, -1, dtype=np.int64)
+        tail_ids = np.full(max(ids) - min_id + 1, -1, dtype=np.int64)
+        tails = []
+        tail2id = {}
+        for label_id, label in self.label_vocab.idx2word.items():
+            if label in self.config.ignore_labels:
+                label_types[label_id - min_id] = 0
+                continue
+            if len(label.split("-")) != 2:
+                label_types[label_id - min_id] = 1
+                continue
+            label_types[label_id - min_id] = 2 if label[0] == "B" else 3
+            tail = label.split("-")[-1]
+            if tail not in tail2id:
+                tail2id[tail] = len(tails)
+                tails.append(tail)
+            tail_ids[label_id - min_id] = tail2id[tail]
+        return min_id, label_types, tail_ids, tails
+
+    def decode_bio(
+        self,
+        predict: Union[torch.LongTensor, np.ndarray, List],
+        offset_mapping: List,
+        word_ids: List,
+    ) -> List[Dict]:
+        """decode the bio label ids to the entities
+
+        A new entity is started by a "B" label or a label whose tail is different from the previous one, and ended by the ignore label(like "O") or a new entity. All the tokens are checked together by numpy, only the found entities are gathered in python.
+
+        Args:
+            predict: the predict label ids of the tokens
+            offset_mapping: every token offset in text
+            word_ids: every token in the index of words
+
+        Returns:
+            predict_entities_info
+
+        """
+        if isinstance(predict, torch.Tensor):
+            predict = predict.detach().cpu().numpy()
+        predict = np.asarray(predict, dtype=np.int64)[: len(offset_mapping)]
+        # the added token like [CLS]/<s>/.. is skipped
+        positions = np.fromiter(
+            (
+                i
+                for i, offset in enumerate(offset_mapping[: len(predict)])
+                if offset != (0, 0)
+            ),
+            dtype=np.int64,
+        )
+        if not len(positions):
+            return []
+        min_id, label_types, tail_ids, tails = self.bio_table
+        table_index = predict[positions] - min_id
+        unknown = (table_index < 0) | (table_index >= len(label_types))
+        if unknown.any():
+            # raise the same error as the vocab
+            self.label_vocab[int(predict[positions][unknown][0])]
+        types = label_types[table_index]
+        if (types == -1).any():
+            self.label_vocab[int(predict[positions][types == -1][0])]
+        assert not (types == 1).any(), "the label must be like 'B-xx' or 'I-xx'"
+
+        is_entity = types >= 2
+        tail = np.where(is_entity, tail_ids[table_index], -1)
+        pre_tail = np.concatenate([[-1], tail[:-1]])
+        starts = is_entity & ((types == 2) | (tail != pre_tail))
+        # the entity is ended if the next token is not in the same entity
+        continued = is_entity & ~starts
+        ends = is_entity & ~np.concatenate([continued[1:], [False]])
+
+        predict_entities_info = []
+        for start, end, tail_id in zip(
+            positions[starts], positions[ends], tail[starts]
+        ):
+            entity_info = self.get_entity_info(
+                [start, end], offset_mapping, word_ids, tails[tail_id]
+            )
+            if entity_info:
+                predict_entities_info.append(entity_info)
+        return predict_entities_info
+
     def _process4predict(
         self, predict: torch.LongTensor, index: int, origin_data: pd.DataFrame
     ) -> Dict:
@@ -391,36 +483,9 @@ class SeqLabPostProcessor(BasePostProcessor):
         offset_mapping = origin_ins[self.config.origin_input_map.offsets][
             :rel_token_len
         ]
-        predict = list(predict[:rel_token_len])
-        predict_entities_info = []
-        pre_label = ""
-        sub_tokens_index = []
-        for i, label_id in enumerate(predict):
-            if offset_mapping[i] == (0, 0):  # added token like [CLS]/<s>/..
-                continue
-            label = self.label_vocab[label_id]
-            if (
-                label in self.config.ignore_labels
-                or (label[0] == "B")
-                or (label.split("-")[-1] != pre_label)
-            ):  # label == "O" or label=='B' or label.tail != previor_label
-                entity_info = self.get_entity_info(
-                    sub_tokens_index, offset_mapping, word_ids, pre_label
-                )
-                if entity_info:
-                    predict_entities_info.append(entity_info)
-                pre_label = ""
-                sub_tokens_index = []
-            if label not in self.config.ignore_labels:
-                assert len(label.split("-")) == 2
-                pre_label = label.split("-")[-1]
-                sub_tokens_index.append(i)
-        entity_info = self.get_entity_info(
-            sub_tokens_index, offset_mapping, word_ids, pre_label
+        one_ins["predict_entities_info"] = self.decode_bio(
+            predict[:rel_token_len], offset_mapping, word_ids
         )
-        if entity_info:
-            predict_entities_info.append(entity_info)
-        one_ins["predict_entities_info"] = predict_entities_info
         return one_ins
 
     def crf_predict(
@@ -459,6 +524,8 @@ class SeqLabPostProcessor(BasePostProcessor):
         predicts = []
         for outputs in list_batch_outputs:
             batch_predict = outputs[self.config.input_map.predict_seq_label]
+            if isinstance(batch_predict, torch.Tensor):
+                batch_predict = batch_predict.detach().cpu().numpy()
             # batch_special_tokens_mask = outputs[self.config.special_tokens_mask]
 
             indexes = list(outputs[self.config.input_map.index])
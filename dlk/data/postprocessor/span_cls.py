@@ -96,6 +96,7 @@ class SpanClsPostProcessor(BasePostProcessor):
         with open(self.config.tokenizer_path, "r", encoding="utf-8") as f:
             tokenizer_str = json.dumps(json.load(f))
         self.tokenizer = Tokenizer.from_str(tokenizer_str)
+        self.ignore_ids = self.ignore_label_ids(self.label_vocab)
 
     def _process4predict(
         self, predict_logits: torch.FloatTensor, index: int, origin_data: pd.DataFrame
@@ -154,24 +155,15 @@ class SpanClsPostProcessor(BasePostProcessor):
         ]
 
         predict_entities_info = []
-        predict_label_ids = predict_logits.argmax(-1).cpu().numpy()
-        for i in range(rel_token_len):
-            for j in range(i, rel_token_len):
-                if word_ids[i] is None or word_ids[j] is None:
-                    continue
-                predict_label_id = predict_label_ids[i][j]
-                predict_label = self.label_vocab[predict_label_id]
-                if (
-                    predict_label == self.label_vocab.pad
-                    or predict_label == self.label_vocab.unknown
-                ):
-                    continue
-                else:
-                    entity_info = _get_entity_info(
-                        [i, j], offset_mapping, word_ids, predict_label
-                    )
-                    if entity_info:
-                        predict_entities_info.append(entity_info)
+        starts, ends, predict_label_ids = self.gather_span_predicts(
+            predict_logits, word_ids, self.ignore_ids
+        )
+        for i, j, predict_label_id in zip(starts, ends, predict_label_ids):
+            entity_info = _get_entity_info(
+                [i, j], offset_mapping, word_ids, self.label_vocab[predict_label_id]
+            )
+            if entity_info:
+                predict_entities_info.append(entity_info)
         one_ins["predict_entities_info"] = predict_entities_info
         return one_ins
 
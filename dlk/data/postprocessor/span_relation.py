@@ -122,6 +122,8 @@ class SpanRelationPostProcessor(BasePostProcessor):
         with open(self.config.tokenizer_path, "r", encoding="utf-8") as f:
             tokenizer_str = json.dumps(json.load(f))
         self.tokenizer = Tokenizer.from_str(tokenizer_str)
+        self.entity_ignore_ids = self.ignore_label_ids(self.entity_label_vocab)
+        self.relation_ignore_ids = self.ignore_label_ids(self.relation_label_vocab)
 
     def do_predict(
         self,
@@ -249,37 +251,34 @@ class SpanRelationPostProcessor(BasePostProcessor):
 
         predict_entities_id_info_map = {}
         entities_in_relations_id = set()
-        predict_entity_ids = entity_logits.argmax(-1).cpu().numpy()
 
         # gather all predicted entities
         entity_set_d = (
             {}
         )  # set_d, set_e, set_t defined in https://arxiv.org/pdf/2010.13415.pdf Algorithm 1
         entity_cnt = 0
-        for i in range(rel_token_len):
-            for j in range(i, rel_token_len):
-                if word_ids[i] is None or word_ids[j] is None:
-                    continue
-                predict_entity_id = predict_entity_ids[i][j]
-                predict_entity = self.entity_label_vocab[predict_entity_id]
-                if predict_entity in {
-                    self.entity_label_vocab.pad,
-                    self.entity_label_vocab.unknown,
-                }:
-                    continue
-                else:
-                    entity_info = _get_entity_info(
-                        [i, j], offset_mapping, word_ids, predict_entity
-                    )
-                    if entity_info:
-                        entity_id = str(uuid.uuid1())
-                        predict_entities_id_info_map[entity_id] = entity_info
-                        entity_set_d[i] = entity_set_d.get(i, [])
-                        entity_set_d[i].append((i, j, entity_id))
-                        entity_cnt += 1
-            if entity_cnt > rel_token_len:
-                # HACK: too many predict, maybe wrong
+        stop_row = None
+        starts, ends, predict_entity_ids = self.gather_span_predicts(
+            entity_logits, word_ids, self.entity_ignore_ids
+        )
+        for i, j, predict_entity_id in zip(starts, ends, predict_entity_ids):
+            if stop_row is not None and i > stop_row:
                 break
+            entity_info = _get_entity_info(
+                [i, j],
+                offset_mapping,
+                word_ids,
+                self.entity_label_vocab[predict_entity_id],
+            )
+            if entity_info:
+                entity_id = str(uuid.uuid1())
+                predict_entities_id_info_map[entity_id] = entity_info
+                entity_set_d[i] = entity_set_d.get(i, [])
+                entity_set_d[i].append((i, j, entity_id))
+                entity_cnt += 1
+            if stop_row is None and entity_cnt > rel_token_len:
+                # HACK: too many predict, maybe wrong, stop after this row
+                stop_row = i
 
         # all predicted relations entity tail pair
         entity_tail_pair_set_e = (
@@ -295,47 +294,47 @@ class SpanRelationPostProcessor(BasePostProcessor):
         )  # for each element (first_entity_info, second_entity_info, relation_idx, head_relation_label_id)
         candidate_cnt = 0
         for relation_idx in range(self.config.relation_groups):
-            head_to_head_logits = relation_logits[relation_idx * 2]
-            tail_to_tail_logits = relation_logits[relation_idx * 2 + 1]
-            head_to_head_ids = head_to_head_logits.argmax(-1).cpu().numpy()
-            tail_to_tail_ids = tail_to_tail_logits.argmax(-1).cpu().numpy()
-            for i in range(rel_token_len):
-                if candidate_cnt > 2 * rel_token_len:
-                    # HACK: too many predict, maybe wrong
+            if candidate_cnt > 2 * rel_token_len:
+                # HACK: too many predict, maybe wrong
+                break
+            head_starts, head_ends, predict_head_ids = self.gather_span_predicts(
+                relation_logits[relation_idx * 2],
+                word_ids,
+                self.relation_ignore_ids,
+                upper=self.config.sym,
+            )
+            # the rows after the stop row are dropped
+            stop_row = rel_token_len
+            for i, j, predict_head_id in zip(head_starts, head_ends, predict_head_ids):
+                if i >= stop_row:
                     break
-                for j in range(i if self.config.sym else 0, rel_token_len):
-                    if word_ids[i] is None or word_ids[j] is None:
-                        continue
-                    predict_tail_id = tail_to_tail_ids[i][j]
-                    predict_tail_relation = self.config.relation_label_vocab[
-                        predict_tail_id
-                    ]
-                    if predict_tail_relation not in {
-                        self.relation_label_vocab.pad,
-                        self.relation_label_vocab.unknown,
-                    }:
-                        entity_tail_pair_set_e.add((i, j, relation_idx))
-                        entity_tail_pair_set_e_with_relation_id.add(
-                            (i, j, relation_idx, predict_tail_id)
+                for first_entity in entity_set_d.get(i, []):
+                    for second_entity in entity_set_d.get(j, []):
+                        candidate_relation_set_c.add(
+                            (
+                                first_entity,
+                                second_entity,
+                                relation_idx,
+                                predict_head_id,
+                            )
                         )
-
-                    predict_head_id = head_to_head_ids[i][j]
-                    predict_head_relation = self.relation_label_vocab[predict_head_id]
-                    if predict_head_relation not in {
-                        self.relation_label_vocab.pad,
-                        self.relation_label_vocab.unknown,
-                    }:
-                        for first_entity in entity_set_d.get(i, []):
-                            for second_entity in entity_set_d.get(j, []):
-                                candidate_relation_set_c.add(
-                                    (
-                                        first_entity,
-                                        second_entity,
-                                        relation_idx,
-                                        predict_head_id,
-                                    )
-                                )
-                                candidate_cnt += 1
+                        candidate_cnt += 1
+                if stop_row == rel_token_len and candidate_cnt > 2 * rel_token_len:
+                    # HACK: too many predict, maybe wrong, stop after this row
+                    stop_row = i + 1
+            tail_starts, tail_ends, predict_tail_ids = self.gather_span_predicts(
+                relation_logits[relation_idx * 2 + 1],
+                word_ids,
+                self.relation_ignore_ids,
+                upper=self.config.sym,
+            )
+            for i, j, predict_tail_id in zip(tail_starts, tail_ends, predict_tail_ids):
+                if i >= stop_row:
+                    break
+                entity_tail_pair_set_e.add((i, j, relation_idx))
+                entity_tail_pair_set_e_with_relation_id.add(
+                    (i, j, relation_idx, predict_tail_id)
+                )
         predict_relations_info = []
         for candidate_relation in candidate_relation_set_c:
             (
@@ -91,28 +91,6 @@ class TxtClsPostProcessor(BasePostProcessor):
         )
         self.top_k = config.top_k if config.top_k > 0 else self.label_vocab.word_num
 
-    def _get_origin_data(self, one_origin: pd.Series) -> Dict:
-        """
-
-        Args:
-            one_origin: the original data
-
-        Returns:
-            the gather origin data
-
-        """
-        origin = {}
-        if self.config.data_type == "single":
-            sentence = one_origin[self.config.origin_input_map.sentence]
-            origin["sentence"] = sentence
-        else:
-            sentence_a = one_origin[self.config.origin_input_map.sentence_a]
-            origin["sentence_a"] = sentence_a
-            sentence_b = one_origin[self.config.origin_input_map.sentence_b]
-            origin["sentence_b"] = sentence_b
-        origin["uuid"] = one_origin[self.config.origin_input_map.uuid]
-        return origin
-
     def do_predict(
         self,
         stage: str,
@@ -139,43 +117,102 @@ class TxtClsPostProcessor(BasePostProcessor):
             all predicts
 
         """
+        if not list_batch_outputs:
+            return []
+        # NOTE: run the softmax and topk once on the logits of all the batches
+        logits = torch.cat(
+            [
+                outputs[self.config.input_map.logits].detach()
+                for outputs in list_batch_outputs
+            ]
+        )
+        assert len(logits.shape) == 2
+        label_values, label_indexes = torch.topk(
+            torch.softmax(logits, -1), self.top_k, dim=-1
+        )
+        label_values = label_values.cpu().tolist()
+        label_names = [
+            [self.label_vocab.get_word(label_index) for label_index in one_indexes]
+            for one_indexes in label_indexes.cpu().tolist()
+        ]
+        indexes = []
+        for outputs in list_batch_outputs:
+            index = outputs[self.config.input_map.index]
+            if torch.is_tensor(index):
+                index = index.detach().reshape(-1).cpu().tolist()
+            indexes.extend(int(i) for i in index)
+        origins = self._gather_origin_data(origin_data, indexes)
+
         results = []
+        cur = 0
         for outputs in list_batch_outputs:
-            logits = outputs[self.config.input_map.logits].detach()
-            assert len(logits.shape) == 2
-            # predict_indexes = list(torch.argmax(logits, 1))
-            indexes = list(outputs[self.config.input_map.index])
-
-            if self.config.input_map.label_ids in outputs:
-                label_ids = outputs[self.config.input_map.label_ids]
-            else:
-                label_ids = [None] * len(indexes)
-            for i, (one_logits, index, label_id) in enumerate(
-                zip(logits, indexes, label_ids)
-            ):
-                one_ins = self._get_origin_data(origin_data.iloc[int(index)])
-                one_logits = torch.softmax(one_logits, -1)
-                label_values, label_indeies = torch.topk(one_logits, self.top_k, dim=-1)
-                predict = {}
-                for i, (label_value, label_index) in enumerate(
-                    zip(label_values, label_indeies)
-                ):
-                    label_name = self.label_vocab.get_word(int(label_index))
-                    predict[i] = [label_name, float(label_value)]
-                ground_truth = []
-                if label_id is not None and label_id.shape:
-                    for one_label_id in label_id:
-                        ground_truth.append(self.label_vocab.get_word(one_label_id))
-                elif label_id:
-                    ground_truth.append(self.label_vocab.get_word(label_id))
-                one_ins["labels"] = ground_truth
-                one_ins["predicts"] = predict
+            batch_size = len(outputs[self.config.input_map.logits])
+            for i in range(batch_size):
+                one_ins = origins[cur]
+                one_ins["labels"] = self._ground_truth(outputs, i)
+                one_ins["predicts"] = {
+                    k: [label_name, label_value]
+                    for k, (label_name, label_value) in enumerate(
+                        zip(label_names[cur], label_values[cur])
+                    )
+                }
                 one_ins["predict_extend_return"] = self.gather_predict_extend_data(
                     outputs, i, self.config.predict_extend_return
                 )
                 results.append(one_ins)
+                cur += 1
         return results
 
+    def _gather_origin_data(
+        self, origin_data: pd.DataFrame, indexes: List[int]
+    ) -> List[Dict]:
+        """gather the origin data(the sentence(s) and the uuid) of all the indexes at once
+
+        Args:
+            origin_data: the origin data
+            indexes: the indexes of the instances
+
+        Returns:
+            the gather origin data of every index
+
+        """
+        rows = origin_data.iloc[indexes]
+        if self.config.data_type == "single":
+            columns = {"sentence": rows[self.config.origin_input_map.sentence]}
+        else:
+            columns = {
+                "sentence_a": rows[self.config.origin_input_map.sentence_a],
+                "sentence_b": rows[self.config.origin_input_map.sentence_b],
+            }
+        columns["uuid"] = rows[self.config.origin_input_map.uuid]
+        names = list(columns)
+        return [
+            dict(zip(names, values))
+            for values in zip(*(columns[name].tolist() for name in names))
+        ]
+
+    def _ground_truth(self, outputs: Dict, i: int) -> List[str]:
+        """get the ground truth label names of the `i`th instance in the batch
+
+        Args:
+            outputs: the outputs of the batch
+            i: the index of the instance in the batch
+
+        Returns:
+            the label names
+
+        """
+        if self.config.input_map.label_ids not in outputs:
+            return []
+        label_id = outputs[self.config.input_map.label_ids][i]
+        if torch.is_tensor(label_id):
+            label_id = label_id.tolist()
+        if label_id is None:
+            return []
+        if not isinstance(label_id, list):
+            label_id = [label_id]
+        return [self.label_vocab.get_word(one_label_id) for one_label_id in label_id]
+
     def do_calc_metrics(
         self,
         predicts: List,
@@ -205,16 +242,38 @@ class TxtClsPostProcessor(BasePostProcessor):
             the named scores, acc
 
         """
-        right_num = 0
-        for one_ins in predicts:
-            labels = one_ins["labels"]
+        if self.config.input_map.label_ids in list_batch_outputs[0]:
+            # NOTE: compare the top 1 predict with the label ids directly
+            logits = torch.cat(
+                [
+                    outputs[self.config.input_map.logits].detach()
+                    for outputs in list_batch_outputs
+                ]
+            )
+            label_ids = torch.cat(
+                [
+                    torch.as_tensor(outputs[self.config.input_map.label_ids])
+                    .detach()
+                    .reshape(len(outputs[self.config.input_map.logits]), -1)
+                    .to(logits.device)
+                    for outputs in list_batch_outputs
+                ]
+            )
             assert (
-                len(labels) == 1
+                label_ids.shape[1] == 1
             ), "We currently is not support multi label in classification postprocess"
-            label = labels[0]
-            one_predicts = one_ins["predicts"]
-            predict_label, predict_value = one_predicts[0]  # the first predict
-            if label == predict_label:
-                right_num += 1
+            right_num = int((logits.argmax(-1) == label_ids[:, 0]).sum())
+        else:
+            right_num = 0
+            for one_ins in predicts:
+                labels = one_ins["labels"]
+                assert (
+                    len(labels) == 1
+                ), "We currently is not support multi label in classification postprocess"
+                label = labels[0]
+                one_predicts = one_ins["predicts"]
+                predict_label, predict_value = one_predicts[0]  # the first predict
+                if label == predict_label:
+                    right_num += 1
         real_name = self.loss_name_map(stage)
         return {f"{real_name}_acc": right_num / len(predicts)}
@@ -0,0 +1,424 @@
+# Copyright the author(s) of DLK.
+#
+# This source code is licensed under the Apache license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Save and load the processed data shards
+
+The processed data of one data type(train/valid/test/predict) is saved to `processed_data_dir/<type>/` as several shards, and a `manifest.json` records the shards in order:
+    >>> {
+    >>>     "shards": [
+    >>>         {"path": "0.pkl", "part": 0, "rows": 1024, "format": "pickle"},
+    >>>         {"path": "1.parquet", "part": 1, "rows": 512, "format": "parquet"},
+    >>>     ]
+    >>> }
+If there is no manifest(the data is processed by the old version), we will fallback to load the `0.pkl`.
+
+The `parquet` format stores the columns natively when it is possible:
+    >>> the flat numeric list columns(like `input_ids`) as arrow `list<int32>`(or list<int64>/list<double>/list<bool>), the `None` in the integer lists(like `word_ids`) is stored as null
+    >>> the 2-D numeric columns with the same width(like `offsets`) as `list<fixed_size_list<int32, width>>`
+    >>> the other 2-D numeric columns(like the label matrices) as a flat `list<int32>` and a `list<int32>` shape column
+    >>> the string columns as dictionary encoded strings
+and pickles the other complex columns(like `entities_info`) cell by cell to a binary column, so these columns could be restored exactly.
+The numeric list columns are loaded as numpy arrays(the 2-D columns as 2-D arrays, like the `offsets` from the `pack_to_numpy` tokenizer), the integer lists with null are loaded as python lists with `None`.
+"""
+
+import json
+import logging
+import os
+import pickle as pkl
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dlk.utils.io import open
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+PICKLED_COLUMNS_KEY = b"dlk_pickled_columns"
+MATRIX_COLUMNS_KEY = b"dlk_matrix_columns"
+# the shape column of the matrix column `name` is `SHAPE_COLUMN_PREFIX + name`
+SHAPE_COLUMN_PREFIX = "__shape__"
+
+_INT32_INFO = np.iinfo(np.int32)
+
+
+def _to_arrow_column(column: pd.Series) -> Union[pa.Array, None]:
+    """convert the column to an arrow native array, if the column is too complex return None
+
+    Args:
+        column: one column of the processed data
+
+    Returns:
+        the arrow array or None
+
+    """
+    first = next((cell for cell in column if cell is not None), None)
+    if isinstance(first, str) or isinstance(column.dtype, pd.StringDtype):
+        try:
+            array = pa.array(column, type=pa.string())
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return None
+        # keep the missing values as python objects
+        return None if array.null_count else array.dictionary_encode()
+    if column.dtype != object:
+        try:
+            return pa.array(column)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            return None
+    if not isinstance(first, (list, np.ndarray)):
+        return None
+    try:
+        array = pa.array(column.values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return None
+    if not pa.types.is_list(array.type) or array.null_count:
+        return None
+    value_type = array.type.value_type
+    if array.flatten().null_count and not pa.types.is_integer(value_type):
+        return None
+    if pa.types.is_integer(value_type):
+        values = array.flatten().drop_null().to_numpy()
+        if _fit_int32(values):
+            return array.cast(pa.list_(pa.int32()))
+        return array
+    if pa.types.is_floating(value_type) or pa.types.is_boolean(value_type):
+        return array
+    return None
+
+
+def _fit_int32(values: np.ndarray) -> bool:
+    """whether the integer values could be saved as int32"""
+    return not len(values) or (
+        values.min() >= _INT32_INFO.min and values.max() <= _INT32_INFO.max
+    )
+
+
+def _to_arrow_matrix(column: pd.Series) -> Union[Tuple[pa.Array, pa.Array], None]:
+    """convert the column of 2-D numeric cells(like the `offsets` or the label matrices) to arrow arrays
+
+    Args:
+        column: one column of the processed data
+
+    Returns:
+        (the array, None) if all the cells have the same width, the array is `list<fixed_size_list<width>>`;
+        (the flat array, the shape array) for the other 2-D cells, the flat array is `list<values>` and the shape array is `list<int32>`;
+        None if the cells are not 2-D numeric
+
+    """
+    if column.dtype != object:
+        return None
+    cells = []
+    for cell in column:
+        if not isinstance(cell, (list, tuple, np.ndarray)):
+            return None
+        try:
+            cell = np.asarray(cell)
+        except ValueError:
+            # ragged
+            return None
+        if cell.size == 0 and (cell.ndim == 1 or cell.shape[0] == 0):
+            # the empty cell has no dtype and width
+            cell = None
+        elif cell.ndim != 2 or cell.size == 0 or cell.dtype.kind not in "iufb":
+            return None
+        cells.append(cell)
+    typed = [cell for cell in cells if cell is not None and cell.size]
+    if not typed:
+        return None
+    dtype = np.result_type(*[cell.dtype for cell in typed])
+    widths = {cell.shape[1] for cell in typed}
+    if len(widths) == 1:
+        width = widths.pop()
+        cells = [
+            cell if cell is not None else np.empty((0, width), dtype=dtype)
+            for cell in cells
+        ]
+    else:
+        cells = [
+            cell if cell is not None else np.empty((0, 0), dtype=dtype)
+            for cell in cells
+        ]
+        width = None
+    values = np.concatenate([cell.reshape(-1) for cell in cells]).astype(dtype)
+    if dtype.kind in "iu" and _fit_int32(values):
+        values = values.astype(np.int32)
+    values = pa.array(values)
+    if width is not None:
+        rows = np.cumsum([0] + [cell.shape[0] for cell in cells]).astype(np.int32)
+        return (
+            pa.ListArray.from_arrays(
+                pa.array(rows), pa.FixedSizeListArray.from_arrays(values, width)
+            ),
+            None,
+        )
+    sizes = np.cumsum([0] + [cell.size for cell in cells]).astype(np.int32)
+    shapes = np.array([cell.shape for cell in cells], dtype=np.int32).reshape(-1)
+    return (
+        pa.ListArray.from_arrays(pa.array(sizes), values),
+        pa.ListArray.from_arrays(
+            pa.array(np.arange(0, len(shapes) + 1, 2, dtype=np.int32)),
+            pa.array(shapes),
+        ),
+    )
+
+
+def _save_parquet(data: pd.DataFrame, path: str):
+    """save the data as parquet, the complex columns will be pickled cell by cell
+
+    Args:
+        data: the processed data
+        path: the save path
+
+    Returns:
+        None
+
+    """
+    arrays, names, pickled_columns, matrix_columns = [], [], [], []
+    for name in data.columns:
+        array = _to_arrow_column(data[name])
+        if array is None:
+            matrix = _to_arrow_matrix(data[name])
+            if matrix is not None:
+                array, shapes = matrix
+                if shapes is not None:
+                    matrix_columns.append(str(name))
+                    arrays.append(shapes)
+                    names.append(SHAPE_COLUMN_PREFIX + str(name))
+        if array is None:
+            pickled_columns.append(str(name))
+            array = pa.array(
+                [pkl.dumps(cell, protocol=pkl.HIGHEST_PROTOCOL) for cell in data[name]],
+                type=pa.binary(),
+            )
+        arrays.append(array)
+        names.append(str(name))
+    table = pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(
+        {
+            PICKLED_COLUMNS_KEY: json.dumps(pickled_columns),
+            MATRIX_COLUMNS_KEY: json.dumps(matrix_columns),
+        }
+    )
+    with open(path, "wb") as f:
+        pq.write_table(table, f)
+
+
+def _split_rows(array: pa.ListArray, values: np.ndarray) -> List[np.ndarray]:
+    """split the values of the list array to the rows
+
+    Args:
+        array: the list array
+        values: the numpy values of `array.values`, the first dim is indexed by the list offsets
+
+    Returns:
+        the rows, they are the slices of the values
+
+    """
+    offsets = array.offsets.to_numpy()
+    return [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _load_matrix(array: pa.ListArray, shapes: Union[pa.ListArray, None]) -> List:
+    """restore the 2-D cells saved by `_to_arrow_matrix`
+
+    Args:
+        array: the saved array
+        shapes: the saved shape array, None for the `list<fixed_size_list>` array
+
+    Returns:
+        the 2-D numpy arrays
+
+    """
+    if shapes is None:
+        rows = array.values
+        values = rows.flatten().to_numpy().reshape(len(rows), rows.type.list_size)
+        return _split_rows(array, values)
+    shapes = shapes.flatten().to_numpy().reshape(-1, 2)
+    return [
+        cell.reshape(shape)
+        for cell, shape in zip(_split_rows(array, array.values.to_numpy()), shapes)
+    ]
+
+
+def _load_parquet(path: str) -> pd.DataFrame:
+    """load the data saved by `_save_parquet`
+
+    The numeric list columns will be loaded as numpy arrays which are slices of the arrow buffer, so we do not materialize the python lists for them.
+
+    Args:
+        path: the parquet shard path
+
+    Returns:
+        the processed data
+
+    """
+    with open(path, "rb") as f:
+        table = pq.read_table(f)
+    metadata = table.schema.metadata or {}
+    pickled_columns = json.loads(metadata.get(PICKLED_COLUMNS_KEY, b"[]"))
+    matrix_columns = json.loads(metadata.get(MATRIX_COLUMNS_KEY, b"[]"))
+    shape_columns = [SHAPE_COLUMN_PREFIX + name for name in matrix_columns]
+    columns = [name for name in table.column_names if name not in shape_columns]
+
+    restored = {}
+    for name in columns:
+        if name in pickled_columns:
+            restored[name] = [
+                pkl.loads(cell) for cell in table.column(name).to_pylist()
+            ]
+            continue
+        field_type = table.schema.field(name).type
+        if not pa.types.is_list(field_type):
+            continue
+        array = table.column(name).combine_chunks()
+        if name in matrix_columns:
+            shapes = table.column(SHAPE_COLUMN_PREFIX + name).combine_chunks()
+            restored[name] = _load_matrix(array, shapes)
+        elif pa.types.is_fixed_size_list(field_type.value_type):
+            restored[name] = _load_matrix(array, None)
+        elif array.values.null_count:
+            # keep the `None` in the lists like `word_ids`
+            restored[name] = array.to_pylist()
+
+    native = table.drop(shape_columns + list(restored))
+    for i, field in enumerate(native.schema):
+        if pa.types.is_dictionary(field.type):
+            native = native.set_column(
+                i, field.name, native.column(i).cast(field.type.value_type)
+            )
+    data = native.to_pandas()
+    for name, cells in restored.items():
+        column = np.empty(len(cells), dtype=object)
+        column[:] = cells
+        data[name] = pd.Series(column, index=data.index)
+    return data[columns]
+
+
+def save_shards(
+    data: pd.DataFrame,
+    save_dir: str,
+    part: int,
+    max_rows_per_shard: int = -1,
+    data_format: str = "pickle",
+) -> List[Dict]:
+    """save one processed part to save_dir, split it by `max_rows_per_shard` if the part is too large
+
+    Args:
+        data: the processed data of this part
+        save_dir: the save dir of this data type
+        part: the index of the part
+        max_rows_per_shard: the max rows of one shard, -1 means do not split
+        data_format: `pickle` or `parquet`
+
+    Returns:
+        the shard infos of this part
+
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    suffix = {"pickle": "pkl", "parquet": "parquet"}[data_format]
+    if max_rows_per_shard <= 0 or len(data) <= max_rows_per_shard:
+        splits = [(f"{part}.{suffix}", data)]
+    else:
+        splits = []
+        for j, start in enumerate(range(0, len(data), max_rows_per_shard)):
+            splits.append(
+                (
+                    f"{part}_{j}.{suffix}",
+                    data.iloc[start : start + max_rows_per_shard].reset_index(
+                        drop=True
+                    ),
+                )
+            )
+    shards = []
+    for name, shard in splits:
+        if data_format == "parquet":
+            _save_parquet(shard, os.path.join(save_dir, name))
+        else:
+            with open(os.path.join(save_dir, name), "wb") as f:
+                pkl.dump(shard, f)
+        shards.append(
+            {"path": name, "part": part, "rows": len(shard), "format": data_format}
+        )
+    return shards
+
+
+def save_manifest(save_dir: str, shards: List[Dict]):
+    """save the shard infos of one data type to the manifest
+
+    Args:
+        save_dir: the save dir of this data type
+        shards: all the shard infos
+
+    Returns:
+        None
+
+    """
+    with open(os.path.join(save_dir, MANIFEST), "w") as f:
+        json.dump({"shards": shards}, f, indent=4)
+
+
+def load_manifest(data_dir: str) -> Union[Dict, None]:
+    """load the manifest of one data type
+
+    Args:
+        data_dir: the processed data dir of this data type
+
+    Returns:
+        the manifest, if there is no data return None
+
+    """
+    manifest_path = os.path.join(data_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    if os.path.exists(os.path.join(data_dir, "0.pkl")):
+        return {
+            "shards": [{"path": "0.pkl", "part": 0, "rows": None, "format": "pickle"}]
+        }
+    return None
+
+
+def iter_processed_data(data_dir: str) -> Iterator[pd.DataFrame]:
+    """load the shards of one data type one by one
+
+    Args:
+        data_dir: the processed data dir of this data type
+
+    Returns:
+        Iterable DataFrame
+
+    """
+    manifest = load_manifest(data_dir)
+    if manifest is None:
+        return
+    for shard in manifest["shards"]:
+        shard_path = os.path.join(data_dir, shard["path"])
+        if shard.get("format", "pickle") == "parquet":
+            yield _load_parquet(shard_path)
+        else:
+            with open(shard_path, "rb") as f:
+                yield pkl.load(f)
+
+
+def load_processed_data(data_dir: str) -> Union[pd.DataFrame, None]:
+    """load all the shards of one data type and concat them to one DataFrame
+
+    Args:
+        data_dir: the processed data dir of this data type
+
+    Returns:
+        the processed data, if there is no data return None
+
+    """
+    shards = list(iter_processed_data(data_dir))
+    if not shards:
+        return None
+    if len(shards) == 1:
+        return shards[0]
+    logger.info(f"Concat {len(shards)} shards from {data_dir}")
+    return pd.concat(shards, ignore_index=True)
@@ -4,9 +4,11 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import multiprocessing
 import os
 import pickle as pkl
-from typing import Callable, Dict, Iterator, Type
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple, Type
 
 import pandas as pd
 import pyarrow.parquet as pq
@@ -25,6 +27,8 @@ from intc import (
     cregister,
 )
 
+from dlk.data import processor_cache
+from dlk.data.processed_data import save_manifest, save_shards
 from dlk.utils.register import register
 
 logger = logging.getLogger(__name__)
@@ -47,6 +51,7 @@ class DefaultProcessorConfig(Base):
             "parquet",
             "parquet_list",
             "json",
+            "json_lines",
             "none",
             "pickle",
         ],
@@ -54,17 +59,25 @@ class DefaultProcessorConfig(Base):
     )
     valid_data_type = StrField(
         value="none",
-        options=["dict", "dataframe", "parquet", "json", "none"],
+        options=["dict", "dataframe", "parquet", "json", "json_lines", "none"],
         help="the type of valid data, `none` means no valid data",
     )
     test_data_type = StrField(
         value="none",
-        options=["dict", "dataframe", "parquet", "json", "none"],
+        options=["dict", "dataframe", "parquet", "json", "json_lines", "none"],
         help="the type of test data, `none` means no test data",
     )
     predict_data_type = StrField(
         value="none",
-        options=["dict", "dataframe", "parquet", "parquet_list", "json", "none"],
+        options=[
+            "dict",
+            "dataframe",
+            "parquet",
+            "parquet_list",
+            "json",
+            "json_lines",
+            "none",
+        ],
         help="the type of predict data, `none` means no predict data",
     )
     online_data_type = StrField(
@@ -100,6 +113,36 @@ class DefaultProcessorConfig(Base):
         if `false` will return the processed dict
         """,
     )
+    max_rows_per_shard = IntField(
+        value=-1,
+        minimum=-1,
+        help="when save the processed data, every loaded part will be saved as one shard, if the part has more than `max_rows_per_shard` rows, we will split it to several shards. -1 means never split.",
+    )
+    processed_data_format = StrField(
+        value="pickle",
+        options=["pickle", "parquet"],
+        help="the save format of the processed data, `pickle` will pickle the DataFrame, `parquet` will save the data as columnar arrow format which is faster to load and smaller on disk.",
+    )
+    num_workers = IntField(
+        value=0,
+        minimum=-1,
+        help="the number of processes to run the subprocessors, 0 means run in the main process, -1 means use os.cpu_count(). When `num_workers` > 0, every loaded part will be split to chunks of `chunk_size` rows and processed in a process pool, the meta collection subprocessors(like `token_gather`) will run on the whole part in the main process when collect the meta info.",
+    )
+    chunk_size = IntField(
+        value=10000,
+        minimum=1,
+        help="the rows of one chunk when `num_workers` > 0",
+    )
+    stream_batch_size = IntField(
+        value=-1,
+        minimum=-1,
+        help="if > 0, the `parquet`, `parquet_list` and `json_lines` data will be loaded and processed batch by batch(the parquet file is read by row groups), every batch has `stream_batch_size` rows and will be saved as one shard, so the peak memory is bounded by the batch size. The meta info will be collected by additional passes over the train data before processing(one pass for every group of adjacent meta collection subprocessors), same as the non-streaming processing, the meta info of the `parquet_list` is only collected from the first file. -1 means load the whole file.",
+    )
+    cache_dir = StrField(
+        value=None,
+        additions=[None],
+        help="if provided, the output of every subprocessor will be cached to the `cache_dir`, the cache key is the hash of the input data fingerprint, the subprocessor config and the upstream keys. When rerun the processor, it will resume from the output of the last unchanged subprocessor. NOTE: the cache will not be cleaned automatically.",
+    )
 
     submodule = SubModule(
         value={},
@@ -107,6 +150,27 @@ class DefaultProcessorConfig(Base):
     )
 
 
+STREAMING_DATA_TYPES = {"parquet", "parquet_list", "json_lines"}
+
+
+def iter_parquet(path: str, batch_size: int) -> Iterator[pd.DataFrame]:
+    """load the parquet file, if batch_size > 0 yield the data batch by batch
+
+    Args:
+        path: the parquet file path
+        batch_size: the rows of one batch
+
+    Returns:
+        Iterable DataFrame
+    """
+    if batch_size <= 0:
+        yield pq.read_table(path).to_pandas()
+        return
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield batch.to_pandas()
+
+
 def yield_dataframe(origin, data_type, config: DefaultProcessorConfig):
     if data_type == "none":
         yield None
@@ -124,21 +188,60 @@ def yield_dataframe(origin, data_type, config: DefaultProcessorConfig):
         if config.data_root:
             origin = os.path.join(config.data_root, origin)
         yield pd.read_json(origin)
+    elif data_type == "json_lines":
+        assert isinstance(origin, str)
+        if config.data_root:
+            origin = os.path.join(config.data_root, origin)
+        if config.stream_batch_size > 0:
+            with pd.read_json(
+                origin, lines=True, chunksize=config.stream_batch_size
+            ) as reader:
+                for chunk in reader:
+                    yield chunk.reset_index(drop=True)
+        else:
+            yield pd.read_json(origin, lines=True)
     elif data_type == "parquet":
         assert isinstance(origin, str)
         if config.data_root:
             origin = os.path.join(config.data_root, origin)
-        yield pq.read_table(origin).to_pandas()
+        yield from iter_parquet(origin, config.stream_batch_size)
     elif data_type == "parquet_list":
         assert isinstance(origin, list)
         for path in origin:
             if config.data_root:
                 path = os.path.join(config.data_root, path)
-            yield pq.read_table(path).to_pandas()
+            yield from iter_parquet(path, config.stream_batch_size)
     else:
         raise NotImplementedError
 
 
+# the subprocessors in the pool workers, set by `_init_worker`
+_worker_subprocessors: Dict = {}
+
+
+def _init_worker(subprocessors: Dict):
+    global _worker_subprocessors
+    _worker_subprocessors = subprocessors
+
+
+def _process_chunk(
+    names: List[str], data: pd.DataFrame, deliver_meta: bool
+) -> pd.DataFrame:
+    """process one chunk by the subprocessors in the pool worker
+
+    Args:
+        names: the subprocessor names in feed order
+        data: the chunk of the data
+        deliver_meta: whether deliver the meta info
+
+    Returns:
+        processed chunk
+    """
+    for name in names:
+        data = _worker_subprocessors[name].process(data=data, deliver_meta=deliver_meta)
+    return data
+
+
 @register("processor", "default")
 class DefaultProcessor(object):
     """docstring for IProcessor"""
@@ -162,6 +265,7 @@ class DefaultProcessor(object):
         )
 
         self.subprocessors = {}
+        self.subprocessor_configs = {}
         droped_subprocessors = []
         self.will_processed_data_set = set()
         for name in self.config.feed_order:
@@ -186,6 +290,7 @@ class DefaultProcessor(object):
             if self.config.load_meta_on_start:
                 subprocessor.load_meta()
             self.subprocessors[name] = subprocessor
+            self.subprocessor_configs[name] = subprocessor_config_dict
         for name in droped_subprocessors:
             self.config.feed_order.remove(name)
 
@@ -212,23 +317,226 @@ class DefaultProcessor(object):
             )
         raise NotImplementedError
 
-    def save(self, data: pd.DataFrame, type_name: str, i: int):
-        """save data to self.config.processed_data_dir
+    def save(self, data: pd.DataFrame, type_name: str, i: int) -> List[Dict]:
+        """save data to self.config.processed_data_dir/type_name as one or several shards
 
         Args:
             data: should saved data
+            type_name: train/valid/test/predict
+            i: the index of the loaded part
 
         Returns:
-            None
+            the saved shard infos
         """
-        os.makedirs(
-            os.path.join(self.config.processed_data_dir, type_name), exist_ok=True
+        return save_shards(
+            data,
+            os.path.join(self.config.processed_data_dir, type_name),
+            i,
+            self.config.max_rows_per_shard,
+            self.config.processed_data_format,
+        )
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        """create the process pool for the subprocessors
+
+        Returns:
+            the process pool, if `num_workers` is 0 return None
+        """
+        num_workers = self.config.num_workers
+        if num_workers == -1:
+            num_workers = os.cpu_count()
+        if num_workers <= 0:
+            return None
+        # NOTE: fork the subprocessors to the workers, so they are not required to be picklable
+        start_method = (
+            "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        )
+        return ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(self.subprocessors,),
         )
-        data_path = os.path.join(self.config.processed_data_dir, type_name, f"{i}.pkl")
-        assert (
-            i == 0
-        ), f"Currently only support save one {type_name} data"  # TODO: support save multi data
-        pkl.dump(data, open(data_path, "wb"))
+
+    def split_stages(
+        self, names: List[str], deliver_meta: bool
+    ) -> List[Tuple[bool, List[str]]]:
+        """group the subprocessors to stages, the meta collection subprocessors should run on the whole data when deliver meta
+
+        Args:
+            names: the subprocessor names in feed order
+            deliver_meta: whether deliver the meta info
+
+        Returns:
+            >>> [(run_on_whole_data, [subprocessor names]), ...]
+        """
+        stages = []
+        for name in names:
+            on_whole = deliver_meta and self.subprocessors[name].meta_collection
+            if stages and stages[-1][0] == on_whole and not on_whole:
+                stages[-1][1].append(name)
+            else:
+                stages.append((on_whole, [name]))
+        return stages
+
+    def run_subprocessors(
+        self,
+        data: pd.DataFrame,
+        names: List[str],
+        deliver_meta: bool,
+        pool: ProcessPoolExecutor = None,
+        desc: str = "",
+    ) -> pd.DataFrame:
+        """process the data by the subprocessors in `names`
+
+        Args:
+            data: the data
+            names: the subprocessor names in feed order
+            deliver_meta: whether deliver the meta info
+            pool: if provided, the data will be split to chunks and processed in the pool
+            desc: the description of the data for logging
+
+        Returns:
+            processed data
+        """
+        if pool is None or len(data) <= self.config.chunk_size:
+            for name in names:
+                logger.info(f"Processing on {desc}: {name}")
+                data = self.subprocessors[name].process(
+                    data=data, deliver_meta=deliver_meta
+                )
+            return data
+
+        for on_whole, stage_names in self.split_stages(names, deliver_meta):
+            if on_whole:
+                for name in stage_names:
+                    logger.info(f"Processing on {desc}: {name}")
+                    data = self.subprocessors[name].process(
+                        data=data, deliver_meta=deliver_meta
+                    )
+                continue
+            logger.info(f"Processing on {desc}: {', '.join(stage_names)} in parallel")
+            chunks = [
+                data.iloc[start : start + self.config.chunk_size]
+                for start in range(0, len(data), self.config.chunk_size)
+            ]
+            data = pd.concat(
+                pool.map(
+                    _process_chunk,
+                    [stage_names] * len(chunks),
+                    chunks,
+                    [deliver_meta] * len(chunks),
+                )
+            )
+        return data
+
+    def process_part(
+        self,
+        data: pd.DataFrame,
+        deliver_meta: bool,
+        pool: ProcessPoolExecutor = None,
+        desc: str = "",
+    ) -> pd.DataFrame:
+        """process one loaded part of the data by all the subprocessors, if the `cache_dir` is provided, resume from the last cached subprocessor output
+
+        Args:
+            data: the loaded part
+            deliver_meta: whether deliver the meta info
+            pool: if provided, the data will be split to chunks and processed in the pool
+            desc: the description of the part for logging
+
+        Returns:
+            processed data
+        """
+        feed_order = self.config.feed_order
+        if not self.config.cache_dir:
+            return self.run_subprocessors(data, feed_order, deliver_meta, pool, desc)
+
+        # when deliver meta, the meta info is collected from the data, so the meta files are not part of the key
+        key = processor_cache.root_key(
+            data, None if deliver_meta else self.config.meta_dir
+        )
+        keys = []
+        for name in feed_order:
+            key = processor_cache.stage_key(
+                key, name, self.subprocessor_configs[name], deliver_meta
+            )
+            keys.append(key)
+
+        # the meta collection subprocessors must be rerun to dump the meta info
+        resume_end = len(feed_order)
+        if deliver_meta:
+            for i, name in enumerate(feed_order):
+                if self.subprocessors[name].meta_collection:
+                    resume_end = i
+                    break
+        start = 0
+        for i in reversed(range(resume_end)):
+            if processor_cache.has_cache(self.config.cache_dir, keys[i]):
+                logger.info(
+                    f"Resume {desc} from the cached output of '{feed_order[i]}'"
+                )
+                data = processor_cache.load_cache(self.config.cache_dir, keys[i])
+                start = i + 1
+                break
+        for i in range(start, len(feed_order)):
+            data = self.run_subprocessors(
+                data, [feed_order[i]], deliver_meta, pool, desc
+            )
+            processor_cache.save_cache(self.config.cache_dir, keys[i], data)
+        return data
+
+    def is_streaming(self, type_name: str) -> bool:
+        """whether the data of type_name will be loaded batch by batch"""
+        data_type = getattr(self.config, f"{type_name}_data_type")
+        return self.config.stream_batch_size > 0 and data_type in STREAMING_DATA_TYPES
+
+    def collect_meta_on_stream(
+        self, data: Dict, type_name: str, pool: ProcessPoolExecutor = None
+    ):
+        """collect the meta info batch by batch before processing the streaming data
+
+        Every group of adjacent meta collection subprocessors needs one pass over the data, the upstream subprocessors are rerun in every pass. The meta info is collected from the same data as the non-streaming processing, which only delivers the meta info on the first loaded part(the first file of the `parquet_list`).
+
+        Args:
+            data: the origin data
+            type_name: the data type name
+            pool: the process pool
+
+        Returns:
+            None
+        """
+        feed_order = self.config.feed_order
+        if getattr(self.config, f"{type_name}_data_type") == "parquet_list":
+            data = {**data, type_name: data[type_name][:1]}
+        start = 0
+        while start < len(feed_order):
+            if not self.subprocessors[feed_order[start]].meta_collection:
+                start += 1
+                continue
+            end = start
+            while (
+                end < len(feed_order)
+                and self.subprocessors[feed_order[end]].meta_collection
+            ):
+                end += 1
+            names = feed_order[start:end]
+            logger.info(f"Collecting the meta info of {', '.join(names)}")
+            for i, loaded_data in enumerate(self.load_data(data, type_name)):
+                if loaded_data is None:
+                    continue
+                loaded_data = self.run_subprocessors(
+                    loaded_data,
+                    feed_order[:start],
+                    False,
+                    pool,
+                    desc=f"{type_name} {i} for meta",
+                )
+                for name in names:
+                    self.subprocessors[name].collect_meta(loaded_data)
+            for name in names:
+                self.subprocessors[name].dump_meta()
+            start = end
 
     def process(self, data: Dict) -> Dict:
         """Process entry
@@ -246,9 +554,27 @@ class DefaultProcessor(object):
         result = {}
         if not self.config.do_save:
             result = {key: [] for key in data}
+        pool = self.get_pool()
+        try:
+            self._process(data, result, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return result
+
+    def _process(self, data: Dict, result: Dict, pool: ProcessPoolExecutor):
+        """process all the data types and save(or gather to the result)"""
         for type_name in ["train", "valid", "test", "predict"]:
             if type_name not in self.will_processed_data_set:
                 continue
+            shards = []
+            collect_meta_first = (
+                self.config.meta_collection_on_train
+                and type_name == "train"
+                and self.is_streaming(type_name)
+            )
+            if collect_meta_first:
+                self.collect_meta_on_stream(data, type_name, pool)
             for i, loaded_data in enumerate(self.load_data(data, type_name)):
                 if loaded_data is None:
                     continue
@@ -256,19 +582,48 @@ class DefaultProcessor(object):
                     self.config.meta_collection_on_train
                     and type_name == "train"
                     and i == 0
+                    and not collect_meta_first
+                )
+                loaded_data = self.process_part(
+                    loaded_data,
+                    deliver_meta,
+                    pool,
+                    desc=f"{type_name} {i if i > 0 else ''}",
                 )
-                for name in self.config.feed_order:
-                    logger.info(
-                        f"Processing on {type_name} {i if i > 0 else ''}: {name}"
-                    )
-                    loaded_data = self.subprocessors[name].process(
-                        data=loaded_data, deliver_meta=deliver_meta
-                    )
                 if not self.config.do_save:
                     result[type_name].append(loaded_data)
                 else:
-                    self.save(loaded_data, type_name, i)
-        return result
+                    shards.extend(self.save(loaded_data, type_name, i))
+            if shards:
+                save_manifest(
+                    os.path.join(self.config.processed_data_dir, type_name), shards
+                )
+
+    def input_columns(self) -> set:
+        """the columns may be consumed by the subprocessors, which are the values of the `input_map` and the `*_columns` of the subprocessor configs
+
+        Returns:
+            the column names, the columns produced by the upstream subprocessors are also included
+
+        """
+        columns = set()
+
+        def gather(value, consumed: bool):
+            if isinstance(value, dict):
+                for key, sub_value in value.items():
+                    gather(
+                        sub_value,
+                        consumed or key == "input_map" or key.endswith("_columns"),
+                    )
+            elif isinstance(value, (list, tuple)):
+                for sub_value in value:
+                    gather(sub_value, consumed)
+            elif consumed and isinstance(value, str) and value:
+                columns.add(value)
+
+        for name in self.config.feed_order:
+            gather(self.subprocessor_configs[name], False)
+        return columns
 
     def online_process(self, data: pd.DataFrame):
         """online server process the data without save
@@ -0,0 +1,152 @@
+# Copyright the author(s) of DLK.
+#
+# This source code is licensed under the Apache license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Cache the output of every subprocessor
+
+The output of the `k`th subprocessor in the `feed_order` is saved to `cache_dir/<key_k>.pkl`, where
+    >>> key_0 = hash(input data fingerprint, meta fingerprint)
+    >>> key_k = hash(key_{k-1}, subprocessor name, subprocessor config, deliver_meta)
+So if only the downstream subprocessors are changed, the processor could resume from the output of the last unchanged subprocessor.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle as pkl
+from typing import Dict, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(*items) -> str:
+    """hash the json serializable items"""
+    return hashlib.md5(
+        json.dumps(items, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def data_fingerprint(data: pd.DataFrame, chunk_size: int = 10000) -> str:
+    """the fingerprint of the input data, the data is hashed column by column and chunk by chunk, so the whole data is never copied
+
+    Args:
+        data: the loaded data
+        chunk_size: the number of rows hashed at once
+
+    Returns:
+        the md5 of the index, the columns and the values
+    """
+    md5 = hashlib.md5()
+    md5.update(
+        _hash(list(map(str, data.columns)), list(map(str, data.dtypes))).encode("utf-8")
+    )
+    columns = [data.index.values] + [
+        data.iloc[:, i].values for i in range(data.shape[1])
+    ]
+    for values in columns:
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start : start + chunk_size]
+            if isinstance(chunk, np.ndarray) and chunk.dtype != object:
+                md5.update(np.ascontiguousarray(chunk).tobytes())
+            else:
+                md5.update(pkl.dumps(list(chunk), protocol=pkl.HIGHEST_PROTOCOL))
+    return md5.hexdigest()
+
+
+def meta_fingerprint(meta_dir: str) -> str:
+    """the fingerprint of the meta files, the subprocessors may load the meta info(like vocab) from the meta_dir
+
+    Args:
+        meta_dir: the meta dir
+
+    Returns:
+        the md5 of the names and the contents of the meta files
+    """
+    md5 = hashlib.md5()
+    if not os.path.isdir(meta_dir):
+        return md5.hexdigest()
+    for root, _, files in sorted(os.walk(meta_dir)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            md5.update(os.path.relpath(path, meta_dir).encode("utf-8"))
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    md5.update(block)
+    return md5.hexdigest()
+
+
+def root_key(data: pd.DataFrame, meta_dir: Union[str, None]) -> str:
+    """the key before all the subprocessors
+
+    Args:
+        data: the loaded data
+        meta_dir: if the meta info will not be collected from this data, the meta files should be part of the key
+
+    Returns:
+        the root key
+    """
+    meta = meta_fingerprint(meta_dir) if meta_dir is not None else None
+    return _hash(data_fingerprint(data), meta)
+
+
+def stage_key(upstream_key: str, name: str, config: Dict, deliver_meta: bool) -> str:
+    """the key of the output of one subprocessor
+
+    Args:
+        upstream_key: the key of the upstream output
+        name: the subprocessor name
+        config: the subprocessor config
+        deliver_meta: whether deliver the meta info
+
+    Returns:
+        the stage key
+    """
+    return _hash(upstream_key, name, config, deliver_meta)
+
+
+def load_cache(cache_dir: str, key: str) -> Union[pd.DataFrame, None]:
+    """load the cached output
+
+    Args:
+        cache_dir: the cache dir
+        key: the stage key
+
+    Returns:
+        the cached data, if not exists return None
+    """
+    path = os.path.join(cache_dir, f"{key}.pkl")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return pkl.load(f)
+
+
+def has_cache(cache_dir: str, key: str) -> bool:
+    """whether the output of the key is cached"""
+    return os.path.exists(os.path.join(cache_dir, f"{key}.pkl"))
+
+
+def save_cache(cache_dir: str, key: str, data: pd.DataFrame):
+    """save the output of one subprocessor
+
+    Args:
+        cache_dir: the cache dir
+        key: the stage key
+        data: the output
+
+    Returns:
+        None
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.pkl")
+    # write to a temp file first, so a broken run will not leave a broken cache
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pkl.dump(data, f, protocol=pkl.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
@@ -60,6 +60,9 @@ class BaseSubProcessorConfig(Base):
 class BaseSubProcessor(object):
     """docstring for ISubProcessor"""
 
+    # if True, the subprocessor collects the meta info from the whole data when `deliver_meta`(like `token_gather`), so it should not be run on the chunks of the data
+    meta_collection = False
+
     def __init__(self, stage: str, config: BaseSubProcessorConfig, meta_dir: str):
         self.loaded_meta = False
         self.meta_dir = meta_dir
@@ -67,6 +70,27 @@ class BaseSubProcessor(object):
     def load_meta(self):
         self.loaded_meta = True
 
+    def collect_meta(self, data: pd.DataFrame):
+        """collect the meta info from one part of the data, the meta info will be dumped by `dump_meta`, only for the `meta_collection` subprocessors
+
+        Args:
+            data: one part of the data
+
+        Returns:
+            None
+
+        """
+        raise NotImplementedError
+
+    def dump_meta(self):
+        """dump the meta info collected by `collect_meta` to the meta_dir
+
+        Returns:
+            None
+
+        """
+        raise NotImplementedError
+
     def process(self, data: pd.DataFrame, deliver_meta: bool) -> pd.DataFrame:
         """SubProcess entry
 
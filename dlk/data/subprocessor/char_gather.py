@@ -76,6 +76,8 @@ class CharGatherConfig(BaseSubProcessorConfig):
 class CharGather(BaseSubProcessor):
     """gather all character from the 'gather_columns' and deliver a vocab named 'char_vocab'"""
 
+    meta_collection = True
+
     def __init__(self, stage: str, config: CharGatherConfig, meta_dir: str):
         super().__init__(stage, config, meta_dir)
         self.config = config
@@ -84,6 +86,8 @@ class CharGather(BaseSubProcessor):
             if not self.config.update
             else os.path.join(self.meta_dir, self.config.update)
         )
+        self.vocab: Vocabulary = None
+        self._collecting = False
 
     def split_to_char(self, input: Union[str, Iterable]):
         """the char is from token or sentence, so we need split them to List[char]
@@ -100,6 +104,44 @@ class CharGather(BaseSubProcessor):
         else:
             return [self.split_to_char(sub_input) for sub_input in input]
 
+    def collect_meta(self, data: pd.DataFrame):
+        """gather the vocab from one part of the data
+
+        Args:
+            data: one part of the data
+
+        Returns:
+            None
+
+        """
+        if not self._collecting:
+            if self.update:
+                with open(self.update, mode="r", encoding="utf-8") as f:
+                    self.vocab = Vocabulary.load(json.load(f))
+            else:
+                self.vocab = Vocabulary(
+                    do_strip=True, unknown=self.config.unk, ignore=self.config.ignore
+                )
+            self._collecting = True
+        for column in self.config.gather_columns:
+            column: str
+            self.vocab.auto_update(self.split_to_char(data[column]))
+
+    def dump_meta(self):
+        """filter the gathered vocab and dump it to the meta_dir
+
+        Returns:
+            None
+
+        """
+        self._collecting = False
+        self.vocab.filter_rare(self.config.min_freq, self.config.most_common)
+        logger.info(f"The Char Vocab Num is {self.vocab.word_num}")
+        with open(
+            os.path.join(self.meta_dir, self.config.char_vocab), "w", encoding="utf-8"
+        ) as f:
+            json.dump(self.vocab.dumps(), f)
+
     def process(self, data: pd.DataFrame, deliver_meta: bool) -> pd.DataFrame:
         """Character gather entry
 
@@ -118,20 +160,6 @@ class CharGather(BaseSubProcessor):
         """
         if not deliver_meta:
             return data
-        if self.update:
-            with open(self.update, mode="r", encoding="utf-8") as f:
-                self.vocab = Vocabulary.load(json.load(f))
-        else:
-            self.vocab = Vocabulary(
-                do_strip=True, unknown=self.config.unk, ignore=self.config.ignore
-            )
-        for column in self.config.gather_columns:
-            column: str
-            self.vocab.auto_update(self.split_to_char(data[column]))
-        self.vocab.filter_rare(self.config.min_freq, self.config.most_common)
-        logger.info(f"The Char Vocab Num is {self.vocab.word_num}")
-        with open(
-            os.path.join(self.meta_dir, self.config.char_vocab), "w", encoding="utf-8"
-        ) as f:
-            json.dump(self.vocab.dumps(), f)
+        self.collect_meta(data)
+        self.dump_meta()
         return data
@@ -5,8 +5,10 @@
 
 import json
 import logging
-from typing import Callable, Dict, Union
+from itertools import chain
+from typing import Callable, Dict, List, Union
 
+import numpy as np
 import pandas as pd
 from intc import (
     MISSING,
@@ -193,6 +195,15 @@ class FastTokenizerConfig(BaseSubProcessorConfig):
     fix_offset = BoolField(
         value=False, help="whether fix the offset for the pretokenized word"
     )
+    output_columns = ListField(
+        value=[],
+        suggestions=[["tokens", "ids", "attention_mask", "offsets", "word_ids"]],
+        help="the keys of the `output_map` which will be extracted from the tokenizer outputs, the others will not be output. Empty means output all of them",
+    )
+    pack_to_numpy = BoolField(
+        value=False,
+        help="whether output the `ids`, `attention_mask`, `type_ids`, `special_tokens_mask` and `offsets` as numpy arrays(the arrays of one column are the slices of one packed buffer) instead of python lists, the `offsets` of every instance is a (length, 2) array. NOTE: make sure the downstream subprocessors support the numpy arrays",
+    )
 
 
 @register("subprocessor", "fast_tokenizer")
@@ -326,72 +337,158 @@ class FastTokenizer(BaseSubProcessor):
             data = data.explode("_tokenizer_encoders", ignore_index=True)
         else:
             data["_tokenizer_encoders"] = batch_encodes
-        (
-            tokens_list,
-            ids_list,
-            attention_mask_list,
-            type_ids_list,
-            special_tokens_mask_list,
-            offsets_list,
-            word_ids_list,
-            overflowing_list,
-            sequence_ids_list,
-        ) = ([], [], [], [], [], [], [], [], [])
-        for encode in data["_tokenizer_encoders"]:
-            tokens_list.append(encode.tokens)
-            ids_list.append(encode.ids)
-            attention_mask_list.append(encode.attention_mask)
-            type_ids_list.append(encode.type_ids)
-            special_tokens_mask_list.append(encode.special_tokens_mask)
-            offsets_list.append(encode.offsets)
-            word_ids_list.append(encode.word_ids)
-            # overflowing_list.append(encode.overflowing)
-            sequence_ids_list.append(encode.sequence_ids)
+        encodes = data.pop("_tokenizer_encoders").tolist()
         output_map = self.config.output_map
-        data[output_map.tokens] = tokens_list
-        data[output_map.ids] = ids_list
-        data[output_map.attention_mask] = attention_mask_list
-        data[output_map.type_ids] = type_ids_list
-        data[output_map.special_tokens_mask] = special_tokens_mask_list
-        data[output_map.offsets] = offsets_list
-        data[output_map.word_ids] = word_ids_list
-        # data[output_map['overflowing']] = overflowing_list
-        data[output_map.sequence_ids] = sequence_ids_list
-        data.drop("_tokenizer_encoders", axis=1, inplace=True)
-
-        if self.config.process_data.is_pretokenized and self.config.fix_offset:
-            data[output_map.offsets] = data.apply(self._fix_offset, axis=1)
+        output_columns = self.config.output_columns or self.encode_attributes
+        for column in output_columns:
+            if column not in self.encode_attributes:
+                raise KeyError(
+                    f"The output column '{column}' is not in {self.encode_attributes}"
+                )
+        fix_offset = self.config.process_data.is_pretokenized and self.config.fix_offset
+        need_attributes = set(output_columns)
+        if fix_offset:
+            need_attributes.update(["offsets", "word_ids", "type_ids"])
+        # only extract the needed attributes from the encodings
+        outputs = {
+            attribute: [getattr(encode, attribute) for encode in encodes]
+            for attribute in need_attributes
+        }
+        lengths = np.fromiter(
+            (len(encode) for encode in encodes), dtype=np.int64, count=len(encodes)
+        )
+        split_points = np.cumsum(lengths)[:-1]
+
+        def split(packed: np.ndarray) -> List[np.ndarray]:
+            """split the packed array to the instances"""
+            return np.split(packed, split_points) if len(lengths) else []
+
+        if fix_offset:
+            offsets = self._fix_offsets(
+                data,
+                outputs["offsets"],
+                outputs["word_ids"],
+                outputs["type_ids"],
+                lengths,
+            )
+            if self.config.pack_to_numpy:
+                outputs["offsets"] = split(offsets)
+            else:
+                outputs["offsets"] = [
+                    list(map(tuple, one.tolist())) for one in split(offsets)
+                ]
+        elif self.config.pack_to_numpy and "offsets" in outputs:
+            outputs["offsets"] = split(self._flat_offsets(outputs["offsets"], lengths))
+        if self.config.pack_to_numpy:
+            for attribute in self.numeric_attributes & set(outputs):
+                packed = np.fromiter(
+                    chain.from_iterable(outputs[attribute]),
+                    dtype=np.int32,
+                    count=int(lengths.sum()),
+                )
+                outputs[attribute] = split(packed)
+
+        for column in output_columns:
+            data[getattr(output_map, column)] = pd.Series(
+                outputs[column], index=data.index, dtype=object
+            )
         return data
 
-    def _fix_offset(self, one_line: pd.Series):
-        """fix the pretokenizerd offset
+    @property
+    def encode_attributes(self) -> List[str]:
+        """the attributes of the tokenizer encoding could be output"""
+        return [
+            "tokens",
+            "ids",
+            "attention_mask",
+            "type_ids",
+            "special_tokens_mask",
+            "offsets",
+            "word_ids",
+            "sequence_ids",
+        ]
+
+    @property
+    def numeric_attributes(self) -> set:
+        """the attributes could be packed to a 1d numpy array"""
+        return {"ids", "attention_mask", "type_ids", "special_tokens_mask"}
+
+    @staticmethod
+    def _flat_offsets(offsets: List, lengths: np.ndarray) -> np.ndarray:
+        """flat the offsets of all the instances to one (total_length, 2) array"""
+        return np.fromiter(
+            chain.from_iterable(chain.from_iterable(offsets)),
+            dtype=np.int64,
+            count=int(lengths.sum()) * 2,
+        ).reshape(-1, 2)
+
+    def _fix_offsets(
+        self,
+        data: pd.DataFrame,
+        offsets: List,
+        word_ids: List,
+        type_ids: List,
+        lengths: np.ndarray,
+    ) -> np.ndarray:
+        """fix the pretokenized offsets of all the instances as an array operation
 
         Args:
-            one_line: a Series which contains the config.input_map.pretokenized_word_offsets, config.output_map.offsets, config.output_map.word_ids, configs.output_map.type_ids
+            data: the data which contains the config.input_map.pretokenized_word_offsets(_a/_b)
+            offsets: the offsets of every instance from the tokenizer
+            word_ids: the word_ids of every instance
+            type_ids: the type_ids of every instance
+            lengths: the length of every instance
 
         Returns:
-            encode.tokens, encode.ids, encode.attention_mask, encode.type_ids, encode.special_tokens_mask, encode.offsets, encode.word_ids, encode.overflowing, encode.sequence_ids
+            the fixed offsets of all the instances, shape is (total_length, 2)
 
         """
-        fixed_offsets = []
-        word_offsets = []
+        total_length = int(lengths.sum())
+        flat_offsets = self._flat_offsets(offsets, lengths)
+        flat_word_ids = np.fromiter(
+            (-1 if word_id is None else word_id for word_id in chain(*word_ids)),
+            dtype=np.int64,
+            count=total_length,
+        )
+        flat_type_ids = np.fromiter(
+            chain.from_iterable(type_ids), dtype=np.int64, count=total_length
+        )
         if self.config.input_type == "single":
-            word_offsets = [one_line[self.config.input_map.pretokenized_word_offsets]]
+            word_offset_columns = [self.config.input_map.pretokenized_word_offsets]
         else:  # pair
-            word_offsets = [
-                one_line[self.config.input_map.pretokenized_word_offsets_a],
-                one_line[self.config.input_map.pretokenized_word_offsets_b],
+            word_offset_columns = [
+                self.config.input_map.pretokenized_word_offsets_a,
+                self.config.input_map.pretokenized_word_offsets_b,
             ]
-        for offset, word_id, type_id in zip(
-            one_line["offsets"], one_line["word_ids"], one_line["type_ids"]
-        ):
-            if offset == (0, 0):
-                fixed_offsets.append(offset)
-            else:
-                fixed_offsets.append(
+        # the start of every pretokenized word, and the start position of every (type, instance) in the word starts
+        word_starts = []
+        bases = np.zeros((len(word_offset_columns), len(lengths)), dtype=np.int64)
+        base = 0
+        for type_id, column in enumerate(word_offset_columns):
+            word_lengths = np.fromiter(
+                (len(word_offsets) for word_offsets in data[column]),
+                dtype=np.int64,
+                count=len(lengths),
+            )
+            bases[type_id] = base + np.cumsum(word_lengths) - word_lengths
+            base += int(word_lengths.sum())
+            word_starts.append(
+                np.fromiter(
                     (
-                        offset[0] + word_offsets[type_id][word_id][0],
-                        offset[1] + word_offsets[type_id][word_id][0],
-                    )
+                        word_offset[0]
+                        for word_offsets in data[column]
+                        for word_offset in word_offsets
+                    ),
+                    dtype=np.int64,
+                    count=int(word_lengths.sum()),
                 )
-        return fixed_offsets
+            )
+        word_starts = np.concatenate(word_starts)
+        instance_ids = np.repeat(np.arange(len(lengths)), lengths)
+        need_fix = (flat_offsets != 0).any(axis=1) & (flat_word_ids >= 0)
+        word_index = (
+            bases[flat_type_ids[need_fix], instance_ids[need_fix]]
+            + flat_word_ids[need_fix]
+        )
+        flat_offsets[need_fix] += word_starts[word_index][:, None]
+        return flat_offsets
@@ -92,6 +92,8 @@ class TokenEmbedding(BaseSubProcessor):
     The tokens are from 'Tokenizer'(get_vocab) or 'Vocabulary'(word2idx) object(the two must provide only one)
     """
 
+    meta_collection = True
+
     def __init__(self, stage: str, config: TokenEmbeddingConfig, meta_dir: str):
         super().__init__(stage, config, meta_dir)
         self.stage = stage
@@ -189,25 +191,25 @@ class TokenEmbedding(BaseSubProcessor):
         )
         return embedding_dict
 
-    def process(self, data: pd.DataFrame, deliver_meta: bool) -> pd.DataFrame:
-        """Character gather entry
+    def collect_meta(self, data: pd.DataFrame):
+        """the embedding only depends on the vocab, nothing to collect from the data
 
         Args:
-            data:
-            >>> |sentence |label|
-            >>> |---------|-----|
-            >>> |sent_a...|la   |
-            >>> |sent_b...|lb   |
+            data: one part of the data
 
-            deliver_meta:
-                if there are some meta info need to deliver to next processor, and deliver_meta is True, save the meta info to datadir
         Returns:
-            processed data
+            None
 
         """
-        if not deliver_meta:
-            return data
+        return
+
+    def dump_meta(self):
+        """dump the embedding of the tokens in the vocab to the meta_dir
 
+        Returns:
+            None
+
+        """
         if not self.loaded_meta:
             self.load_meta()
 
@@ -227,4 +229,23 @@ class TokenEmbedding(BaseSubProcessor):
         with open(os.path.join(self.meta_dir, self.config.token_embedding), "wb") as f:
             embedding_mat.dump(f)
 
+    def process(self, data: pd.DataFrame, deliver_meta: bool) -> pd.DataFrame:
+        """Character gather entry
+
+        Args:
+            data:
+            >>> |sentence |label|
+            >>> |---------|-----|
+            >>> |sent_a...|la   |
+            >>> |sent_b...|lb   |
+
+            deliver_meta:
+                if there are some meta info need to deliver to next processor, and deliver_meta is True, save the meta info to datadir
+        Returns:
+            processed data
+
+        """
+        if not deliver_meta:
+            return data
+        self.dump_meta()
         return data
@@ -83,6 +83,8 @@ class TokenGatherConfig(BaseSubProcessorConfig):
 class TokenGather(BaseSubProcessor):
     """gather all tokens from the 'gather_columns' and deliver a vocab named 'token_vocab'"""
 
+    meta_collection = True
+
     def __init__(self, stage: str, config: TokenGatherConfig, meta_dir: str):
         super().__init__(stage, config, meta_dir)
         self.stage = stage
@@ -92,6 +94,8 @@ class TokenGather(BaseSubProcessor):
             if not self.config.update
             else os.path.join(self.meta_dir, self.config.update)
         )
+        self.vocab: Vocabulary = None
+        self._collecting = False
 
     def get_elements_from_series_by_trace(self, data: pd.Series, trace: str) -> List:
         """get the data from data[trace_path]
@@ -127,31 +131,25 @@ class TokenGather(BaseSubProcessor):
 
         return [get_elements_from_iter_by_trace(one, trace.split(".")) for one in data]
 
-    def process(self, data: pd.DataFrame, deliver_meta: bool) -> pd.DataFrame:
-        """Character gather entry
+    def collect_meta(self, data: pd.DataFrame):
+        """gather the vocab from one part of the data
 
         Args:
-            data:
-            >>> |sentence |label|
-            >>> |---------|-----|
-            >>> |sent_a...|la   |
-            >>> |sent_b...|lb   |
+            data: one part of the data
 
-            deliver_meta:
-                if there are some meta info need to deliver to next processor, and deliver_meta is True, save the meta info to datadir
         Returns:
-            processed data
+            None
 
         """
-        if not deliver_meta:
-            return data
-        if self.update:
-            with open(self.update, mode="r", encoding="utf-8") as f:
-                self.vocab = Vocabulary.load(json.load(f))
-        else:
-            self.vocab = Vocabulary(
-                do_strip=True, unknown=self.config.unk, ignore=self.config.ignore
-            )
+        if not self._collecting:
+            if self.update:
+                with open(self.update, mode="r", encoding="utf-8") as f:
+                    self.vocab = Vocabulary.load(json.load(f))
+            else:
+                self.vocab = Vocabulary(
+                    do_strip=True, unknown=self.config.unk, ignore=self.config.ignore
+                )
+            self._collecting = True
         for column in self.config.gather_columns:
             if isinstance(column, str):
                 self.vocab.auto_update(data[column])
@@ -165,6 +163,15 @@ class TokenGather(BaseSubProcessor):
                 raise PermissionError(
                     f"The gather column currently is only support str or dict."
                 )
+
+    def dump_meta(self):
+        """filter the gathered vocab and dump it to the meta_dir
+
+        Returns:
+            None
+
+        """
+        self._collecting = False
         self.vocab.filter_rare(self.config.min_freq, self.config.most_common)
         logger.info(f"The Vocab Num is {self.vocab.word_num}")
         with open(
@@ -172,4 +179,24 @@ class TokenGather(BaseSubProcessor):
         ) as f:
             json.dump(self.vocab.dumps(), f)
 
+    def process(self, data: pd.DataFrame, deliver_meta: bool) -> pd.DataFrame:
+        """Character gather entry
+
+        Args:
+            data:
+            >>> |sentence |label|
+            >>> |---------|-----|
+            >>> |sent_a...|la   |
+            >>> |sent_b...|lb   |
+
+            deliver_meta:
+                if there are some meta info need to deliver to next processor, and deliver_meta is True, save the meta info to datadir
+        Returns:
+            processed data
+
+        """
+        if not deliver_meta:
+            return data
+        self.collect_meta(data)
+        self.dump_meta()
         return data
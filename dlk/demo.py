@@ -36,6 +36,7 @@ from PIL import Image
 from dlk.display import Display
 from dlk.online import OnlinePredict
 from dlk.preprocess import PreProcessor
+from dlk.utils.import_module import import_config_modules
 from dlk.utils.register import register, register_module_name
 
 logger = logging.getLogger(__name__)
@@ -81,7 +82,9 @@ def prepare_display(dump_display_config: str) -> Display:
         Display
     """
 
-    configs = Parser(json.loads(dump_display_config)).parser_init()
+    display_config_dict = json.loads(dump_display_config)
+    import_config_modules(display_config_dict)
+    configs = Parser(display_config_dict).parser_init()
     assert len(configs) == 1, f"You should not use '_search' for demo"
     display_config = configs[0]["@display"]
     display_name = register_module_name(display_config._module_name)
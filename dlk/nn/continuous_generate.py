@@ -0,0 +1,456 @@
+# Copyright the author(s) of DLK.
+#
+# This source code is licensed under the Apache license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+The continuous batching generation for the token_enc_dec model
+
+The generator keeps `max_sentences` slots, every slot holds the `beam_size` hypotheses of one sentence. All the slots are decoded by one decoder call every step although they are at different steps, and when a sentence is finished, its slot is freed and a new sentence is admitted to it at the next step. So the batch is kept full until there is no pending sentence.
+
+The token sample and the beam bookkeeping are the same as `TokenGenBase._generate_tokens`, the slots at the same step are sampled together. Only the rows of the occupied slots are decoded, the free slots are skipped when the sources run out.
+"""
+
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import torch
+
+from dlk.nn.token_gen_base import FinalizedHypos, TokenGenBase
+
+
+class _Slot(object):
+    """the decoding status of one sentence"""
+
+    def __init__(self, index: int, src_length: int, max_len: int):
+        self.index = index
+        self.src_length = src_length
+        self.max_len = max_len
+        self.step = 0
+
+
+class ContinuousBatchGenerator(object):
+    """Continuous batching generator for the token_enc_dec model
+
+    NOTE: the decoder must provide `init_slot_cache`, `admit_slots` and `slot_forward` (like the bart_like_decoder), the prefix tokens and the constraints are not supported
+
+    NOTE: every sentence is encoded and decoded as if it was alone: the source padding is masked in the cross attention, and the max decode steps is computed from the sentence's own length. `model.generate` attends to the padding of the batch and uses the max_len of the padded batch, so the outputs are only the same as `model.generate` when the sources in a batch are not padded
+
+    Args:
+        model: the token_enc_dec model
+        max_sentences: the number of the sentences decoded at the same time
+        max_len: the max decode steps of one sentence, -1 means the `max_len` of the model config
+
+    """
+
+    def __init__(self, model: TokenGenBase, max_sentences: int = 16, max_len: int = -1):
+        assert hasattr(
+            model.decoder, "slot_forward"
+        ), f"The decoder does not support the continuous batching"
+        assert max_sentences >= 1
+        self.model = model
+        self.max_sentences = max_sentences
+        self.beam_size = model.config.beam_size
+        self.max_len = max_len if max_len > 0 else model.config.max_len
+
+    def sentence_max_len(self, src_tokens: torch.Tensor) -> Tuple[int, int]:
+        """the max decode steps of one sentence, same as the `generate` of the token_enc_dec model
+
+        Args:
+            src_tokens: the source token ids without padding
+
+        Returns:
+            the source length(except the eos and pad) and the max decode steps
+        """
+        model = self.model
+        src_length = int((src_tokens.ne(model.eos) & src_tokens.ne(model.pad)).sum())
+        if model.config.match_source_len:
+            max_len = src_length
+        else:
+            max_len = min(
+                int(
+                    model.config.max_len_a_ratio * src_tokens.size(0)
+                    + model.config.max_len_b
+                ),
+                model.config.max_len - 1,
+            )
+        assert (
+            model.config.min_len <= max_len
+        ), "min_len cannot be larger than max_len, please adjust these!"
+        if max_len > self.max_len:
+            raise ValueError(
+                f"The max decode steps {max_len} is larger than the generator max_len {self.max_len}"
+            )
+        return src_length, max_len
+
+    def _admit(
+        self,
+        cache,
+        slots: List[Optional[_Slot]],
+        admitted: List[Tuple[int, int, torch.Tensor]],
+        tokens: torch.Tensor,
+        scores: torch.Tensor,
+        cands_to_ignore: torch.Tensor,
+    ):
+        """encode the new sentences and put them to the free slots
+
+        Args:
+            cache: the decoder cache
+            slots: the status of all the slots, will be updated
+            admitted: list of (slot index, sentence index, source token ids)
+            tokens: the tokens of all the rows, will be updated
+            scores: the scores of all the rows, will be updated
+            cands_to_ignore: the ignore mask of every slot, will be updated
+
+        Returns:
+            None
+        """
+        model = self.model
+        device = tokens.device
+        beam_size = self.beam_size
+        src_len = max(src.size(0) for _, _, src in admitted)
+        src_tokens = torch.full(
+            (len(admitted), src_len), model.pad, dtype=torch.long, device=device
+        )
+        for i, (slot_idx, index, src) in enumerate(admitted):
+            src_tokens[i, : src.size(0)] = src.to(device)
+            slots[slot_idx] = _Slot(index, *self.sentence_max_len(src))
+        src_mask = src_tokens.ne(model.pad).long()
+
+        inputs = {
+            model.config.input_map.encoder_input_ids: src_tokens,
+            model.encoder.config.input_map.encoder_attention_mask: src_mask,
+        }
+        if model.config.share_embedding:
+            src_embedding = model.embedding.forward(src_tokens) * model.embedding_scale
+        else:
+            src_embedding = (
+                model.src_embedding.forward(src_tokens) * model.embedding_scale
+            )
+        inputs[model.encoder.config.input_map.encoder_input_embedding] = src_embedding
+        encoder_outs = model.encoder.forward(inputs)
+        encoder_output_embedding = encoder_outs[
+            model.encoder.config.output_map.encoder_output_embedding
+        ]
+
+        slot_index = torch.tensor(
+            [slot_idx for slot_idx, _, _ in admitted], dtype=torch.long, device=device
+        )
+        rows = self._slot_rows(slot_index.tolist(), device)
+        tokens[rows] = model.pad
+        tokens[rows, 0] = model.bos
+        scores[rows] = 0
+        cands_to_ignore[slot_index] = False
+        model.decoder.admit_slots(
+            cache,
+            rows,
+            encoder_output_embedding.repeat_interleave(beam_size, dim=0),
+            src_mask.repeat_interleave(beam_size, dim=0),
+        )
+
+    def _decode_step(
+        self,
+        cache,
+        slots: List[Optional[_Slot]],
+        active: List[int],
+        tokens: torch.Tensor,
+    ) -> torch.Tensor:
+        """decode one step of the occupied slots and apply the constraints which are not dependent on the step of the batch
+
+        Args:
+            cache: the decoder cache
+            slots: the status of all the slots
+            active: the indexes of the occupied slots
+            tokens: the tokens of all the rows
+
+        Returns:
+            lprobs of the rows of the occupied slots, in the order of `active`
+        """
+        model = self.model
+        device = tokens.device
+        beam_size = self.beam_size
+        rows = None
+        if len(active) < len(slots):
+            rows = self._slot_rows(active, device)
+            tokens = tokens[rows]
+        row_steps = torch.tensor(
+            [slots[slot_idx].step for slot_idx in active], device=device
+        ).repeat_interleave(beam_size)
+        row_max_len = torch.tensor(
+            [slots[slot_idx].max_len for slot_idx in active], device=device
+        ).repeat_interleave(beam_size)
+        current_tokens = tokens.gather(1, row_steps.unsqueeze(1))
+        if model.config.share_embedding:
+            decoder_embedding = model.embedding.forward(current_tokens)
+        else:
+            decoder_embedding = model.tgt_embedding.forward(current_tokens)
+        decoder_output_embedding = model.decoder.slot_forward(
+            decoder_embedding * model.embedding_scale, row_steps, cache, rows
+        )
+        lprobs = model.lm_head(decoder_output_embedding[:, -1, :])
+
+        lprobs[lprobs != lprobs] = torch.tensor(-math.inf).to(lprobs)
+        if model.pad != model.eos:
+            lprobs[:, model.pad] = -math.inf  # never select pad
+        if model.bos != model.eos:
+            lprobs[:, model.bos] = -math.inf  # never select bos
+        if model.unk != model.eos:
+            lprobs[:, model.unk] -= model.config.unk_penalty  # apply unk penalty
+
+        # handle max length constraint
+        not_eos = torch.ones(lprobs.size(1), dtype=torch.bool, device=device)
+        not_eos[model.eos] = False
+        lprobs.masked_fill_((row_steps >= row_max_len)[:, None] & not_eos, -math.inf)
+        # minimum length constraint
+        lprobs[:, model.eos].masked_fill_(row_steps < model.config.min_len, -math.inf)
+        return lprobs
+
+    def _slot_rows(self, slot_index: List[int], device) -> torch.Tensor:
+        """the rows of the slots, every slot holds `beam_size` rows
+
+        Args:
+            slot_index: the slot indexes
+            device: the device of the rows
+
+        Returns:
+            the row indexes
+        """
+        slot_index = torch.tensor(slot_index, dtype=torch.long, device=device)
+        return (
+            slot_index[:, None] * self.beam_size
+            + torch.arange(self.beam_size, device=device)
+        ).view(-1)
+
+    def _sample_group(
+        self,
+        step: int,
+        max_len: int,
+        group: List[int],
+        slots: List[Optional[_Slot]],
+        group_lprobs: torch.Tensor,
+        tokens: torch.Tensor,
+        scores: torch.Tensor,
+        cands_to_ignore: torch.Tensor,
+        new_order: torch.Tensor,
+        finalized: FinalizedHypos,
+    ) -> List[int]:
+        """sample the next tokens of the slots at the same step, this is the same as one step of `TokenGenBase._generate_tokens`
+
+        Args:
+            step: the current step of the slots
+            max_len: the max decode steps of the slots
+            group: the slot indexes
+            slots: the status of all the slots
+            group_lprobs: lprobs of the rows of the group slots
+            tokens: the tokens of all the rows, will be updated
+            scores: the scores of all the rows, will be updated
+            cands_to_ignore: the ignore mask of every slot, will be updated
+            new_order: the decoder cache order, will be updated
+            finalized: the finished hypotheses of all the slots, will be updated
+
+        Returns:
+            the finished slot indexes
+        """
+        model = self.model
+        device = tokens.device
+        beam_size = self.beam_size
+        cand_size = 2 * beam_size
+        bsz = len(group)
+        group_index = torch.tensor(group, dtype=torch.long, device=device)
+        group_set = set(group)
+        rows = self._slot_rows(group, device)
+        group_tokens = tokens[rows]
+        group_scores = scores[rows]
+        group_cands_to_ignore = cands_to_ignore[group_index]
+        src_lengths = torch.tensor(
+            [slots[i].src_length for i in group], dtype=torch.long, device=device
+        )
+        original_batch_idxs = torch.tensor(
+            [slots[i].index for i in group], dtype=torch.long, device=device
+        )
+
+        if model.should_set_src_lengths:
+            model.token_sample.set_src_lengths(src_lengths)
+        if model.repeat_ngram_blocker is not None:
+            group_lprobs = model.repeat_ngram_blocker(
+                group_tokens[:, : step + 1], group_lprobs, bsz, beam_size, step
+            )
+
+        # Shape: (batch, cand_size)
+        cand_scores, cand_indices, cand_beams = model.token_sample.step(
+            step,
+            group_lprobs.view(bsz, -1, model.tgt_vocab_size),
+            group_scores.view(bsz, beam_size, -1)[:, :, :step],
+            group_tokens[:, : step + 1],
+            original_batch_idxs,
+        )
+        bbsz_offsets = (torch.arange(0, bsz, device=device) * beam_size).unsqueeze(1)
+        cand_bbsz_idx = cand_beams.add(bbsz_offsets)
+
+        # finalize hypotheses that end in eos
+        eos_mask = cand_indices.eq(model.eos) & cand_scores.ne(-math.inf)
+        eos_mask[:, :beam_size][group_cands_to_ignore] = torch.tensor(0).to(eos_mask)
+        eos_bbsz_idx = torch.masked_select(
+            cand_bbsz_idx[:, :beam_size], mask=eos_mask[:, :beam_size]
+        )
+        finalized_sents: List[int] = []
+        if eos_bbsz_idx.numel() > 0:
+            eos_scores = torch.masked_select(
+                cand_scores[:, :beam_size], mask=eos_mask[:, :beam_size]
+            )
+            finalized_sents = model.finalize_hypos(
+                step,
+                eos_bbsz_idx,
+                eos_scores,
+                group_tokens,
+                group_scores,
+                finalized,
+                # the slots out of the group are treated as finished, so the group rows are mapped to their slots
+                [slot_idx not in group_set for slot_idx in range(len(slots))],
+                beam_size,
+                None,
+                src_lengths,
+                max_len,
+            )
+
+        # the finished slots are also updated, they will be reset when the new sentences are admitted
+        eos_mask[:, :beam_size] = ~(
+            (~group_cands_to_ignore) & (~eos_mask[:, :beam_size])
+        )
+        cand_offsets = torch.arange(0, cand_size, device=device)
+        active_mask = torch.add(
+            eos_mask.type_as(cand_offsets) * cand_size,
+            cand_offsets[: eos_mask.size(1)],
+        )
+        new_cands_to_ignore, active_hypos = torch.topk(
+            active_mask, k=beam_size, dim=1, largest=False
+        )
+        cands_to_ignore[group_index] = new_cands_to_ignore.ge(cand_size)[:, :beam_size]
+        active_bbsz_idx = torch.gather(cand_bbsz_idx, dim=1, index=active_hypos).view(
+            -1
+        )
+
+        group_tokens[:, : step + 1] = torch.index_select(
+            group_tokens[:, : step + 1], dim=0, index=active_bbsz_idx
+        )
+        group_tokens.view(bsz, beam_size, -1)[:, :, step + 1] = torch.gather(
+            cand_indices, dim=1, index=active_hypos
+        )
+        if step > 0:
+            group_scores[:, :step] = torch.index_select(
+                group_scores[:, :step], dim=0, index=active_bbsz_idx
+            )
+        group_scores.view(bsz, beam_size, -1)[:, :, step] = torch.gather(
+            cand_scores, dim=1, index=active_hypos
+        )
+        tokens[rows] = group_tokens
+        scores[rows] = group_scores
+        new_order[rows] = rows[active_bbsz_idx]
+        return [group[i] for i in finalized_sents]
+
+    @torch.no_grad()
+    def generate(
+        self, sources: Iterable[Union[torch.Tensor, List[int]]]
+    ) -> Iterator[Tuple[int, List[Dict[str, torch.Tensor]]]]:
+        """generate the sentences, the new sentences are admitted when there are free slots
+
+        Args:
+            sources: the source token ids of every sentence, without padding
+
+        Yields:
+            the index of the sentence in the sources and its finalized hypotheses(sorted by the score), in the finished order
+        """
+        model = self.model
+        device = model.lm_head.weight.device
+        beam_size = self.beam_size
+        num_rows = self.max_sentences * beam_size
+        cache = model.decoder.init_slot_cache(num_rows, self.max_len + 1)
+        tokens = torch.full(
+            (num_rows, self.max_len + 2), model.pad, dtype=torch.long, device=device
+        )  # +2 for bos and pad
+        scores = torch.zeros(num_rows, self.max_len + 1, device=device)
+        cands_to_ignore = torch.zeros(
+            self.max_sentences, beam_size, dtype=torch.bool, device=device
+        )
+        slots: List[Optional[_Slot]] = [None for _ in range(self.max_sentences)]
+        finalized = FinalizedHypos(
+            self.max_sentences, beam_size, self.max_len + 1, device
+        )
+
+        pending = enumerate(sources)
+        exhausted = False
+        while True:
+            admitted = []
+            for slot_idx, slot in enumerate(slots):
+                if exhausted or slot is not None:
+                    continue
+                source = next(pending, None)
+                if source is None:
+                    exhausted = True
+                    break
+                index, src = source
+                admitted.append(
+                    (slot_idx, index, torch.as_tensor(src, dtype=torch.long))
+                )
+            if admitted:
+                self._admit(cache, slots, admitted, tokens, scores, cands_to_ignore)
+            if all(slot is None for slot in slots):
+                break
+
+            active = [
+                slot_idx for slot_idx, slot in enumerate(slots) if slot is not None
+            ]
+            lprobs = self._decode_step(cache, slots, active, tokens)
+            scores = scores.type_as(lprobs)
+
+            # the token sample needs the same step for the whole batch
+            groups: Dict[Tuple[int, int], List[int]] = {}
+            # the position of the slots in the lprobs
+            positions: Dict[int, int] = {}
+            for position, slot_idx in enumerate(active):
+                slot = slots[slot_idx]
+                groups.setdefault((slot.step, slot.max_len), []).append(slot_idx)
+                positions[slot_idx] = position
+            new_order = torch.arange(num_rows, device=device)
+            for (step, max_len), group in groups.items():
+                group_lprobs = lprobs[
+                    self._slot_rows([positions[slot_idx] for slot_idx in group], device)
+                ]
+                finished = self._sample_group(
+                    step,
+                    max_len,
+                    group,
+                    slots,
+                    group_lprobs,
+                    tokens,
+                    scores,
+                    cands_to_ignore,
+                    new_order,
+                    finalized,
+                )
+                for slot_idx in group:
+                    slots[slot_idx].step += 1
+                for slot_idx in finished:
+                    slot = slots[slot_idx]
+                    slots[slot_idx] = None
+                    hypos = finalized.hypos([slot_idx])[0]
+                    finalized.reset(slot_idx)
+                    yield slot.index, hypos
+            # reorder the decoder internal states based on the choice of beams
+            cache = model.decoder.reorder_incremental_state(cache, new_order)
+
+    def generate_all(
+        self, sources: Iterable[Union[torch.Tensor, List[int]]]
+    ) -> List[List[Dict[str, torch.Tensor]]]:
+        """generate all the sentences
+
+        Args:
+            sources: the source token ids of every sentence, without padding
+
+        Returns:
+            the finalized hypotheses of every sentence, in the order of the sources
+        """
+        results = {}
+        for index, hypos in self.generate(sources):
+            results[index] = hypos
+        return [results[i] for i in range(len(results))]
@@ -87,6 +87,76 @@ class BartLikeDecoder(SimpleModule):
         """
         self.bart_like_decoder.init_weight(method)
 
+    @property
+    def hidden_size(self) -> int:
+        """the size of the output hidden states"""
+        return self.bart_like_decoder.hidden_size
+
+    def init_incremental_state(self, max_len: int):
+        """the empty cache for the incremental decoding
+
+        Args:
+            max_len: the max decode steps
+
+        Returns:
+            the cache
+        """
+        return self.bart_like_decoder.init_incremental_state(max_len)
+
+    def init_slot_cache(self, num_slots: int, max_len: int):
+        """the cache for the continuous batching
+
+        Args:
+            num_slots: the number of the rows
+            max_len: the max decode steps
+
+        Returns:
+            the cache
+        """
+        return self.bart_like_decoder.init_slot_cache(num_slots, max_len)
+
+    def admit_slots(
+        self,
+        cache,
+        slots: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        encoder_mask: torch.Tensor,
+    ):
+        """put the new samples to the slots of the cache
+
+        Args:
+            cache: the cache from `init_slot_cache`
+            slots: the slot index of the new samples
+            encoder_hidden_states: the encoder outputs of the new samples
+            encoder_mask: the mask of the encoder outputs
+
+        Returns:
+            None
+        """
+        self.bart_like_decoder.admit_slots(
+            cache, slots, encoder_hidden_states, encoder_mask
+        )
+
+    def slot_forward(
+        self,
+        inputs_embeds: torch.Tensor,
+        steps: torch.Tensor,
+        cache,
+        rows: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """decode one step of the slots, every slot is at its own step
+
+        Args:
+            inputs_embeds: the embedding of the current tokens
+            steps: the current step of every row
+            cache: the cache from `init_slot_cache`
+            rows: the rows of the cache to decode, None means all the rows
+
+        Returns:
+            the decoder output embedding
+        """
+        return self.bart_like_decoder.slot_forward(inputs_embeds, steps, cache, rows)
+
     def reorder_incremental_state(
         self,
         decoder_past_cache,
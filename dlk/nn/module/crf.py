@@ -210,7 +210,7 @@ class ConditionalRandomField(Module):
         # Start transition and first emission
         # shape: (batch_size, num_tags)
         score = self.start_transitions + emissions[0]
-        history = torch.jit.annotate(List[int], [])
+        history = torch.jit.annotate(List[torch.Tensor], [])
 
         # score is a tensor of size (batch_size, num_tags) where for every batch,
         # value at column j stores the score of the best tag sequence so far that ends
@@ -249,32 +249,28 @@ class ConditionalRandomField(Module):
         # shape: (batch_size, num_tags)
         score += self.end_transitions
 
-        # Now, compute the best path for each sample
+        # Now, compute the best path for all samples at once
 
         # shape: (batch_size,)
         seq_ends = mask.long().sum(dim=0) - 1
-        best_tags_list = []
-        best_tags_list = torch.jit.annotate(List[List[int]], [])
-
-        for idx in range(batch_size):
-            # Find the tag which maximizes the score at the last timestep; this is our best tag
-            # for the last timestep
-            _, best_last_tag = score[idx].max(dim=0)
-            best_tags = [best_last_tag.item()]
-
-            # We trace back where the best last tag comes from, append that to our best tag
-            # sequence, and trace it back again, and so on
-            for hist in reversed(history[: seq_ends[idx]]):
-                best_last_tag = hist[idx][best_tags[-1]]
-                best_tags.append(best_last_tag.item())
-
-            # Reverse the order because we start from the last timestep
-            best_tags.reverse()
-            best_tags_list.append(best_tags)
-
-        output = torch.jit.annotate(List[List[int]], [])
-        for tag_list in best_tags_list:
-            if len(tag_list) < seq_length:
-                tag_list = tag_list + [-1] * (seq_length - len(tag_list))
-            output.append(tag_list)
-        return torch.tensor(output, dtype=torch.long, device=mask.device)
+        batch_index = torch.arange(batch_size, device=score.device)
+
+        # Find the tag which maximizes the score at the last timestep of every sample; this is
+        # the best tag for the last timestep, the positions after it are padded with -1
+        # shape: (batch_size,)
+        best_last_tags = score.argmax(dim=1)
+        # shape: (seq_length, batch_size)
+        best_tags = torch.full(
+            (seq_length, batch_size), -1, dtype=torch.long, device=score.device
+        )
+        best_tags[seq_ends, batch_index] = best_last_tags
+
+        # We trace back where the best tags come from for all samples together, a sample only
+        # starts to trace back when the timestep is not after its last timestep
+        for i in range(seq_length - 1, 0, -1):
+            # shape: (batch_size,)
+            prev_tags = history[i - 1].gather(1, best_last_tags.unsqueeze(1)).squeeze(1)
+            in_seq = i <= seq_ends
+            best_last_tags = torch.where(in_seq, prev_tags, best_last_tags)
+            best_tags[i - 1] = torch.where(in_seq, prev_tags, best_tags[i - 1])
+        return best_tags.transpose(0, 1).to(mask.device)
@@ -6,10 +6,11 @@
 
 import json
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from intc import (
     MISSING,
     AnyField,
@@ -37,6 +38,84 @@ class BartDecoderWrapConfig(Base):
     pretrained_model_path = StrField(value="???", help="the pretrained model path")
     from_pretrain = BoolField(value=True, help="from pretrained or not")
     freeze = BoolField(value=False, help="freeze or not")
+    output_attentions = BoolField(
+        value=False,
+        help="whether to return the self attentions and the cross attentions of all the layers, they are not used by the generation, so only set it when you need them",
+    )
+    output_hidden_states = BoolField(
+        value=False,
+        help="whether to return the hidden states of all the layers, they are not used by the generation, so only set it when you need them",
+    )
+
+
+class BartDecoderCache(object):
+    """the preallocated key/value cache of the bart decoder for the incremental decoding
+
+    The keys and values of all the layers are saved in one buffer, so the cache is written in place and reordered by one gather every step
+
+    Args:
+        max_len: the max decode steps
+
+    """
+
+    def __init__(self, max_len: int):
+        self.max_len = max_len
+        self.length = 0
+        # shape: (num_layers, 2, batch_size, num_heads, max_len, head_dim)
+        self.self_kv: Optional[torch.Tensor] = None
+        # shape: (num_layers, 2, batch_size, num_heads, src_len, head_dim)
+        self.cross_kv: Optional[torch.Tensor] = None
+        # the mask of the cross attention, only used by the continuous batching
+        # shape: (batch_size, src_len)
+        self.cross_mask: Optional[torch.Tensor] = None
+
+    def reorder(self, new_order: torch.Tensor) -> "BartDecoderCache":
+        """reorder the cache by the new_order
+
+        NOTE: if the batch size is not changed, the beams are only reordered in the same sentence(like the beam search), and the beams of one sentence share the same cross attention key/value, so only the self attention key/value are gathered
+
+        Args:
+            new_order: the new order of the batch
+
+        Returns:
+            the reordered cache
+        """
+        if self.self_kv is None:
+            return self
+        new_order = new_order.to(self.self_kv.device)
+        past = self.self_kv[..., : self.length, :].index_select(2, new_order)
+        if new_order.numel() == self.self_kv.size(2):
+            self.self_kv[..., : self.length, :] = past
+            return self
+        # the finished sentences are removed, shrink the buffer
+        shape = list(self.self_kv.shape)
+        shape[2] = new_order.numel()
+        self.self_kv = self.self_kv.new_empty(shape)
+        self.self_kv[..., : self.length, :] = past
+        if self.cross_kv is not None:
+            self.cross_kv = self.cross_kv.index_select(2, new_order)
+        if self.cross_mask is not None:
+            self.cross_mask = self.cross_mask.index_select(0, new_order)
+        return self
+
+    def to_legacy(self):
+        """convert to the past_key_values of the transformers
+
+        Returns:
+            the past_key_values of every layer like (self_key, self_value, cross_key, cross_value)
+        """
+        if self.self_kv is None:
+            return None
+        legacy = ()
+        for idx in range(self.self_kv.size(0)):
+            layer_past = (
+                self.self_kv[idx, 0, :, :, : self.length],
+                self.self_kv[idx, 1, :, :, : self.length],
+            )
+            if self.cross_kv is not None:
+                layer_past += (self.cross_kv[idx, 0], self.cross_kv[idx, 1])
+            legacy += (layer_past,)
+        return legacy
 
 
 @register("module", "bart_decoder")
@@ -76,6 +155,11 @@ class BartDecoderWrap(Module):
             self.bart_decoder_config, embed_tokens=embedding
         )
 
+    @property
+    def hidden_size(self) -> int:
+        """the size of the output hidden states"""
+        return self.bart_decoder_config.d_model
+
     def init_weight(self, method):
         """init the weight of model by 'bart_decoder.init_weight()' or from_pretrain
 
@@ -97,11 +181,24 @@ class BartDecoderWrap(Module):
             self.config.pretrained_model_path
         )
 
+    def init_incremental_state(self, max_len: int) -> BartDecoderCache:
+        """the empty preallocated cache for the incremental decoding, the buffers are allocated at the first step
+
+        Args:
+            max_len: the max decode steps
+
+        Returns:
+            the cache
+        """
+        return BartDecoderCache(max_len)
+
     def reorder_incremental_state(
         self,
         past_key_values,
         beam_idx,
     ):
+        if isinstance(past_key_values, BartDecoderCache):
+            return past_key_values.reorder(beam_idx)
         reordered_past = ()
         for layer_past in past_key_values:
             reordered_past += (
@@ -122,6 +219,24 @@ class BartDecoderWrap(Module):
             sequence_output, all_hidden_states, all_self_attentions
 
         """
+        past_caches = inputs.get("past_caches", None)
+        if isinstance(past_caches, BartDecoderCache):
+            if (
+                self.training
+                or self.config.output_attentions
+                or self.config.output_hidden_states
+                or inputs.get("decoder_attention_mask", None) is not None
+                or inputs.get("decoder_head_mask", None) is not None
+            ):
+                # the preallocated cache only supports the plain incremental decoding
+                inputs["past_caches"] = past_caches.to_legacy()
+            else:
+                hidden_states = self.cached_forward(
+                    inputs["inputs_embeds"],
+                    inputs.get("encoder_outputs", None),
+                    past_caches,
+                )
+                return hidden_states, past_caches, None, None, None
         if self.config.freeze:
             with torch.no_grad():
                 outputs = self.bart_decoder(
@@ -132,9 +247,9 @@ class BartDecoderWrap(Module):
                     past_key_values=inputs.get("past_caches", None),
                     inputs_embeds=inputs.get("inputs_embeds", None),
                     use_cache=True,
-                    output_attentions=True,
-                    output_hidden_states=True,
-                    return_dict=False,
+                    output_attentions=self.config.output_attentions,
+                    output_hidden_states=self.config.output_hidden_states,
+                    return_dict=True,
                 )
         else:
             outputs = self.bart_decoder(
@@ -145,25 +260,302 @@ class BartDecoderWrap(Module):
                 past_key_values=inputs.get("past_caches", None),
                 inputs_embeds=inputs["inputs_embeds"],
                 use_cache=True,
-                output_attentions=True,
-                output_hidden_states=True,
-                return_dict=False,
+                output_attentions=self.config.output_attentions,
+                output_hidden_states=self.config.output_hidden_states,
+                return_dict=True,
             )
-        assert (
-            len(outputs) == 5
-        ), f"Please check transformers version, the len(outputs) is 3 in version == 4.12|4.15"
-        # sequence_output, all_hidden_states, all_self_attentions = outputs[0], outputs[1], outputs[2]
-        (
-            hidden_states,
-            next_cache,
-            all_hidden_states,
-            all_self_attns,
-            all_cross_attentions,
-        ) = (outputs[0], outputs[1], outputs[2], outputs[3], outputs[4])
+        # NOTE: the all_hidden_states and the attentions are None if they are not required
         return (
-            hidden_states,
-            next_cache,
-            all_hidden_states,
-            all_self_attns,
-            all_cross_attentions,
+            outputs.last_hidden_state,
+            outputs.past_key_values,
+            outputs.hidden_states,
+            outputs.attentions,
+            outputs.cross_attentions,
+        )
+
+    def _attention(
+        self,
+        attention: nn.Module,
+        hidden_states: torch.Tensor,
+        key_states: torch.Tensor,
+        value_states: torch.Tensor,
+        attn_mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """the attention with the projected key and value
+
+        Args:
+            attention: the BartAttention module
+            hidden_states: the query hidden states, shape: (batch_size, tgt_len, embed_dim)
+            key_states: shape: (batch_size, num_heads, src_len, head_dim)
+            value_states: shape: (batch_size, num_heads, src_len, head_dim)
+            attn_mask: the bool mask, True means attend
+
+        Returns:
+            the attention outputs, shape: (batch_size, tgt_len, embed_dim)
+        """
+        bsz, tgt_len, _ = hidden_states.shape
+        query_states = (
+            attention.q_proj(hidden_states)
+            .view(bsz, tgt_len, attention.num_heads, attention.head_dim)
+            .transpose(1, 2)
+        )
+        outputs = F.scaled_dot_product_attention(
+            query_states, key_states, value_states, attn_mask=attn_mask
+        )
+        outputs = outputs.transpose(1, 2).reshape(bsz, tgt_len, attention.embed_dim)
+        return attention.out_proj(outputs)
+
+    def _project(
+        self, attention: nn.Module, hidden_states: torch.Tensor
+    ) -> torch.Tensor:
+        """project the hidden states to the key and value
+
+        Args:
+            attention: the BartAttention module
+            hidden_states: shape: (batch_size, seq_len, embed_dim)
+
+        Returns:
+            the stacked key and value, shape: (2, batch_size, num_heads, seq_len, head_dim)
+        """
+        bsz, seq_len, _ = hidden_states.shape
+        return torch.stack(
+            [
+                proj(hidden_states)
+                .view(bsz, seq_len, attention.num_heads, attention.head_dim)
+                .transpose(1, 2)
+                for proj in [attention.k_proj, attention.v_proj]
+            ]
+        )
+
+    def _cache_shape(self, batch_size: int, length: int):
+        """the shape of the key/value buffer of all the layers"""
+        attention = self.bart_decoder.layers[0].self_attn
+        return (
+            len(self.bart_decoder.layers),
+            2,
+            batch_size,
+            attention.num_heads,
+            length,
+            attention.head_dim,
+        )
+
+    def _decode_layers(
+        self,
+        hidden_states: torch.Tensor,
+        cache: BartDecoderCache,
+        steps: Union[slice, torch.Tensor],
+        self_mask: Optional[torch.Tensor],
+        encoder_hidden_states: Optional[torch.Tensor] = None,
+        rows: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """run the decoder layers, the new self attention key/value are written to the cache
+
+        Args:
+            hidden_states: the embedded new steps, shape: (batch_size, seq_len, embed_dim)
+            cache: the preallocated cache
+            steps: the positions of the new steps in the cache, a slice for all the samples or the position of every sample(seq_len must be 1)
+            self_mask: the bool mask of the self attention, True means attend
+            encoder_hidden_states: if provided, compute the cross attention key/value and save them to the cache
+            rows: the rows of the cache the hidden states belong to, None means all the rows. Only supported with the position of every sample
+
+        Returns:
+            the hidden states of the new steps
+        """
+        assert rows is None or not isinstance(
+            steps, slice
+        ), "The rows are only supported with the position of every sample"
+        end = steps.stop if isinstance(steps, slice) else int(steps.max().item()) + 1
+        if rows is None:
+            batch_index = torch.arange(
+                hidden_states.size(0), device=hidden_states.device
+            )
+        else:
+            batch_index = rows.to(hidden_states.device)
+        cross_mask = cache.cross_mask
+        if cross_mask is not None:
+            if rows is not None:
+                cross_mask = cross_mask[batch_index]
+            cross_mask = cross_mask[:, None, None, :]
+        for idx, layer in enumerate(self.bart_decoder.layers):
+            residual = hidden_states
+            kv = self._project(layer.self_attn, hidden_states)
+            if isinstance(steps, slice):
+                cache.self_kv[idx, :, :, :, steps] = kv
+            else:
+                # shape: (batch_size, 2, num_heads, head_dim)
+                cache.self_kv[idx][:, batch_index, :, steps] = kv[:, :, :, 0].transpose(
+                    0, 1
+                )
+            self_key = cache.self_kv[idx, 0, :, :, :end]
+            self_value = cache.self_kv[idx, 1, :, :, :end]
+            if rows is not None:
+                self_key, self_value = self_key[batch_index], self_value[batch_index]
+            hidden_states = self._attention(
+                layer.self_attn, hidden_states, self_key, self_value, self_mask
+            )
+            hidden_states = layer.self_attn_layer_norm(residual + hidden_states)
+
+            if cache.cross_kv is not None:
+                residual = hidden_states
+                if encoder_hidden_states is not None:
+                    cache.cross_kv[idx] = self._project(
+                        layer.encoder_attn, encoder_hidden_states
+                    )
+                cross_key, cross_value = cache.cross_kv[idx, 0], cache.cross_kv[idx, 1]
+                if rows is not None:
+                    cross_key = cross_key[batch_index]
+                    cross_value = cross_value[batch_index]
+                hidden_states = self._attention(
+                    layer.encoder_attn,
+                    hidden_states,
+                    cross_key,
+                    cross_value,
+                    cross_mask,
+                )
+                hidden_states = layer.encoder_attn_layer_norm(residual + hidden_states)
+
+            residual = hidden_states
+            hidden_states = layer.fc2(layer.activation_fn(layer.fc1(hidden_states)))
+            hidden_states = layer.final_layer_norm(residual + hidden_states)
+        return hidden_states
+
+    def cached_forward(
+        self,
+        inputs_embeds: torch.Tensor,
+        encoder_hidden_states: Optional[torch.Tensor],
+        cache: BartDecoderCache,
+    ) -> torch.Tensor:
+        """the incremental decoding which writes the key/value to the preallocated cache in place, this is the same as the `BartDecoder.forward` in eval mode
+
+        Args:
+            inputs_embeds: the new steps embedding, shape: (batch_size, seq_len, embed_dim)
+            encoder_hidden_states: the encoder outputs
+            cache: the preallocated cache, will be updated
+
+        Returns:
+            the hidden states of the new steps
+        """
+        decoder = self.bart_decoder
+        bsz, seq_len, _ = inputs_embeds.shape
+        start, end = cache.length, cache.length + seq_len
+        if cache.self_kv is None:
+            cache.self_kv = inputs_embeds.new_empty(
+                self._cache_shape(bsz, cache.max_len)
+            )
+        assert end <= cache.max_len, f"The decode steps is larger than {cache.max_len}"
+        if cache.cross_kv is None and encoder_hidden_states is not None:
+            cache.cross_kv = inputs_embeds.new_empty(
+                self._cache_shape(bsz, encoder_hidden_states.size(1))
+            )
+        else:
+            encoder_hidden_states = None
+
+        self_mask = None
+        if seq_len > 1:
+            # the new steps can see all the past steps and the previous new steps
+            self_mask = torch.ones(
+                seq_len, end, dtype=torch.bool, device=inputs_embeds.device
+            ).tril(diagonal=start)
+
+        positions = decoder.embed_positions(inputs_embeds, start)
+        hidden_states = inputs_embeds + positions.to(inputs_embeds.device)
+        hidden_states = decoder.layernorm_embedding(hidden_states)
+        hidden_states = self._decode_layers(
+            hidden_states, cache, slice(start, end), self_mask, encoder_hidden_states
+        )
+        cache.length = end
+        return hidden_states
+
+    def init_slot_cache(self, num_slots: int, max_len: int) -> BartDecoderCache:
+        """the cache for the continuous batching, every row(slot) of the cache is decoded at its own position, the sample in a slot is replaced by `admit_slots`
+
+        Args:
+            num_slots: the number of the rows
+            max_len: the max decode steps
+
+        Returns:
+            the cache
+        """
+        parameter = next(self.bart_decoder.parameters())
+        cache = BartDecoderCache(max_len)
+        # NOTE: zeros, the masked key/value should not be nan
+        cache.self_kv = parameter.new_zeros(self._cache_shape(num_slots, max_len))
+        return cache
+
+    def admit_slots(
+        self,
+        cache: BartDecoderCache,
+        slots: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        encoder_mask: torch.Tensor,
+    ):
+        """put the new samples to the slots of the cache, compute their cross attention key/value
+
+        Args:
+            cache: the cache from `init_slot_cache`
+            slots: the slot index of the new samples
+            encoder_hidden_states: the encoder outputs of the new samples
+            encoder_mask: the mask of the encoder outputs, 1 for the real tokens
+
+        Returns:
+            None
+        """
+        num_slots = cache.self_kv.size(2)
+        src_len = encoder_hidden_states.size(1)
+        if cache.cross_kv is None or cache.cross_kv.size(4) < src_len:
+            cross_kv = cache.self_kv.new_zeros(self._cache_shape(num_slots, src_len))
+            # the empty slots attend to the zeros, so there is no nan
+            cross_mask = torch.ones(
+                num_slots, src_len, dtype=torch.bool, device=cross_kv.device
+            )
+            if cache.cross_kv is not None:
+                old_len = cache.cross_kv.size(4)
+                cross_kv[..., :old_len, :] = cache.cross_kv
+                cross_mask[:, old_len:] = False
+                cross_mask[:, :old_len] = cache.cross_mask
+            cache.cross_kv, cache.cross_mask = cross_kv, cross_mask
+        slots = slots.to(cache.self_kv.device)
+        cache.cross_mask[slots] = False
+        cache.cross_mask[slots, :src_len] = encoder_mask.bool()
+        for idx, layer in enumerate(self.bart_decoder.layers):
+            cache.cross_kv[idx][:, slots, :, :src_len] = self._project(
+                layer.encoder_attn, encoder_hidden_states
+            )
+
+    def slot_forward(
+        self,
+        inputs_embeds: torch.Tensor,
+        steps: torch.Tensor,
+        cache: BartDecoderCache,
+        rows: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """decode one step of the slots, every slot is at its own step
+
+        Args:
+            inputs_embeds: the embedding of the current tokens, shape: (num_rows, 1, embed_dim)
+            steps: the current step of every row, shape: (num_rows)
+            cache: the cache from `init_slot_cache`
+            rows: the rows(slots) of the cache to decode, the other rows are not computed. None means all the rows of the cache
+
+        Returns:
+            the hidden states, shape: (num_rows, 1, embed_dim)
+        """
+        decoder = self.bart_decoder
+        steps = steps.to(inputs_embeds.device)
+        end = int(steps.max().item()) + 1
+        assert end <= cache.max_len, f"The decode steps is larger than {cache.max_len}"
+        # shape: (num_slots, 1, 1, end)
+        self_mask = (torch.arange(end, device=steps.device)[None, :] <= steps[:, None])[
+            :, None, None, :
+        ]
+        positions = F.embedding(
+            steps + decoder.embed_positions.offset, decoder.embed_positions.weight
+        )
+        hidden_states = inputs_embeds + positions[:, None, :]
+        hidden_states = decoder.layernorm_embedding(hidden_states)
+        hidden_states = self._decode_layers(
+            hidden_states, cache, steps, self_mask, rows=rows
         )
+        # the used length of the cache, the reorder only gathers this part
+        cache.length = end
+        return hidden_states
@@ -28,6 +28,8 @@ from intc import (
 from tokenizers import Tokenizer
 
 from dlk.nn.base_module import BaseModel
+from dlk.nn.token_sample.beam_search import BeamSearch
+from dlk.nn.token_sample.sampling import Sampling
 from dlk.utils.ngram_repeat_block import NGramRepeatBlock
 from dlk.utils.register import register, register_module_name
 
@@ -80,6 +82,11 @@ class TokenGenBaseConfig(Base):
         value=1,
         help="the minimum length of the generated output(not including end-of-sentence)",
     )
+    speculative_steps = IntField(
+        value=0,
+        minimum=0,
+        help="if > 0, use the speculative decoding, the draft decoder(the `token_gen_decoder` submodule named with the `draft` suffix, like `@token_gen_decoder@bart_like_decoder#draft`) proposes `speculative_steps` tokens and the decoder verifies them in one forward. Only support the `beam_size==1` with the `beam_search`(greedy) or the `sampling` token_sample, the draft decoder shares the embedding and the lm head with the decoder, it is not trained or saved to the checkpoint and is always initialized from its own config, so it should be loaded from a pretrained(like distilled) model by its `from_pretrain` and `pretrained_model_path`",
+    )
     tgt_eos = StrField(value=MISSING, help="the end of sentence token")
     tgt_pad = StrField(value=MISSING, help="the padding token")
     tgt_unk = StrField(value=MISSING, help="the unknown token")
@@ -172,6 +179,141 @@ class SpecialVocab(object):
         return self.tokenizer.get_vocab_size()
 
 
+class FinalizedHypos(object):
+    """the finished hypotheses of a batch, kept in the preallocated tensors and sorted by the score only when they are fetched
+
+    Args:
+        bsz: the number of the sentences
+        beam_size: the max number of the hypotheses of one sentence
+        max_len: the max length of the hypotheses(including the eos)
+        device: the device of the buffers
+
+    """
+
+    def __init__(self, bsz: int, beam_size: int, max_len: int, device):
+        self.beam_size = beam_size
+        self.max_len = max_len
+        self.tokens = torch.zeros(
+            bsz, beam_size, max_len, dtype=torch.long, device=device
+        )
+        self.positional_scores = torch.zeros(bsz, beam_size, max_len, device=device)
+        self.scores = torch.full((bsz, beam_size), -math.inf, device=device)
+        self.lengths = torch.zeros(bsz, beam_size, dtype=torch.long, device=device)
+        # the number of the finished hypotheses of every sentence
+        self.counts = torch.zeros(bsz, dtype=torch.long, device=device)
+        self.attention: Optional[torch.Tensor] = None
+
+    def add(
+        self,
+        sent: torch.Tensor,
+        step: int,
+        tokens: torch.Tensor,
+        positional_scores: torch.Tensor,
+        scores: torch.Tensor,
+        attention: Optional[torch.Tensor] = None,
+    ):
+        """add the hypotheses which end at the `step`, the hypotheses beyond the `beam_size` of their sentence are dropped
+
+        Args:
+            sent: (num_hypos) the sentence index of every hypothesis
+            step: the eos step of the hypotheses
+            tokens: (num_hypos, step + 1)
+            positional_scores: (num_hypos, step + 1)
+            scores: (num_hypos)
+            attention: (num_hypos, src_len, step + 1) or None
+
+        Returns:
+            None
+
+        """
+        # the rank of every hypothesis in its sentence, the same sentence hypotheses keep the input order
+        sorted_sent, order = sent.sort(stable=True)
+        _, sent_counts = torch.unique_consecutive(sorted_sent, return_counts=True)
+        starts = (sent_counts.cumsum(0) - sent_counts).repeat_interleave(sent_counts)
+        rank = torch.empty_like(sent)
+        rank[order] = torch.arange(sent.numel(), device=sent.device) - starts
+        slot = self.counts[sent] + rank
+        keep = slot < self.beam_size
+        sent, slot = sent[keep], slot[keep]
+
+        self.tokens[sent, slot, : step + 1] = tokens[keep]
+        self.positional_scores[sent, slot, : step + 1] = positional_scores[keep].to(
+            self.positional_scores
+        )
+        self.scores[sent, slot] = scores[keep].to(self.scores)
+        self.lengths[sent, slot] = step + 1
+        if attention is not None:
+            if self.attention is None:
+                self.attention = attention.new_zeros(
+                    *self.scores.shape, attention.size(1), self.max_len
+                )
+            self.attention[sent, slot, :, : step + 1] = attention[keep]
+        self.counts.index_add_(0, sent, torch.ones_like(sent))
+
+    def reset(self, sent: int):
+        """drop the hypotheses of the sentence, so the buffers could be reused by a new sentence
+
+        Args:
+            sent: the sentence index
+
+        Returns:
+            None
+
+        """
+        self.counts[sent] = 0
+
+    def hypos(
+        self, sents: Optional[List[int]] = None
+    ) -> List[List[Dict[str, torch.Tensor]]]:
+        """the finished hypotheses of the sentences, sorted by the score descending
+
+        Args:
+            sents: the sentence indexes, None for all the sentences
+
+        Returns:
+            the hypotheses of every sentence
+
+        """
+        device = self.scores.device
+        if sents is None:
+            index = torch.arange(self.scores.size(0), device=device)
+        else:
+            index = torch.tensor(sents, dtype=torch.long, device=device)
+        counts = self.counts[index]
+        empty = torch.arange(self.beam_size, device=device) >= counts.unsqueeze(1)
+        _, order = (
+            self.scores[index]
+            .masked_fill(empty, -math.inf)
+            .sort(dim=1, descending=True, stable=True)
+        )
+        rows = index.unsqueeze(1)
+        # NOTE: the advanced indexing copies the hypotheses, so the buffers could be reused after fetching
+        tokens = self.tokens[rows, order]
+        positional_scores = self.positional_scores[rows, order]
+        scores = self.scores[rows, order]
+        attention = self.attention[rows, order] if self.attention is not None else None
+        lengths: List[List[int]] = self.lengths[rows, order].tolist()
+        result: List[List[Dict[str, torch.Tensor]]] = []
+        for i, count in enumerate(counts.tolist()):
+            result.append(
+                [
+                    {
+                        "tokens": tokens[i, j, : lengths[i][j]],
+                        "score": scores[i, j],
+                        "attention": (
+                            attention[i, j, :, : lengths[i][j]]
+                            if attention is not None
+                            else torch.empty(0)
+                        ),  # src_len x tgt_len
+                        "alignment": torch.empty(0),
+                        "positional_scores": positional_scores[i, j, : lengths[i][j]],
+                    }
+                    for j in range(count)
+                ]
+            )
+        return result
+
+
 class TokenGenBase(nn.Module):
     def __init__(
         self, config: TokenGenBaseConfig, checkpoint, encoder_type: str = "encoder"
@@ -213,18 +355,60 @@ class TokenGenBase(nn.Module):
                 register_module_name(encoder_configs[0]._module_name),
             )(config=encoder_configs[0], embedding=self.src_embedding)
 
-        decoder_configs = config._get_modules("token_gen_decoder")
-        assert len(decoder_configs) == 1
-        if config.share_embedding:
-            self.decoder = register.get(
-                "token_gen_decoder",
-                register_module_name(decoder_configs[0]._module_name),
-            )(config=decoder_configs[0], embedding=self.embedding)
+        init_method_configs = config._get_modules("initmethod")
+        if len(init_method_configs) == 0:
+            init_method = register.get("initmethod", "default")(config=None)
         else:
-            self.decoder = register.get(
+            assert len(init_method_configs) == 1
+            init_method_config = init_method_configs[0]
+            init_method = register.get(
+                "initmethod", register_module_name(init_method_config._module_name)
+            )(config=init_method_config)
+
+        decoder_configs = []
+        draft_decoder_configs = []
+        for name, decoder_config in config._get_named_modules(
+            "token_gen_decoder"
+        ).items():
+            if name.endswith("#draft"):
+                draft_decoder_configs.append(decoder_config)
+            else:
+                decoder_configs.append(decoder_config)
+        assert len(decoder_configs) == 1
+        assert len(draft_decoder_configs) <= 1
+        decoder_embedding = (
+            self.embedding if config.share_embedding else self.tgt_embedding
+        )
+        self.decoder = register.get(
+            "token_gen_decoder",
+            register_module_name(decoder_configs[0]._module_name),
+        )(config=decoder_configs[0], embedding=decoder_embedding)
+        # NOTE: the draft decoder is not a registered submodule, so it is not in the state dict, the optimizer
+        # or the DDP, and it is always initialized from its own config(like the `pretrained_model_path`) even
+        # if the model is loaded from a checkpoint. It is moved with the model by the `_apply`.
+        draft_decoder = None
+        if draft_decoder_configs:
+            draft_decoder = register.get(
                 "token_gen_decoder",
-                register_module_name(decoder_configs[0]._module_name),
-            )(config=decoder_configs[0], embedding=self.tgt_embedding)
+                register_module_name(draft_decoder_configs[0]._module_name),
+            )(config=draft_decoder_configs[0], embedding=decoder_embedding)
+            assert hasattr(
+                draft_decoder, "init_incremental_state"
+            ), "the draft decoder must support the preallocated cache"
+            assert (
+                getattr(draft_decoder, "hidden_size", None)
+                == self.config.decoder_hidden_size
+            ), "the draft decoder shares the lm head with the decoder, its hidden size must be the `decoder_hidden_size`"
+            draft_decoder.init_weight(init_method)
+            draft_decoder.eval()
+        object.__setattr__(self, "draft_decoder", draft_decoder)
+        if self.config.speculative_steps > 0:
+            assert (
+                self.draft_decoder is not None
+            ), "the speculative decoding needs a `token_gen_decoder` named with the `draft` suffix"
+            assert (
+                self.config.beam_size == 1
+            ), "the speculative decoding only support beam_size == 1"
 
         self.lm_head = nn.Linear(
             self.config.decoder_hidden_size,
@@ -232,15 +416,6 @@ class TokenGenBase(nn.Module):
             bias=self.config.lm_head_bias,
         )
         if not checkpoint:
-            init_method_configs = config._get_modules("initmethod")
-            if len(init_method_configs) == 0:
-                init_method = register.get("initmethod", "default")()
-            else:
-                assert len(init_method_configs) == 1
-                init_method_config = init_method_configs[0]
-                init_method = register.get(
-                    "initmethod", register_module_name(init_method_config._module_name)
-                )(config=init_method_config)
             if self.config.share_embedding:
                 self.embedding.apply(init_method)
             else:
@@ -275,6 +450,11 @@ class TokenGenBase(nn.Module):
                 register_module_name(token_sample_configs[0]._module_name),
             )(self.tgt_dict, token_sample_configs[0])
 
+        if self.config.speculative_steps > 0:
+            assert isinstance(
+                self.token_sample, (BeamSearch, Sampling)
+            ), "the speculative decoding only support the `beam_search` and `sampling` token_sample"
+
         # We only need to set src_lengths in LengthConstrainedBeamSearch.
         # As a module attribute, setting it would break in multithread
         # settings when the model is shared.
@@ -290,6 +470,13 @@ class TokenGenBase(nn.Module):
         else:
             self.should_set_src_lengths = False
 
+    def _apply(self, fn, *args, **kwargs):
+        """apply the `fn` to the draft decoder too, like the device and dtype conversion"""
+        super()._apply(fn, *args, **kwargs)
+        if self.draft_decoder is not None:
+            self.draft_decoder._apply(fn, *args, **kwargs)
+        return self
+
     def forward(self, inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         """do forward on a mini batch
 
@@ -378,8 +565,15 @@ class TokenGenBase(nn.Module):
         raise NotImplementedError
 
     def _generate_tokens(self, bsz, beam_size, max_len, encoder_outs, src_lengths=None):
+        if self.config.speculative_steps > 0:
+            return self._speculative_generate_tokens(
+                bsz, max_len, encoder_outs, src_lengths
+            )
         target_device = encoder_outs[self.config.output_map.decoder_target_ids].device
         decoder_past_cache = None
+        if hasattr(self.decoder, "init_incremental_state"):
+            # one extra step for EOS marker
+            decoder_past_cache = self.decoder.init_incremental_state(max_len + 1)
         # initialize buffers
         scores = (
             torch.zeros(bsz * beam_size, max_len + 1).to(target_device).float()
@@ -402,10 +596,9 @@ class TokenGenBase(nn.Module):
         )  # forward and backward-compatible False mask
 
         # list of completed sentences
-        finalized = torch.jit.annotate(
-            List[List[Dict[str, torch.Tensor]]],
-            [torch.jit.annotate(List[Dict[str, torch.Tensor]], []) for i in range(bsz)],
-        )  # contains lists of dictionaries of information about the hypothesis being finalized at each step
+        finalized = FinalizedHypos(
+            bsz, beam_size, max_len + 1, target_device
+        )  # contains the information about the hypothesis being finalized at each step
 
         # a boolean array indicating if the sentence at the index is finished or not
         finished = [False for i in range(bsz)]
@@ -444,9 +637,13 @@ class TokenGenBase(nn.Module):
                 decoder_past_cache = self.decoder.reorder_incremental_state(
                     decoder_past_cache, reorder_state
                 )
-                encoder_outs = self.encoder.reorder_encoder_out(
-                    encoder_outs, reorder_state
-                )
+                # NOTE: the beams are only reordered in the same sentence and the beams of one
+                # sentence share the same encoder outputs, so the encoder outputs only need to
+                # be gathered when the finished sentences are removed from the batch
+                if batch_idxs is not None:
+                    encoder_outs = self.encoder.reorder_encoder_out(
+                        encoder_outs, reorder_state
+                    )
             encoder_outs[self.config.input_map.decoder_input_ids] = tokens[
                 :, : step + 1
             ]
@@ -468,9 +665,9 @@ class TokenGenBase(nn.Module):
                     )
                     * self.embedding_scale
                 )
-            encoder_outs[
-                self.decoder.config.input_map.decoder_input_embedding
-            ] = decoder_embedding
+            encoder_outs[self.decoder.config.input_map.decoder_input_embedding] = (
+                decoder_embedding
+            )
             decoder_outs = self.decoder.forward(encoder_outs, decoder_past_cache)
             decoder_past_cache = decoder_outs[
                 self.decoder.config.output_map.decoder_past_cache
@@ -698,16 +895,258 @@ class TokenGenBase(nn.Module):
             reorder_state = active_bbsz_idx
 
         # sort by score descending
-        for sent in range(len(finalized)):
-            scores = torch.tensor(
-                [float(elem["score"].item()) for elem in finalized[sent]]
+        return finalized.hypos()
+
+    def _decode_logits(self, decoder, inputs, input_ids, decoder_past_cache):
+        """decode the `input_ids` with the preallocated cache and get the lm logits
+
+        Args:
+            decoder: the decoder or the draft decoder
+            inputs: the encoder outputs
+            input_ids: (bsz, seq_len) the new input tokens
+            decoder_past_cache: the cache of the decoder, updated in place
+
+        Returns:
+            logits: (bsz, seq_len, vocab_size)
+
+        """
+        if self.config.share_embedding:
+            decoder_embedding = self.embedding.forward(input_ids)
+        else:
+            decoder_embedding = self.tgt_embedding.forward(input_ids)
+        inputs[decoder.config.input_map.decoder_input_embedding] = (
+            decoder_embedding * self.embedding_scale
+        )
+        decoder_outs = decoder.forward(inputs, decoder_past_cache)
+        if (
+            decoder_outs[decoder.config.output_map.decoder_past_cache]
+            is not decoder_past_cache
+        ):
+            # the rollback only resets the length of the preallocated cache
+            raise ValueError(
+                "The speculative decoding needs the decoder to update the preallocated cache in place, "
+                "the decoder attention mask, the head mask and the `output_attentions`/`output_hidden_states` are not supported"
+            )
+        return self.lm_head(
+            decoder_outs[decoder.config.output_map.decoder_output_embedding]
+        )
+
+    def _constrain_lprobs(self, lprobs, step: int, max_len: int, prev_tokens):
+        """apply the same constraints as the `_generate_tokens` on the lprobs of one step, only for beam_size == 1
+
+        Args:
+            lprobs: (bsz, vocab_size), will be modified in place
+            step: the step of the lprobs
+            max_len: the max generate length
+            prev_tokens: (bsz, step + 1) the tokens before the step
+
+        Returns:
+            lprobs
+
+        """
+        lprobs[lprobs != lprobs] = -math.inf
+        if self.pad != self.eos:
+            lprobs[:, self.pad] = -math.inf
+        if self.bos != self.eos:
+            lprobs[:, self.bos] = -math.inf
+        if self.unk != self.eos:
+            lprobs[:, self.unk] -= self.config.unk_penalty
+        if step >= max_len:
+            lprobs[:, : self.eos] = -math.inf
+            lprobs[:, self.eos + 1 :] = -math.inf
+        if step < self.config.min_len:
+            assert self.config.min_len < max_len
+            lprobs[:, self.eos] = -math.inf
+        if self.repeat_ngram_blocker is not None:
+            lprobs = self.repeat_ngram_blocker(
+                prev_tokens, lprobs, lprobs.size(0), 1, step
             )
-            _, sorted_scores_indices = torch.sort(scores, descending=True)
-            finalized[sent] = [finalized[sent][ssi] for ssi in sorted_scores_indices]
-            finalized[sent] = torch.jit.annotate(
-                List[Dict[str, torch.Tensor]], finalized[sent]
+        return lprobs
+
+    def _speculative_generate_tokens(
+        self, bsz, max_len, encoder_outs, src_lengths=None
+    ):
+        """the greedy or sampling generation with the speculative decoding.
+        Every iteration the draft decoder proposes `speculative_steps` tokens one by one and the decoder
+        scores all of them in one forward, the greedy decoding accepts the drafts which equal to the argmax of
+        the decoder and the sampling decoding accepts them by the rejection sampling, so the outputs follow the
+        same distribution as the decoder only generation.
+
+        NOTE: all the sentences in the batch advance the same number of tokens(the minimum accepted length) to
+        keep the caches aligned, the caches are rolled back by the `length`.
+
+        Args:
+            bsz: the batch size
+            max_len: the max generate length
+            encoder_outs: the encoder outputs
+            src_lengths: the source lengths
+
+        Returns:
+            the finalized hypos
+
+        """
+        target_device = encoder_outs[self.config.output_map.decoder_target_ids].device
+        sampling = isinstance(self.token_sample, Sampling)
+        draft_outs = dict(encoder_outs)
+        decoder_past_cache = self.decoder.init_incremental_state(max_len + 1)
+        draft_past_cache = self.draft_decoder.init_incremental_state(max_len + 1)
+        scores = torch.zeros(bsz, max_len + 1).to(target_device).float()
+        tokens = torch.zeros(bsz, max_len + 2).to(target_device).long().fill_(self.pad)
+        tokens[:, 0] = self.bos
+        finalized = FinalizedHypos(bsz, 1, max_len + 1, target_device)
+        finished = [False for i in range(bsz)]
+        # the index of the sentence in the original batch for each row
+        sent_idxs = list(range(bsz))
+
+        step = 0
+        while True:
+            num_drafts = min(self.config.speculative_steps, max_len - step)
+            drafts: List[torch.Tensor] = []
+            draft_probs: List[torch.Tensor] = []
+            for i in range(num_drafts):
+                prev_tokens = torch.cat([tokens[:, : step + 1]] + drafts, dim=1)
+                draft_lprobs = self._decode_logits(
+                    self.draft_decoder,
+                    draft_outs,
+                    prev_tokens[:, draft_past_cache.length :],
+                    draft_past_cache,
+                )[:, -1]
+                draft_lprobs = self._constrain_lprobs(
+                    draft_lprobs, step + i, max_len, prev_tokens
+                )
+                if sampling:
+                    probs = self.token_sample.sample_probs(draft_lprobs.unsqueeze(1))
+                    draft_probs.append(probs.squeeze(1))
+                    drafts.append(torch.multinomial(probs.squeeze(1), 1))
+                else:
+                    drafts.append(draft_lprobs.argmax(dim=-1, keepdim=True))
+
+            # verify all the drafts in one forward
+            prev_tokens = torch.cat([tokens[:, : step + 1]] + drafts, dim=1)
+            logits = self._decode_logits(
+                self.decoder, encoder_outs, prev_tokens[:, step:], decoder_past_cache
             )
-        return finalized
+            lprobs = torch.stack(
+                [
+                    self._constrain_lprobs(
+                        logits[:, i], step + i, max_len, prev_tokens[:, : step + i + 1]
+                    )
+                    for i in range(num_drafts + 1)
+                ],
+                dim=1,
+            )
+            draft_tokens = prev_tokens[:, step + 1 :]
+            if sampling:
+                probs = self.token_sample.sample_probs(lprobs)
+                # no draft for the last position, the residual is the decoder distribution
+                draft_probs.append(torch.zeros_like(probs[:, 0]))
+                all_draft_probs = torch.stack(draft_probs, dim=1)
+                target_prob = probs[:, :num_drafts].gather(
+                    2, draft_tokens.unsqueeze(-1)
+                )
+                draft_prob = all_draft_probs[:, :num_drafts].gather(
+                    2, draft_tokens.unsqueeze(-1)
+                )
+                accepted = (
+                    torch.rand_like(draft_prob) * draft_prob < target_prob
+                ).squeeze(-1)
+                num_accepted = accepted.long().cumprod(dim=1).sum(dim=1)
+                row_idxs = torch.arange(tokens.size(0), device=target_device)
+                # sample the first rejected position from the residual distribution
+                residual = (
+                    probs[row_idxs, num_accepted]
+                    - all_draft_probs[row_idxs, num_accepted]
+                ).clamp_(min=0)
+                residual_sum = residual.sum(dim=-1, keepdim=True)
+                residual = torch.where(
+                    residual_sum > 0,
+                    residual / residual_sum.clamp(min=1e-12),
+                    probs[row_idxs, num_accepted],
+                )
+                correction = torch.multinomial(residual, 1).squeeze(1)
+            else:
+                best = lprobs.argmax(dim=-1)
+                accepted = best[:, :num_drafts] == draft_tokens
+                num_accepted = accepted.long().cumprod(dim=1).sum(dim=1)
+                correction = best.gather(1, num_accepted.unsqueeze(1)).squeeze(1)
+
+            num_emit = int(num_accepted.min().item()) + 1
+            emitted = torch.cat([draft_tokens, correction.unsqueeze(1)], dim=1)[
+                :, :num_emit
+            ]
+            emitted[:, -1] = torch.where(
+                num_accepted == num_emit - 1, correction, emitted[:, -1]
+            )
+            step_scores = (
+                lprobs[:, :num_emit].gather(2, emitted.unsqueeze(-1)).squeeze(-1)
+            ).cumsum(dim=1)
+            if step > 0:
+                step_scores = step_scores + scores[:, step - 1 : step]
+            tokens[:, step + 1 : step + num_emit + 1] = emitted
+            scores[:, step : step + num_emit] = step_scores
+
+            eos_mask = emitted.eq(self.eos) & step_scores.ne(-math.inf)
+            has_eos = eos_mask.any(dim=1)
+            finalized_rows: List[int] = []
+            if has_eos.any():
+                eos_steps = eos_mask.long().argmax(dim=1)
+                eos_steps_list: List[int] = eos_steps.tolist()
+                eos_rows: List[int] = has_eos.nonzero().squeeze(1).tolist()
+                # `finalize_hypos` maps the rows to the sentences by `finished`,
+                # so all the groups must see the `finished` before this iteration
+                finished_before = list(finished)
+                for eos_step in sorted(set(eos_steps_list[row] for row in eos_rows)):
+                    bbsz_idx = torch.tensor(
+                        [row for row in eos_rows if eos_steps_list[row] == eos_step],
+                        device=target_device,
+                    )
+                    finalized_rows.extend(
+                        self.finalize_hypos(
+                            step + eos_step,
+                            bbsz_idx,
+                            step_scores[bbsz_idx, eos_step],
+                            tokens,
+                            scores,
+                            finalized,
+                            list(finished_before),
+                            1,
+                            None,
+                            src_lengths,
+                            max_len,
+                        )
+                    )
+                for row in finalized_rows:
+                    finished[sent_idxs[row]] = True
+            if len(finalized_rows) == tokens.size(0):
+                break
+
+            step += num_emit
+            decoder_past_cache.length = step
+            draft_past_cache.length = min(draft_past_cache.length, step)
+            if finalized_rows:
+                batch_mask = torch.ones(
+                    tokens.size(0), dtype=torch.bool, device=target_device
+                )
+                batch_mask[finalized_rows] = False
+                batch_idxs = torch.arange(
+                    tokens.size(0), device=target_device
+                ).masked_select(batch_mask)
+                sent_idxs = [sent_idxs[row] for row in batch_idxs.tolist()]
+                tokens = tokens[batch_idxs]
+                scores = scores[batch_idxs]
+                if src_lengths is not None:
+                    src_lengths = src_lengths[batch_idxs]
+                decoder_past_cache = self.decoder.reorder_incremental_state(
+                    decoder_past_cache, batch_idxs
+                )
+                draft_past_cache = self.draft_decoder.reorder_incremental_state(
+                    draft_past_cache, batch_idxs
+                )
+                encoder_outs = self.encoder.reorder_encoder_out(
+                    encoder_outs, batch_idxs
+                )
+                draft_outs = dict(encoder_outs)
+        return finalized.hypos()
 
     def _prefix_tokens(
         self, step: int, lprobs, scores, tokens, prefix_tokens, beam_size: int
@@ -750,7 +1189,7 @@ class TokenGenBase(nn.Module):
         eos_scores,
         tokens,
         scores,
-        finalized: List[List[Dict[str, torch.Tensor]]],
+        finalized: FinalizedHypos,
         finished: List[bool],
         beam_size: int,
         attn: Optional[torch.Tensor],
@@ -759,6 +1198,7 @@ class TokenGenBase(nn.Module):
     ):
         """Finalize hypothesis, store finalized information in `finalized`, and change `finished` accordingly.
         A sentence is finalized when {beam_size} finished items have been collected for it.
+        All the hypotheses are added to the preallocated buffers of `finalized` at once, without per hypothesis loop.
 
         Returns number of sentences (not beam items) being finalized.
         These will be removed from the batch and not processed further.
@@ -791,32 +1231,15 @@ class TokenGenBase(nn.Module):
         if self.config.normalize_scores:
             eos_scores /= (step + 1) ** self.config.len_penalty
 
-        # cum_unfin records which sentences in the batch are finished.
-        # It helps match indexing between (a) the original sentences
-        # in the batch and (b) the current, possibly-reduced set of
-        # sentences.
-        cum_unfin: List[int] = []
-        prev = 0
-        # [1, 0, 1, 0, 0, 1]
-        # [1, 2, 2]
-        for f in finished:
-            if f:
-                prev += 1
-            else:
-                cum_unfin.append(prev)
-        cum_fin_tensor = torch.tensor(cum_unfin, dtype=torch.int).to(bbsz_idx)
-
+        # map the rows of the current(possibly reduced) batch to the sentences of the original batch
+        unfinished = (
+            (~torch.tensor(finished, dtype=torch.bool))
+            .nonzero()
+            .squeeze(1)
+            .to(bbsz_idx)
+        )
         unfin_idx = torch.div(bbsz_idx, beam_size, rounding_mode="trunc")
-        sent = unfin_idx + torch.index_select(cum_fin_tensor, 0, unfin_idx)
-
-        # Create a set of "{sent}{unfin_idx}", where
-        # "unfin_idx" is the index in the current (possibly reduced)
-        # list of sentences, and "sent" is the index in the original,
-        # unreduced batch
-        # For every finished beam item
-        # sentence index in the current (possibly reduced) batch
-        seen = (sent << 32) + unfin_idx
-        unique_seen: List[int] = torch.unique(seen).tolist()
+        sent = unfinished[unfin_idx]
 
         # NOTE: only for token encode and token decode model should we consider the match_source_len
         if (
@@ -825,55 +1248,18 @@ class TokenGenBase(nn.Module):
         ):
             condition = step > torch.index_select(src_lengths, 0, unfin_idx)
             eos_scores = torch.where(condition, torch.tensor(-math.inf), eos_scores)
-        sent_list: List[int] = sent.tolist()
-        for i in range(bbsz_idx.size()[0]):
-            # An input sentence (among those in a batch) is finished when
-            # beam_size hypotheses have been collected for it
-            if len(finalized[sent_list[i]]) < beam_size:
-                if attn_clone is not None:
-                    # remove padding tokens from attn scores
-                    hypo_attn = attn_clone[i]
-                else:
-                    hypo_attn = torch.empty(0)
-
-                finalized[sent_list[i]].append(
-                    {
-                        "tokens": tokens_clone[i],
-                        "score": eos_scores[i],
-                        "attention": hypo_attn,  # src_len x tgt_len
-                        "alignment": torch.empty(0),
-                        "positional_scores": pos_scores[i],
-                    }
-                )
-
-        newly_finished: List[int] = []
-        for unique_s in unique_seen:
-            # check termination conditions for this sentence
-            unique_sent: int = unique_s >> 32
-            unique_unfin_idx: int = unique_s - (unique_sent << 32)
-
-            if not finished[unique_sent] and self.is_finished(
-                step, unique_unfin_idx, max_len, len(finalized[unique_sent]), beam_size
-            ):
-                finished[unique_sent] = True
-                newly_finished.append(unique_unfin_idx)
-
+        finalized.add(sent, step, tokens_clone, pos_scores, eos_scores, attn_clone)
+
+        # An input sentence (among those in a batch) is finished when
+        # beam_size hypotheses have been collected for it, or when we reach the maximum length
+        unique_unfin_idx = torch.unique(unfin_idx)
+        if step < max_len:
+            unique_unfin_idx = unique_unfin_idx[
+                finalized.counts[unfinished[unique_unfin_idx]] == beam_size
+            ]
+        newly_finished, newly_finished_sents = torch.stack(
+            [unique_unfin_idx, unfinished[unique_unfin_idx]]
+        ).tolist()
+        for unique_sent in newly_finished_sents:
+            finished[unique_sent] = True
         return newly_finished
-
-    def is_finished(
-        self,
-        step: int,
-        unfin_idx: int,
-        max_len: int,
-        finalized_sent_len: int,
-        beam_size: int,
-    ):
-        """
-        Check whether decoding for a sentence is finished, which
-        occurs when the list of finalized sentences has reached the
-        beam size, or when we reach the maximum length.
-        """
-        assert finalized_sent_len <= beam_size
-        if finalized_sent_len == beam_size or step == max_len:
-            return True
-        return False
@@ -93,6 +93,26 @@ class Sampling(Sample):
         trimed_probs = truncated_probs.masked_fill_(trim_mask, 0)
         return trimed_probs, truncated_indices
 
+    def sample_probs(self, lprobs):
+        """the normalized distribution over the whole vocab which the `step` samples from
+
+        Args:
+            lprobs: (bsz x input_beam_size x vocab_size), will not be modified
+
+        Returns:
+            probs: (bsz x input_beam_size x vocab_size)
+        """
+        if self.sampling_topp > 0:
+            probs, top_indices = self._sample_topp(lprobs.clone())
+            probs = torch.zeros_like(lprobs).scatter_(2, top_indices, probs)
+            return probs / probs.sum(dim=-1, keepdim=True)
+        elif self.sampling_topk > 0:
+            top_lprobs, top_indices = lprobs.topk(self.sampling_topk)
+            return torch.zeros_like(lprobs).scatter_(
+                2, top_indices, top_lprobs.softmax(dim=-1)
+            )
+        return lprobs.softmax(dim=-1)
+
     def step(
         self,
         step: int,
@@ -4,47 +4,183 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
-from typing import Any, Callable, Dict, List, Union
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Union
 
+import pandas as pd
 import torch
 
 from dlk.predict import Predict
 
 logger = logging.getLogger(__name__)
 
+# the end of the pipeline
+_STOP = object()
+
+
+class _StageError(object):
+    """wrap the exception raised in one stage, and pass it to the downstream stages"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
 
 class OnlinePredict(Predict):
     """OnlinePredict"""
 
     def __init__(self, config: Union[str, dict], checkpoint: str, update_config=None):
         super(OnlinePredict, self).__init__(config, checkpoint, update_config)
-        datamodule, _ = self.get_datamodule(
-            self.dlk_config, {}, world_size=self.trainer.world_size
-        )
+        # NOTE: the online predict runs in the current process, so the trainer is never created
+        datamodule, _ = self.get_datamodule(self.dlk_config, {}, world_size=1)
         self.online = True
         self.datamodule = datamodule
 
-    def predict(self, data):
-        """init the model, datamodule, manager then predict the predict_dataloader
+    def forward(self, data: pd.DataFrame) -> List[Dict]:
+        """collate the data and forward the model
 
         Args:
             data: the preprocessed data
 
         Returns:
-            None
+            the outputs of all the batches
 
         """
-        # get data
-        dataloader = self.datamodule.online_dataloader(data)
         result = []
         with torch.no_grad():
-            for i, batch in enumerate(dataloader):
+            for i, batch in enumerate(self.datamodule.online_dataloader(data)):
                 result.append(self.imodel.predict_step(batch, i))
-        # start predict
+        return result
+
+    def postprocess(self, list_batch_outputs: List[Dict], data: pd.DataFrame):
+        """convert the model outputs to the human readable predicts
+
+        Args:
+            list_batch_outputs: the outputs of all the batches
+            data: the preprocessed data
+
+        Returns:
+            the predicts
+
+        """
         return self.imodel.postprocessor(
             stage="online",
-            list_batch_outputs=result,
+            list_batch_outputs=list_batch_outputs,
             origin_data=data,
             rt_config={},
             save_condition=False,
         )
+
+    def predict(self, data):
+        """init the model, datamodule, manager then predict the predict_dataloader
+
+        Args:
+            data: the preprocessed data
+
+        Returns:
+            the predicts
+
+        """
+        return self.postprocess(self.forward(data), data)
+
+    def pipeline_predict(
+        self,
+        inputs: Iterable[pd.DataFrame],
+        processor: Union[Callable[[pd.DataFrame], pd.DataFrame], None] = None,
+        queue_size: int = 2,
+    ) -> Iterator:
+        """predict a stream of data, the preprocess, the model forward and the postprocess run in different threads
+
+        The preprocess of the data `N+1` and the postprocess of the data `N-1` overlap with the model forward of the data `N`. The tokenizers and torch release the GIL, so the idle cores could be used while torch runs.
+
+        Args:
+            inputs: the stream of the data
+            processor: the preprocess function(like `PreProcessor.fit`), if not provided, the inputs should be the preprocessed data
+            queue_size: the max number of the data waiting between two stages
+
+        Returns:
+            the generator of the predicts, one for every input data, in the same order as the inputs
+
+        """
+        preprocess_queue = queue.Queue(maxsize=queue_size)
+        processed_queue = queue.Queue(maxsize=queue_size)
+        forward_queue = queue.Queue(maxsize=queue_size)
+        result_queue = queue.Queue(maxsize=queue_size)
+        stop_event = threading.Event()
+
+        def put(out_queue: queue.Queue, item):
+            # NOTE: check the stop_event, so the stage will not be blocked forever when the consumer stops early
+            while not stop_event.is_set():
+                try:
+                    out_queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def read_inputs():
+            try:
+                for data in inputs:
+                    if stop_event.is_set():
+                        return
+                    put(preprocess_queue, data)
+                put(preprocess_queue, _STOP)
+            except BaseException as e:
+                put(preprocess_queue, _StageError(e))
+
+        def stage(fn: Callable, in_queue: queue.Queue, out_queue: queue.Queue):
+            def run():
+                while not stop_event.is_set():
+                    try:
+                        item = in_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is _STOP or isinstance(item, _StageError):
+                        put(out_queue, item)
+                        return
+                    try:
+                        put(out_queue, fn(item))
+                    except BaseException as e:
+                        put(out_queue, _StageError(e))
+                        return
+
+            return run
+
+        def preprocess(data: pd.DataFrame):
+            if processor is not None:
+                data = processor(data)
+            return data
+
+        def forward(data: pd.DataFrame):
+            return self.forward(data), data
+
+        def postprocess(item):
+            return self.postprocess(*item)
+
+        threads = [
+            threading.Thread(target=read_inputs, daemon=True),
+            threading.Thread(
+                target=stage(preprocess, preprocess_queue, processed_queue),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=stage(forward, processed_queue, forward_queue), daemon=True
+            ),
+            threading.Thread(
+                target=stage(postprocess, forward_queue, result_queue), daemon=True
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = result_queue.get()
+                if item is _STOP:
+                    return
+                if isinstance(item, _StageError):
+                    raise item.error
+                yield item
+        finally:
+            stop_event.set()
+            # NOTE: the reader thread may be blocked by the inputs iterator, it is a daemon thread, so we do not wait for it
+            for thread in threads[1:]:
+                thread.join()
@@ -9,9 +9,10 @@ import logging
 import os
 import pickle as pkl
 import uuid
-from typing import Any, Callable, Dict, List, Union
+from typing import Any, Callable, Dict, Iterator, List, Union
 
 import hjson
+import pandas as pd
 import torch
 from intc import (
     MISSING,
@@ -30,7 +31,14 @@ from intc import (
     init_config,
 )
 
+from dlk.data.processed_data import (
+    iter_processed_data,
+    load_processed_data,
+    save_manifest,
+    save_shards,
+)
 from dlk.train import DLKFitConfig
+from dlk.utils.import_module import import_config_modules
 from dlk.utils.io import open
 from dlk.utils.register import register, register_module_name
 
@@ -57,11 +65,8 @@ class Predict(object):
                 config_dict = hjson.load(f, object_pairs_hook=dict)
         else:
             config_dict = config
-        if isinstance(checkpoint, str):
-            with open(checkpoint, "rb") as f:
-                self.checkpoint = torch.load(f, map_location=torch.device("cpu"))
-        else:
-            self.checkpoint = torch.load(checkpoint, map_location=torch.device("cpu"))
+        self.checkpoint = self.load_checkpoint(checkpoint)
+        self._trainer = None
         dlk_config, name_str = self.get_config(config_dict, update_config)
         self.dlk_config = dlk_config
         self.init(dlk_config, name_str)
@@ -75,6 +80,7 @@ class Predict(object):
         Returns:
             DLKFitConfig, config_name_str
         """
+        import_config_modules([config_dict, update_config])
         configs = Parser(config_dict, update_config=update_config).parser_init()
         assert len(configs) == 1, f"You should not use '_search' for predict/online"
 
@@ -84,19 +90,50 @@ class Predict(object):
         return fit_config, config_name_str
 
     def init(self, config, name):
-        """init the model and trainer
+        """init the model, the trainer will be created when it is used
         Args:
             config: the config
             name: the name of the config
 
         Returns: None
         """
-        # set trainer
-        self.trainer = self.get_trainer(config, name)
+        self.name = name
 
         # init imodel and inject the origin test and valid data
         self.imodel = self.get_imodel(config)
 
+    @property
+    def trainer(self):
+        """the trainer, only the offline predict needs the trainer, so it is created when first used and the online predict will skip it"""
+        if self._trainer is None:
+            self._trainer = self.get_trainer(self.dlk_config, self.name)
+        return self._trainer
+
+    @staticmethod
+    def load_checkpoint(checkpoint) -> Dict:
+        """load the checkpoint to cpu
+
+        Args:
+            checkpoint: the path to the checkpoint or the file-like object
+
+        Returns:
+            the loaded checkpoint
+
+        """
+        if isinstance(checkpoint, str) and os.path.isfile(checkpoint):
+            # NOTE: the local checkpoint is loaded by mmap, the tensors are read from the disk when they are copied to the model, so there is no extra copy of the weights
+            try:
+                return torch.load(
+                    checkpoint, map_location=torch.device("cpu"), mmap=True
+                )
+            except (RuntimeError, TypeError):
+                # the legacy(not zipfile) format could not be loaded by mmap, and torch < 2.1 does not support the `mmap` argument
+                logger.info(f"Could not load the {checkpoint} by mmap, fallback")
+        if isinstance(checkpoint, str):
+            with open(checkpoint, "rb") as f:
+                return torch.load(f, map_location=torch.device("cpu"))
+        return torch.load(checkpoint, map_location=torch.device("cpu"))
+
     def predict(self, data=None, save_condition=False):
         """init the model, datamodule, manager then predict the predict_dataloader
 
@@ -125,6 +162,93 @@ class Predict(object):
             save_condition=save_condition,
         )
 
+    def iter_parts(
+        self, data: Union[pd.DataFrame, None] = None, chunk_size: int = -1
+    ) -> Iterator[pd.DataFrame]:
+        """iterate the predict data part by part, the shards of the processed predict data are loaded lazily
+
+        Args:
+            data: if provide will not load from the processed_data_dir
+            chunk_size: the max rows of one part, -1 means one shard is one part
+
+        Returns:
+            Iterable DataFrame
+
+        """
+        if data is None:
+            shards = iter_processed_data(
+                os.path.join(self.dlk_config.processed_data_dir, "predict")
+            )
+        else:
+            shards = [data]
+        for shard in shards:
+            if chunk_size <= 0 or len(shard) <= chunk_size:
+                yield shard
+                continue
+            for start in range(0, len(shard), chunk_size):
+                yield shard.iloc[start : start + chunk_size].reset_index(drop=True)
+
+    def iter_predict(
+        self, data: Union[pd.DataFrame, None] = None, chunk_size: int = -1
+    ) -> Iterator[List]:
+        """predict the data part by part and yield the predicts of every part, so only the outputs of one part are held in memory
+
+        Args:
+            data: if provide will not load from the processed_data_dir
+            chunk_size: the max rows of one part, -1 means one shard is one part
+
+        Returns:
+            the generator of the predicts of every part
+
+        """
+        for part in self.iter_parts(data, chunk_size):
+            datamodule, _ = self.get_datamodule(
+                self.dlk_config, {"predict": part}, world_size=self.trainer.world_size
+            )
+            with torch.no_grad():
+                predict_result = self.trainer.predict(
+                    model=self.imodel, datamodule=datamodule
+                )
+            yield self.imodel.postprocessor(
+                stage="predict",
+                list_batch_outputs=predict_result,
+                origin_data=part,
+                rt_config={},
+                save_condition=False,
+            )
+
+    def predict_to_shards(
+        self,
+        save_dir: str,
+        data: Union[pd.DataFrame, None] = None,
+        chunk_size: int = -1,
+        data_format: str = "parquet",
+    ) -> int:
+        """predict the data part by part and save the predicts of every part to one shard as soon as it is produced
+
+        Args:
+            save_dir: the dir to save the predict shards and the manifest, the shards could be loaded by `dlk.data.processed_data.iter_processed_data`
+            data: if provide will not load from the processed_data_dir
+            chunk_size: the max rows of one part, -1 means one shard is one part
+            data_format: `pickle` or `parquet`
+
+        Returns:
+            the number of the predicts
+
+        """
+        os.makedirs(save_dir, exist_ok=True)
+        shards = []
+        save_manifest(save_dir, shards)
+        for part, predicts in enumerate(self.iter_predict(data, chunk_size)):
+            shards.extend(
+                save_shards(
+                    pd.DataFrame(predicts), save_dir, part, data_format=data_format
+                )
+            )
+            # NOTE: update the manifest for every part, so the finished parts could be consumed before all the data is predicted
+            save_manifest(save_dir, shards)
+        return sum(shard["rows"] for shard in shards)
+
     def get_data(self, config):
         """get the data decided by config
 
@@ -137,10 +261,11 @@ class Predict(object):
         """
         data = {}
         for data_type in ["predict"]:
-            data_path = os.path.join(config.processed_data_dir, data_type, "0.pkl")
-            if os.path.exists(data_path):
-                with open(data_path, "rb") as f:
-                    data[data_type] = pkl.load(f)
+            loaded_data = load_processed_data(
+                os.path.join(config.processed_data_dir, data_type)
+            )
+            if loaded_data is not None:
+                data[data_type] = loaded_data
         return data
 
     def get_datamodule(self, config, data, world_size):
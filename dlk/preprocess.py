@@ -26,6 +26,7 @@ from intc import (
 
 import dlk.data.processor
 import dlk.data.subprocessor
+from dlk.utils.import_module import import_config_modules
 from dlk.utils.io import open
 from dlk.utils.register import register, register_module_name
 
@@ -62,12 +63,22 @@ class PreProcessor(object):
         processor_ins = register.get("processor", process_name)(
             config=config, stage=stage
         )
+        self.processor_instance = processor_ins
         if stage in ["train", "predict"]:
             self.processor = processor_ins.process
         else:
             assert stage == "online", f"stage {stage} is not supported"
             self.processor = processor_ins.online_process
 
+    def input_columns(self) -> set:
+        """the columns may be consumed by the processor
+
+        Returns:
+            the column names
+
+        """
+        return self.processor_instance.input_columns()
+
     def get_config(self, config_dict, update_config=None):
         """get the predict config
 
@@ -77,6 +88,7 @@ class PreProcessor(object):
         Returns:
             DLKPreProConfig, config_name_str
         """
+        import_config_modules([config_dict, update_config])
         configs = Parser(config_dict, update_config=update_config).parser_init()
         assert len(configs) == 1, f"You should not use '_search' for preprocess"
 
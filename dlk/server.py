@@ -3,29 +3,58 @@
 # This source code is licensed under the Apache license found in the
 # LICENSE file in the root directory of this source tree.
 
+import asyncio
+import hashlib
 import logging
-from typing import Any, Callable, Dict, List, Union
+import pickle as pkl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
 
 import pandas as pd
 
 from dlk.online import OnlinePredict
 from dlk.preprocess import PreProcessor
+from dlk.utils.result_cache import ResultCache
 
 logger = logging.getLogger(__name__)
 
 
 class Server(object):
-    """Demo"""
+    """Demo
+
+    Args:
+        process_config: the path to process config or the config dict
+        fit_config: the path to fit config or the config dict
+        checkpoint: the path to the checkpoint
+        cache_size: the max number of the cached results, the result of one input row is cached by the hash of the row columns consumed by the processor, 0 means disable the cache
+        cache_ttl: the seconds a cached result lives, -1 means never expire
+        cache_max_bytes: the max memory(the pickled size) of the cached results, -1 means no limit
+
+    """
 
     def __init__(
         self,
         process_config: Union[str, Dict] = "/path/to/config",
         fit_config: Union[str, Dict] = "/path/to/config",
         checkpoint: str = "/path/to/checkpoint",
+        cache_size: int = 0,
+        cache_ttl: float = -1,
+        cache_max_bytes: int = -1,
     ):
         super(Server, self).__init__()
+        self.fit_config = fit_config
         self.processor = self.get_processor(process_config)
         self.predictor = self.get_predictor(fit_config, checkpoint)
+        self.cache = (
+            ResultCache(cache_size, ttl=cache_ttl, max_bytes=cache_max_bytes)
+            if cache_size > 0
+            else None
+        )
+        self._cache_columns: Dict[Tuple, List[str]] = {}
+        # NOTE: the generation is increased by every reload, the predicts of an in-flight request which started before the reload are not cached
+        self._generation = 0
+        self._cache_lock = threading.Lock()
 
     def fit(self, input_df: pd.DataFrame) -> Dict:
         """use the model to get the result of the data want to predict
@@ -37,10 +66,131 @@ class Server(object):
             the prediction result
 
         """
+        if self.cache is None:
+            return self._fit(input_df)
+        input_df = input_df.reset_index(drop=True)
+        keys = self.cache_keys(input_df)
+        results = [self.cache.get(key) for key in keys]
+        hits = [i for i, result in enumerate(results) if result is not None]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            generation = self._generation
+            predicts = self._fit(input_df.iloc[missing].reset_index(drop=True))
+            if len(predicts) != len(missing):
+                # NOTE: the processor drops or expands the rows(like the stride tokenizer), the predicts can not be mapped to the rows, so they are not cached, and if some rows hit the cache, all the rows are predicted again to keep the order
+                logger.warning(
+                    f"Got {len(predicts)} predicts for {len(missing)} input rows, the predicts are not cached"
+                )
+                return predicts if not hits else self._fit(input_df)
+            with self._cache_lock:
+                if generation == self._generation:
+                    for i, predict in zip(missing, predicts):
+                        self.cache.put(keys[i], predict)
+            for i, predict in zip(missing, predicts):
+                results[i] = predict
+        if hits:
+            origin_input_map = self.origin_input_map()
+            for i in hits:
+                self.update_origin(results[i], input_df.iloc[i], origin_input_map)
+        return results
+
+    def _fit(self, input_df: pd.DataFrame):
+        """process and predict the input_df without the cache"""
         processed_data = self.processor.fit(input_df)
-        result = self.predictor.predict.predict(processed_data)
+        result = self.predictor.predict(processed_data)
         return result
 
+    def cache_keys(self, input_df: pd.DataFrame) -> List[str]:
+        """the cache key of every row, which is the hash of the columns consumed by the processor
+
+        Args:
+            input_df: the input data
+
+        Returns:
+            the keys
+
+        """
+        all_columns = tuple(input_df.columns)
+        if all_columns not in self._cache_columns:
+            input_columns = self.processor.input_columns()
+            columns = [column for column in all_columns if column in input_columns]
+            if not columns:
+                logger.warning(
+                    f"None of the input columns {all_columns} is consumed by the processor, the cache key will use all the columns"
+                )
+                columns = list(all_columns)
+            self._cache_columns[all_columns] = columns
+        columns = self._cache_columns[all_columns]
+        return [
+            hashlib.md5(
+                pkl.dumps((columns, row), protocol=pkl.HIGHEST_PROTOCOL)
+            ).hexdigest()
+            for row in input_df[columns].itertuples(index=False, name=None)
+        ]
+
+    def origin_input_map(self) -> Dict[str, str]:
+        """the postprocessor copies these columns of the input data to the predict, like the `uuid`
+
+        Returns:
+            the map from the predict key to the input column
+
+        """
+        postprocessor = self.predictor.imodel.postprocessor
+        config = getattr(postprocessor, "config", None)
+        if config is None:
+            return {}
+        return config._to_dict().get("origin_input_map", {})
+
+    @staticmethod
+    def update_origin(predict, row: pd.Series, origin_input_map: Dict[str, str]):
+        """the cached predict is from another request, update the copied input columns(like the `uuid`) to the current row
+
+        Args:
+            predict: the cached predict
+            row: the current input row
+            origin_input_map: the map from the predict key to the input column
+
+        Returns:
+            None
+
+        """
+        if not isinstance(predict, dict):
+            return
+        for key, column in origin_input_map.items():
+            if key in predict and column in row:
+                predict[key] = row[column]
+
+    def reload(self, checkpoint: str, fit_config: Union[str, Dict, None] = None):
+        """reload the predictor from the checkpoint, the cached results are dropped and the in-flight requests will not cache their predicts
+
+        Args:
+            checkpoint: the path to the new checkpoint
+            fit_config: the path to config or the config dict, if not provided, use the origin fit_config
+
+        Returns:
+            None
+
+        """
+        if fit_config is not None:
+            self.fit_config = fit_config
+        self.predictor = self.get_predictor(self.fit_config, checkpoint)
+        with self._cache_lock:
+            self._generation += 1
+            if self.cache is not None:
+                self.cache.clear()
+
+    def pipeline_fit(self, input_dfs: Iterable[pd.DataFrame]) -> Iterator:
+        """predict a stream of data, the preprocess of the next data and the postprocess of the last data overlap with the model forward
+
+        Args:
+            input_dfs: the stream of the input data
+
+        Returns:
+            the generator of the prediction results, in the same order as the input_dfs
+
+        """
+        return self.predictor.pipeline_predict(input_dfs, processor=self.processor.fit)
+
     def get_processor(self, config: Union[str, Dict]) -> PreProcessor:
         """get the preprocessor instance
 
@@ -64,3 +214,245 @@ class Server(object):
 
         """
         return OnlinePredict(config, checkpoint)
+
+
+class MicroBatchServer(Server):
+    """Coalesce the concurrent requests into micro batches
+
+    The requests are queued by `async_fit`, and a background task collects them into one batch until
+    the batch has `max_batch_size` rows or the first request has waited `max_wait_ms`. The processor
+    and the model run once for the whole batch, and the results are scattered back to the requests.
+
+    >>> server = MicroBatchServer(process_config, fit_config, checkpoint)
+    >>> result = await server.async_fit(input_df)
+    """
+
+    def __init__(
+        self,
+        process_config: Union[str, Dict] = "/path/to/config",
+        fit_config: Union[str, Dict] = "/path/to/config",
+        checkpoint: str = "/path/to/checkpoint",
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        cache_size: int = 0,
+        cache_ttl: float = -1,
+        cache_max_bytes: int = -1,
+    ):
+        super(MicroBatchServer, self).__init__(
+            process_config,
+            fit_config,
+            checkpoint,
+            cache_size=cache_size,
+            cache_ttl=cache_ttl,
+            cache_max_bytes=cache_max_bytes,
+        )
+        assert max_batch_size >= 1, f"max_batch_size must be >= 1"
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # NOTE: the model runs in one background thread, so the event loop will not be blocked and the model is never called concurrently
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue: Union[asyncio.Queue, None] = None
+        self._worker: Union[asyncio.Task, None] = None
+        # the request which will make the current batch exceed the max_batch_size, it will be the first request of the next batch
+        self._pending: Union[Tuple[pd.DataFrame, asyncio.Future], None] = None
+        # the requests of the batch which is predicting in the executor
+        self._running: List[Tuple[pd.DataFrame, asyncio.Future]] = []
+
+    async def start(self):
+        """start the batching task in the running event loop
+
+        Returns:
+            None
+
+        """
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self):
+        """stop the batching task, the queued and the predicting requests will be cancelled
+
+        Returns:
+            None
+
+        """
+        if self._worker is None:
+            return
+        # NOTE: the running requests are dropped when the worker is cancelled, so get them first
+        requests = list(self._running)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        if self._pending:
+            requests.append(self._pending)
+        while not self._queue.empty():
+            requests.append(self._queue.get_nowait())
+        for _, future in requests:
+            future.cancel()
+        self._worker = None
+        self._pending = None
+        self._running = []
+
+    async def async_fit(self, input_df: pd.DataFrame) -> List:
+        """queue the request and wait for the result
+
+        Args:
+            input_df: the one input data, it could be only one row or multiple rows(batch)
+
+        Returns:
+            the prediction result of the input_df
+
+        """
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((input_df, future))
+        return await future
+
+    def fit_batch(self, input_dfs: List[pd.DataFrame]) -> List[Union[List, Exception]]:
+        """process and predict the input_dfs together, if the batch failed, the requests are retried one by one so only the failed request gets the exception
+
+        Args:
+            input_dfs: the input data of the requests
+
+        Returns:
+            the prediction result or the exception of every input_df
+
+        """
+        if len(input_dfs) > 1:
+            try:
+                return self._fit_coalesced(input_dfs)
+            except Exception:
+                logger.exception(
+                    f"Predict the {len(input_dfs)} coalesced requests failed, retry them one by one"
+                )
+        results: List[Union[List, Exception]] = []
+        for input_df in input_dfs:
+            try:
+                results.append(self.fit(input_df))
+            except Exception as e:
+                logger.exception(f"Predict the request failed")
+                results.append(e)
+        return results
+
+    def _fit_coalesced(self, input_dfs: List[pd.DataFrame]) -> List[List]:
+        """predict the concatenated input_dfs and scatter the predicts back to the requests
+
+        The rows are tagged by `(request_id, row_id)` in the `uuid` column, which is copied to the predict by the postprocessor, so the predicts are scattered by the tag even if the processor drops or expands(like the stride tokenizer) the rows. The origin `uuid` is restored after scattering.
+
+        Args:
+            input_dfs: the input data of the requests
+
+        Returns:
+            the prediction result of every input_df
+
+        """
+        uuid_column = self.origin_input_map().get("uuid")
+        if not uuid_column:
+            # NOTE: no tag column, the predicts can only be split by the position
+            sizes = [len(input_df) for input_df in input_dfs]
+            predicts = self.fit(pd.concat(input_dfs, ignore_index=True))
+            if len(predicts) != sum(sizes):
+                raise ValueError(
+                    f"The number of the predicts {len(predicts)} is not equal to the number of the input rows {sum(sizes)}, and there is no uuid to scatter the predicts"
+                )
+            results = []
+            start = 0
+            for size in sizes:
+                results.append(predicts[start : start + size])
+                start += size
+            return results
+
+        tagged = [
+            input_df.assign(**{uuid_column: [(i, j) for j in range(len(input_df))]})
+            for i, input_df in enumerate(input_dfs)
+        ]
+        origin_uuids = [
+            input_df[uuid_column].tolist() if uuid_column in input_df else None
+            for input_df in input_dfs
+        ]
+        predicts = self.fit(pd.concat(tagged, ignore_index=True))
+        results: List[List] = [[] for _ in input_dfs]
+        for predict in predicts:
+            tag = predict.get("uuid") if isinstance(predict, dict) else None
+            if not (isinstance(tag, tuple) and len(tag) == 2):
+                raise ValueError(f"The predict is not tagged by the request: {tag}")
+            i, j = tag
+            if origin_uuids[i] is None:
+                predict.pop("uuid")
+            else:
+                predict["uuid"] = origin_uuids[i][j]
+            results[i].append(predict)
+        return results
+
+    async def _collect(self) -> List[Tuple[pd.DataFrame, asyncio.Future]]:
+        """collect the requests for one batch
+
+        Returns:
+            the requests of one batch
+
+        """
+        loop = asyncio.get_running_loop()
+        if self._pending is not None:
+            first, self._pending = self._pending, None
+        else:
+            first = await self._queue.get()
+        requests = [first]
+        num_rows = len(first[0])
+        deadline = loop.time() + self.max_wait
+        while num_rows < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if num_rows + len(request[0]) > self.max_batch_size:
+                self._pending = request
+                break
+            requests.append(request)
+            num_rows += len(request[0])
+        return requests
+
+    async def _batch_loop(self):
+        """the batching task, collect the requests, predict them and scatter the results
+
+        Returns:
+            None
+
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [
+                request
+                for request in await self._collect()
+                if not request[1].cancelled()
+            ]
+            if not requests:
+                continue
+            self._running = requests
+            try:
+                results = await loop.run_in_executor(
+                    self._executor,
+                    self.fit_batch,
+                    [input_df for input_df, _ in requests],
+                )
+            except Exception as e:
+                logger.exception(f"Predict the batch failed")
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self._running = []
+            for (_, future), result in zip(requests, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
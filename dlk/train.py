@@ -42,6 +42,8 @@ import dlk.nn
 import dlk.optimizer
 import dlk.scheduler
 import dlk.trainer
+from dlk.data.processed_data import load_processed_data
+from dlk.utils.import_module import import_config_modules
 from dlk.utils.io import open
 from dlk.utils.register import register, register_module_name
 
@@ -92,6 +94,7 @@ class Train(object):
 
         self.checkpoint = checkpoint
         self.state_dict_only = state_dict_only
+        import_config_modules([config_dict, update_config])
         self.configs = Parser(config_dict, update_config=update_config).parser_init()
         if self.checkpoint:
             assert (
@@ -188,14 +191,13 @@ class Train(object):
         Returns:
             loaded all the processed data
         """
-        # NOTE: currently only support load one data for each type
-        # TODO: support load multi data for each type
         data = {}
         for data_type in ["train", "valid", "test"]:
-            data_path = os.path.join(config.processed_data_dir, data_type, "0.pkl")
-            if os.path.exists(data_path):
-                with open(data_path, "rb") as f:
-                    data[data_type] = pkl.load(f)
+            loaded_data = load_processed_data(
+                os.path.join(config.processed_data_dir, data_type)
+            )
+            if loaded_data is not None:
+                data[data_type] = loaded_data
         return data
 
     def get_datamodule(self, config: DLKFitConfig, world_size):
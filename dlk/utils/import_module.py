@@ -3,11 +3,172 @@
 # This source code is licensed under the Apache license found in the
 # LICENSE file in the root directory of this source tree.
 
+"""
+Import the modules in the module dir
+
+By default the modules are imported lazily: `import_module_dir` only scans the `@register(type, name)` and `@cregister(type, name)` in the module files and records the module path of every name, and the module is imported when the name is first used by `register.get` or by the config. Set the environment variable `DLK_EAGER_IMPORT=1` to import all the modules at once.
+"""
+
 import importlib
 import os
+import re
+from typing import Dict, List, Set, Tuple, Union
+
+from intc.register import ic_repo
+from intc.share import registry as config_registry
+
+from dlk.utils.register import add_lazy_module, register, register_module_name
+
+TRUE_VALUES = {"1", "True", "true", "TRUE", "YES", "yes", "Yes"}
+
+# the `@register("type", "name")`, `@cregister("type", "name")` or `register("type", "name")(Module)`
+REGISTER_PATTERN = re.compile(
+    r'^@?(c?register)\(\s*"([^"]*)"\s*(?:,\s*"([^"]*)"\s*)?\)', re.MULTILINE
+)
+
+# (register kind, type, name) -> module path, the kind is `register` for the modules and `cregister` for the configs
+lazy_index: Dict[Tuple[str, str, str], str] = {}
+_indexed_dirs: Set[str] = set()
+_loaded_configs: Set[Tuple[str, str]] = set()
+
+
+def eager_import() -> bool:
+    """whether to import all the modules at once, the intc language server needs all the configs"""
+    return (
+        os.environ.get("DLK_EAGER_IMPORT", "0") in TRUE_VALUES
+        or os.environ.get("IN_INTC", "0") in TRUE_VALUES
+    )
+
+
+def index_module_file(path: str, module: str):
+    """record the registered names in the module file
+
+    Args:
+        path: the module file path
+        module: the module path
+
+    Returns:
+        None
+
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    for kind, type_name, name in REGISTER_PATTERN.findall(content):
+        lazy_index[(kind, type_name, name)] = module
+        add_lazy_module(
+            config_registry if kind == "cregister" else register.registry,
+            type_name,
+            name,
+            module,
+        )
+
+
+def index_module_dir(module_dir: str, namespace: str):
+    """record the registered names in all the module files of the module_dir(and the sub dirs), without importing them
+
+    Args:
+        module_dir: the module dir
+        namespace: the module path of the module dir
+
+    Returns:
+        None
+
+    """
+    module_dir = os.path.abspath(module_dir)
+    if module_dir in _indexed_dirs:
+        return
+    _indexed_dirs.add(module_dir)
+    for file in os.listdir(module_dir):
+        path = os.path.join(module_dir, file)
+        if file.startswith("_") or file.startswith("."):
+            continue
+        if file.endswith(".py"):
+            index_module_file(path, f"{namespace}.{file[: -len('.py')]}")
+        elif os.path.isdir(path):
+            # the names registered in the `__init__.py` belong to the sub package
+            init_file = os.path.join(path, "__init__.py")
+            if os.path.isfile(init_file):
+                index_module_file(init_file, f"{namespace}.{file}")
+            index_module_dir(path, f"{namespace}.{file}")
+
+
+def _import_config_module(type_name: str, name: str) -> List[Dict]:
+    """import the module which registers the config `type_name`:`name`
+
+    Args:
+        type_name: the config type
+        name: the config name
+
+    Returns:
+        the default config of the module, which may reference the other modules
+
+    """
+    result = []
+    for candidate in {name, register_module_name(name)}:
+        if (type_name, candidate) in _loaded_configs:
+            continue
+        _loaded_configs.add((type_name, candidate))
+        module = lazy_index.get(("cregister", type_name, candidate))
+        if module is not None:
+            importlib.import_module(module)
+        if (type_name, candidate) in ic_repo:
+            result.append({f"@{type_name}": ic_repo[(type_name, candidate)]})
+    return result
+
+
+def import_config_modules(config: Union[Dict, List, None]):
+    """import the lazy modules referenced by the config, the referenced modules of the default configs are also imported.
+
+    NOTE: the parser of intc reads the default configs from the registered configs, so this should be called before parsing the config
+
+    Args:
+        config: the raw config dict
+
+    Returns:
+        None
+
+    """
+    pending = [config]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, list):
+            pending.extend(value)
+            continue
+        if not isinstance(value, dict):
+            continue
+        for key, sub_value in value.items():
+            pending.append(sub_value)
+            if not isinstance(key, str) or not key.startswith("@"):
+                continue
+            # the key is like `@type`, `@type@name` or `@type@name#alias`
+            type_names = key.lstrip("@").split("#")[0].split("@")
+            names = set(type_names[1:2])
+            if isinstance(sub_value, str):
+                names.add(sub_value)
+            elif isinstance(sub_value, dict):
+                for name_key in ["_base", "_name"]:
+                    if isinstance(sub_value.get(name_key), str):
+                        names.add(sub_value[name_key])
+            if not names:
+                names.add("")
+            for name in names:
+                pending.extend(_import_config_module(type_names[0], name))
 
 
 def import_module_dir(module_dir, namespace):
+    """import all the modules in the module_dir, or record them for lazy import(default)
+
+    Args:
+        module_dir: the module dir
+        namespace: the module path of the module dir
+
+    Returns:
+        None
+
+    """
+    if not eager_import():
+        index_module_dir(module_dir, namespace)
+        return
     for file in os.listdir(module_dir):
         path = os.path.join(module_dir, file)
         if (
@@ -2,10 +2,10 @@
 #
 # There are many code borrowed from fairseq.
 
-""" Wrapper for ngram_repeat_block cuda extension """
+"""Wrapper for ngram_repeat_block cuda extension"""
+
 import math
 import warnings
-from typing import List
 
 import torch
 from torch import nn
@@ -87,27 +87,23 @@ class NGramRepeatBlock(nn.Module):
         )
 
     def _no_repeat_ngram(self, tokens, lprobs, bsz: int, beam_size: int, step: int):
-        """For each hypothesis generate a list of previous ngrams and set associated lprobs to -inf"""
-        banned_tokens = [
-            torch.jit.annotate(List[int], []) for bbsz_idx in range(bsz * beam_size)
-        ]
-        if step + 2 - self.no_repeat_ngram_size >= 0:
-            cpu_tokens: List[List[int]] = tokens.cpu().tolist()
-            check_start_pos = step + 2 - self.no_repeat_ngram_size
-            for bbsz_idx in range(bsz * beam_size):
-                ngram_to_check = cpu_tokens[bbsz_idx][
-                    -(self.no_repeat_ngram_size - 1) :
-                ]
-                for i in range(check_start_pos):
-                    if (
-                        ngram_to_check
-                        == cpu_tokens[bbsz_idx][i : i + self.no_repeat_ngram_size - 1]
-                    ):
-                        banned_tokens[bbsz_idx].append(
-                            cpu_tokens[bbsz_idx][i + self.no_repeat_ngram_size - 1]
-                        )
-        for bbsz_idx in range(bsz * beam_size):
-            lprobs[bbsz_idx][
-                torch.tensor(banned_tokens[bbsz_idx], dtype=torch.int64)
-            ] = torch.tensor(-math.inf).to(lprobs)
+        """For each hypothesis find the previous ngrams whose prefix is the same as the last (ngram_size-1) tokens and set the lprobs of their last tokens to -inf
+
+        All the hypotheses are checked together on the device of the tokens, there is no host round trip
+        """
+        ngram_size = self.no_repeat_ngram_size
+        num_ngrams = tokens.size(1) - ngram_size + 1
+        if num_ngrams <= 0:
+            return lprobs
+        # shape: (bsz*beam_size, num_ngrams, ngram_size), this is a view of the tokens
+        ngrams = tokens.unfold(1, ngram_size, 1)
+        # shape: (bsz*beam_size, num_ngrams)
+        matched = (ngrams[:, :, :-1] == tokens[:, num_ngrams:].unsqueeze(1)).all(dim=-1)
+        banned_tokens = ngrams[:, :, -1]
+        # add -inf to the banned tokens and 0 to the others, so the mask is applied without
+        # gathering the matched indices to the host
+        banned_lprobs = torch.zeros(
+            banned_tokens.shape, dtype=lprobs.dtype, device=lprobs.device
+        ).masked_fill_(matched, -math.inf)
+        lprobs.scatter_add_(1, banned_tokens, banned_lprobs)
         return lprobs
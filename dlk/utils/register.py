@@ -3,11 +3,72 @@
 # This source code is licensed under the Apache license found in the
 # LICENSE file in the root directory of this source tree.
 
+import importlib
 from typing import Any, Callable, Dict
 
 PROTECTED = ["_name", "_base", "_search"]
 
 
+class LazyModules(dict):
+    """the registered modules of one type, if a name is missing, the module file which registers the name will be imported"""
+
+    def __init__(self, *args, **kwargs):
+        super(LazyModules, self).__init__(*args, **kwargs)
+        # name -> the module(file) which registers the name
+        self.lazy: Dict[str, str] = {}
+
+    def add_lazy(self, name: str, module: str):
+        """record the module which registers the name
+
+        Args:
+            name: the registered name
+            module: the module path, like `dlk.data.subprocessor.fast_tokenizer`
+
+        Returns:
+            None
+
+        """
+        if not dict.__contains__(self, name):
+            self.lazy[name] = module
+
+    def _load(self, name: str):
+        """import the module which registers the name"""
+        module = self.lazy.pop(name, None)
+        if module is not None:
+            importlib.import_module(module)
+
+    def __contains__(self, name):
+        if not dict.__contains__(self, name):
+            self._load(name)
+        return dict.__contains__(self, name)
+
+    def __missing__(self, name):
+        self._load(name)
+        if dict.__contains__(self, name):
+            return dict.__getitem__(self, name)
+        raise KeyError(name)
+
+
+def add_lazy_module(registry: Dict[str, Dict], type_name: str, name: str, module: str):
+    """record the module which registers the `type_name`:`name` to the registry, the module will be imported when the name is first used
+
+    Args:
+        registry: the registry, like `register.registry` or the registry of intc
+        type_name: the registered type
+        name: the registered name
+        module: the module path
+
+    Returns:
+        None
+
+    """
+    modules = registry.get(type_name)
+    if not isinstance(modules, LazyModules):
+        modules = LazyModules(modules or {})
+        registry[type_name] = modules
+    modules.add_lazy(name, module)
+
+
 def register_module_name(module_name: str):
     """get the real registerd instance module name
 
@@ -0,0 +1,121 @@
+# Copyright the author(s) of DLK.
+#
+# This source code is licensed under the Apache license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pickle as pkl
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple, Union
+
+
+class ResultCache(object):
+    """LRU cache with the time to live, bounded by the number of the entries and the memory
+
+    Args:
+        max_size: the max number of the entries
+        ttl: the seconds an entry lives, -1 means never expire
+        max_bytes: the max memory(the pickled size) of all the entries, -1 means no limit
+
+    NOTE: the values are saved pickled, every `get` unpickles a new copy, so the caller could update the result safely
+
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = -1, max_bytes: int = -1):
+        assert max_size >= 1, f"max_size must be >= 1"
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # key -> (pickled value, expire time)
+        self._data: "OrderedDict[Hashable, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Union[Any, None]:
+        """get the value of the key, the hit entry will be the most recently used
+
+        Args:
+            key: the key
+
+        Returns:
+            a copy of the cached value, None if the key is missing or expired
+
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+        return pkl.loads(entry[0])
+
+    def put(self, key: Hashable, value: Any):
+        """cache the value, the least recently used entries are evicted if out of the bounds
+
+        Args:
+            key: the key
+            value: the value, must be picklable
+
+        Returns:
+            None
+
+        """
+        pickled = pkl.dumps(value, protocol=pkl.HIGHEST_PROTOCOL)
+        size = len(pickled)
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return
+        expire = time.monotonic() + self.ttl if self.ttl > 0 else float("inf")
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (pickled, expire)
+            self._bytes += size
+            while len(self._data) > self.max_size or (
+                self.max_bytes > 0 and self._bytes > self.max_bytes
+            ):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        """drop all the entries, the stats are kept
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """the metrics of the cache
+
+        Returns:
+            the hits, misses, hit rate, evictions, size and memory of the cache
+
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "bytes": self._bytes,
+        }
+
+    def _pop(self, key: Hashable):
+        """remove the entry without lock"""
+        pickled, _ = self._data.pop(key)
+        self._bytes -= len(pickled)
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from lightning.fabric.utilities.data import _replace_dunder_methods
+from lightning.pytorch.trainer.states import RunningStage
+from lightning.pytorch.utilities.data import _update_dataloader
+from torch.utils.data import (
+    BatchSampler,
+    DataLoader,
+    DistributedSampler,
+    RandomSampler,
+    SequentialSampler,
+)
+
+from dlk.data.datamodule.sampler import LengthBucketBatchSampler
+
+NUM = 103
+
+
+@pytest.fixture
+def lengths():
+    return np.random.RandomState(0).randint(1, 50, NUM)
+
+
+def flatten(batches):
+    return [index for batch in batches for index in batch]
+
+
+def distributed_batches(lengths, num_replicas, epoch=0, **kwargs):
+    """the batches of every rank in one epoch"""
+    all_batches = []
+    for rank in range(num_replicas):
+        sampler = DistributedSampler(
+            range(NUM), num_replicas=num_replicas, rank=rank, shuffle=True, seed=3
+        )
+        sampler.set_epoch(epoch)
+        batch_sampler = LengthBucketBatchSampler(
+            sampler, lengths=lengths, shuffle=True, **kwargs
+        )
+        batches = list(batch_sampler)
+        assert len(batches) == len(batch_sampler)
+        all_batches.append(batches)
+    return all_batches
+
+
+class TestLengthBucketBatchSampler(object):
+    @pytest.mark.parametrize("shuffle", [True, False])
+    @pytest.mark.parametrize("max_tokens", [-1, 120])
+    def test_every_index_once(self, lengths, shuffle, max_tokens):
+        sampler = (
+            RandomSampler(range(NUM)) if shuffle else SequentialSampler(range(NUM))
+        )
+        batch_sampler = LengthBucketBatchSampler(
+            sampler,
+            batch_size=8,
+            drop_last=False,
+            lengths=lengths,
+            bucket_size=2 if shuffle else -1,
+            max_tokens=max_tokens,
+            shuffle=shuffle,
+        )
+        for _ in range(2):
+            num_batches = len(batch_sampler)
+            batches = list(batch_sampler)
+            assert len(batches) == num_batches
+            assert sorted(flatten(batches)) == list(range(NUM))
+            for batch in batches:
+                if max_tokens > 0:
+                    assert len(batch) == 1 or max(lengths[batch]) * len(batch) <= 120
+                else:
+                    assert len(batch) <= 8
+        if not shuffle:
+            # sort the whole data
+            assert flatten(batches) == np.argsort(lengths, kind="stable").tolist()
+
+    @pytest.mark.parametrize("max_tokens", [-1, 120])
+    def test_distributed_shards_not_overlap(self, lengths, max_tokens):
+        kwargs = dict(batch_size=8, bucket_size=2, max_tokens=max_tokens)
+        all_batches = distributed_batches(lengths, 2, drop_last=True, **kwargs)
+        assert len(all_batches[0]) == len(all_batches[1])
+        rank_indices = [set(flatten(batches)) for batches in all_batches]
+        assert not rank_indices[0] & rank_indices[1]
+        assert len(flatten(all_batches[0] + all_batches[1])) == len(
+            rank_indices[0] | rank_indices[1]
+        )
+
+        # the batches of the last rank are padded by the first batches when not drop_last
+        all_batches = distributed_batches(lengths, 2, drop_last=False, **kwargs)
+        assert len(all_batches[0]) == len(all_batches[1])
+        assert sorted(set(flatten(all_batches[0] + all_batches[1]))) == list(range(NUM))
+
+    def test_distributed_epochs(self, lengths):
+        kwargs = dict(batch_size=8, bucket_size=2, drop_last=True)
+        first = distributed_batches(lengths, 2, epoch=0, **kwargs)
+        assert first == distributed_batches(lengths, 2, epoch=0, **kwargs)
+        assert first != distributed_batches(lengths, 2, epoch=1, **kwargs)
+
+    @pytest.mark.parametrize("mode", [RunningStage.TRAINING, RunningStage.PREDICTING])
+    def test_lightning_reinstantiate(self, lengths, mode):
+        """lightning injects the DistributedSampler by re-instantiating the batch sampler with the saved init args"""
+        dataset = list(range(NUM))
+        with _replace_dunder_methods(DataLoader, "dataset"), _replace_dunder_methods(
+            BatchSampler
+        ):
+            dataloader = DataLoader(
+                dataset,
+                batch_sampler=LengthBucketBatchSampler(
+                    RandomSampler(dataset),
+                    batch_size=8,
+                    drop_last=True,
+                    lengths=lengths,
+                    bucket_size=2,
+                    max_tokens=120,
+                    shuffle=True,
+                ),
+            )
+        all_indices = []
+        for rank in range(2):
+            sampler = DistributedSampler(
+                dataset, num_replicas=2, rank=rank, shuffle=True
+            )
+            new_dataloader = _update_dataloader(dataloader, sampler, mode=mode)
+            batch_sampler = new_dataloader.batch_sampler
+            if mode == RunningStage.PREDICTING:
+                # lightning wraps the batch sampler to track the indices
+                batch_sampler = batch_sampler._batch_sampler
+                assert not batch_sampler.drop_last
+            assert isinstance(batch_sampler, LengthBucketBatchSampler)
+            assert batch_sampler.sampler is sampler
+            assert batch_sampler.max_tokens == 120
+            assert batch_sampler.bucket_size == 2
+            assert np.array_equal(batch_sampler.lengths, lengths)
+            all_indices.append(
+                set(index for batch in new_dataloader for index in batch.tolist())
+            )
+        if mode == RunningStage.TRAINING:
+            assert not all_indices[0] & all_indices[1]
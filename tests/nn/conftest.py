@@ -0,0 +1,117 @@
+import json
+
+import pytest
+import torch
+from intc import Parser
+from tokenizers import Tokenizer, models
+
+import dlk.initmethod
+import dlk.nn
+from dlk.utils.import_module import import_config_modules
+from dlk.utils.register import register, register_module_name
+
+BART_CONFIG = {
+    "vocab_size": 50,
+    "max_position_embeddings": 128,
+    "d_model": 16,
+    "encoder_ffn_dim": 32,
+    "encoder_layers": 1,
+    "encoder_attention_heads": 2,
+    "decoder_ffn_dim": 32,
+    "decoder_layers": 2,
+    "decoder_attention_heads": 2,
+    "dropout": 0.0,
+    "attention_dropout": 0.0,
+    "activation_dropout": 0.0,
+    "scale_embedding": False,
+    "bos_token_id": 0,
+    "pad_token_id": 1,
+    "eos_token_id": 2,
+}
+
+
+@pytest.fixture
+def tiny_bart(tmp_path):
+    """the dir of a tiny bart config and a word level tokenizer with 50 tokens"""
+    with open(tmp_path / "config.json", "w") as f:
+        json.dump(BART_CONFIG, f)
+    vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "<unk>": 3}
+    for i in range(46):
+        vocab[f"w{i}"] = len(vocab)
+    Tokenizer(models.WordLevel(vocab, unk_token="<unk>")).save(
+        str(tmp_path / "tokenizer.json")
+    )
+    return tmp_path
+
+
+def build_token_enc_dec(path, seed=0, weight_std=0.3, eos_bias=0.0, **kwargs):
+    """build a randomly initialized token_enc_dec model with the tiny bart
+
+    Args:
+        path: the dir from the `tiny_bart`
+        seed: the random seed of the weights
+        weight_std: the std of the weights, the larger the more different outputs of the sentences
+        eos_bias: add to the eos logit, the larger the shorter outputs
+        kwargs: update the model config, the submodules like `@token_sample@sampling` are also supported
+
+    Returns:
+        the model in eval mode
+    """
+    bart = {"from_pretrain": False, "pretrained_model_path": str(path)}
+    model_config = {
+        "@initmethod@default": {},
+        "@encoder@bart_like_encoder": dict(bart),
+        "@token_gen_decoder@bart_like_decoder": dict(bart),
+        "beam_size": 1,
+        "max_len_a_ratio": 0,
+        "max_len_b": 20,
+        "max_len": 21,
+        "min_len": 1,
+        "tgt_eos": "</s>",
+        "tgt_bos": "<s>",
+        "tgt_pad": "<pad>",
+        "tgt_unk": "<unk>",
+        "tgt_tokenizer": str(path / "tokenizer.json"),
+        "src_tokenizer": str(path / "tokenizer.json"),
+        "tgt_embedding_dim": 16,
+        "src_embedding_dim": 16,
+        "decoder_hidden_size": 16,
+    }
+    model_config.update(kwargs)
+    if not any(key.startswith("@token_sample@") for key in model_config):
+        model_config["@token_sample@beam_search"] = {}
+    config = {"@model@token_enc_dec": model_config}
+    import_config_modules(config)
+    model_config = Parser(config).parser_init()[0]["@model@token_enc_dec"]
+    torch.manual_seed(seed)
+    model = register.get("model", register_module_name(model_config._module_name))(
+        model_config, False
+    ).eval()
+    with torch.no_grad():
+        for parameter in model.parameters():
+            if parameter.dim() > 1:
+                parameter.normal_(0, weight_std)
+        model.lm_head.bias[model.eos] += eos_bias
+    return model
+
+
+def random_sources(num, min_len=3, max_len=12, seed=1):
+    """random source token ids without the special tokens"""
+    generator = torch.Generator().manual_seed(seed)
+    lengths = torch.randint(min_len, max_len + 1, (num,), generator=generator)
+    return [
+        torch.randint(4, 50, (int(length),), generator=generator) for length in lengths
+    ]
+
+
+def generate_inputs(sources, pad=1):
+    """the padded generate inputs of the sources"""
+    max_len = max(len(source) for source in sources)
+    input_ids = torch.full((len(sources), max_len), pad, dtype=torch.long)
+    for i, source in enumerate(sources):
+        input_ids[i, : len(source)] = source
+    return {
+        "encoder_input_ids": input_ids,
+        "encoder_attention_mask": input_ids.ne(pad).long(),
+        "decoder_input_ids": input_ids[:, :1],
+    }
@@ -0,0 +1,118 @@
+import torch
+import torch.nn as nn
+
+from dlk.nn.module.module_bart_decoder import (
+    BartDecoderCache,
+    BartDecoderWrap,
+    BartDecoderWrapConfig,
+)
+
+
+def build_decoder(tiny_bart):
+    config = BartDecoderWrapConfig._from_dict(
+        {"from_pretrain": False, "pretrained_model_path": str(tiny_bart)}
+    )
+    torch.manual_seed(0)
+    decoder = BartDecoderWrap(config, embedding=nn.Embedding(50, 16))
+    decoder.init_weight(None)
+    return decoder.eval()
+
+
+def reference_forward(decoder, inputs_embeds, encoder_hidden_states, past_key_values):
+    """the decoding of transformers with the legacy past_key_values"""
+    outputs = decoder.bart_decoder(
+        inputs_embeds=inputs_embeds,
+        encoder_hidden_states=encoder_hidden_states,
+        past_key_values=past_key_values,
+        use_cache=True,
+        return_dict=True,
+    )
+    return outputs.last_hidden_state, outputs.past_key_values
+
+
+def reorder_legacy(past_key_values, new_order):
+    return tuple(
+        tuple(state.index_select(0, new_order) for state in layer_past)
+        for layer_past in past_key_values
+    )
+
+
+class TestBartDecoderCache(object):
+    @torch.no_grad()
+    def test_step_by_step(self, tiny_bart):
+        decoder = build_decoder(tiny_bart)
+        encoder_hidden_states = torch.randn(3, 7, 16)
+        inputs_embeds = torch.randn(3, 6, 16)
+        cache = decoder.init_incremental_state(8)
+        past_key_values = None
+        for step in range(6):
+            expected, past_key_values = reference_forward(
+                decoder,
+                inputs_embeds[:, step : step + 1],
+                encoder_hidden_states,
+                past_key_values,
+            )
+            outputs = decoder.cached_forward(
+                inputs_embeds[:, step : step + 1], encoder_hidden_states, cache
+            )
+            assert cache.length == step + 1
+            assert torch.allclose(outputs, expected, atol=1e-5)
+
+    @torch.no_grad()
+    def test_multi_steps(self, tiny_bart):
+        """decode several steps at once, and roll back by the length"""
+        decoder = build_decoder(tiny_bart)
+        encoder_hidden_states = torch.randn(3, 7, 16)
+        inputs_embeds = torch.randn(3, 6, 16)
+        expected, _ = reference_forward(
+            decoder, inputs_embeds, encoder_hidden_states, None
+        )
+        cache = decoder.init_incremental_state(8)
+        outputs = decoder.cached_forward(
+            inputs_embeds[:, :1], encoder_hidden_states, cache
+        )
+        assert torch.allclose(outputs, expected[:, :1], atol=1e-5)
+        outputs = decoder.cached_forward(
+            inputs_embeds[:, 1:5], encoder_hidden_states, cache
+        )
+        assert torch.allclose(outputs, expected[:, 1:5], atol=1e-5)
+        # roll back the last 2 steps and decode them again
+        cache.length = 3
+        outputs = decoder.cached_forward(
+            inputs_embeds[:, 3:6], encoder_hidden_states, cache
+        )
+        assert torch.allclose(outputs, expected[:, 3:6], atol=1e-5)
+
+    @torch.no_grad()
+    def test_reorder(self, tiny_bart):
+        """reorder the beams of the same sentence, then remove the finished sentences"""
+        decoder = build_decoder(tiny_bart)
+        # 3 sentences with 2 beams
+        encoder_hidden_states = torch.randn(3, 7, 16).repeat_interleave(2, dim=0)
+        inputs_embeds = torch.randn(6, 6, 16)
+        cache = decoder.init_incremental_state(8)
+        assert isinstance(cache, BartDecoderCache)
+        past_key_values = None
+        orders = {
+            2: torch.tensor([1, 1, 2, 3, 5, 4]),
+            3: torch.tensor([2, 3, 1, 1]),
+            4: torch.tensor([3, 2]),
+        }
+        for step in range(6):
+            if step in orders:
+                new_order = orders[step]
+                past_key_values = reorder_legacy(past_key_values, new_order)
+                cache = decoder.reorder_incremental_state(cache, new_order)
+                inputs_embeds = inputs_embeds[new_order]
+                encoder_hidden_states = encoder_hidden_states[new_order]
+            expected, past_key_values = reference_forward(
+                decoder,
+                inputs_embeds[:, step : step + 1],
+                encoder_hidden_states,
+                past_key_values,
+            )
+            outputs = decoder.cached_forward(
+                inputs_embeds[:, step : step + 1], encoder_hidden_states, cache
+            )
+            assert outputs.size(0) == expected.size(0) == cache.self_kv.size(2)
+            assert torch.allclose(outputs, expected, atol=1e-5)
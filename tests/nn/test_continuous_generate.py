@@ -0,0 +1,78 @@
+import pytest
+import torch
+
+from dlk.nn.continuous_generate import ContinuousBatchGenerator
+
+from .conftest import build_token_enc_dec, generate_inputs, random_sources
+
+
+def assert_same_hypos(expected, outputs):
+    assert len(expected) == len(outputs)
+    for expected_hypos, hypos in zip(expected, outputs):
+        assert len(expected_hypos) == len(hypos)
+        for expected_hypo, hypo in zip(expected_hypos, hypos):
+            assert torch.equal(expected_hypo["tokens"], hypo["tokens"])
+            assert torch.allclose(expected_hypo["score"], hypo["score"], atol=1e-4)
+            assert torch.allclose(
+                expected_hypo["positional_scores"],
+                hypo["positional_scores"],
+                atol=1e-4,
+            )
+
+
+class TestContinuousBatchGenerator(object):
+    @pytest.mark.parametrize("beam_size", [1, 3])
+    @pytest.mark.parametrize("max_sentences", [1, 3])
+    def test_same_as_generate(self, tiny_bart, beam_size, max_sentences):
+        """every sentence is the same as `model.generate` on the unpadded source"""
+        model = build_token_enc_dec(
+            tiny_bart, weight_std=1.0, eos_bias=6.0, beam_size=beam_size
+        )
+        sources = random_sources(7)
+        expected = [
+            model.generate(generate_inputs([source]))["generated"][0]
+            for source in sources
+        ]
+        # the sentences are finished at the different steps
+        assert len(set(len(hypos[0]["tokens"]) for hypos in expected)) > 1
+
+        generator = ContinuousBatchGenerator(model, max_sentences=max_sentences)
+        assert_same_hypos(expected, generator.generate_all(sources))
+
+    @pytest.mark.parametrize("max_sentences", [1, 4])
+    def test_same_as_batch_generate(self, tiny_bart, max_sentences):
+        """the sources with the same length are not padded in the batch of `model.generate`"""
+        model = build_token_enc_dec(tiny_bart, weight_std=1.0, eos_bias=6.0)
+        sources = random_sources(6, min_len=8, max_len=8)
+        expected = model.generate(generate_inputs(sources))["generated"]
+
+        generator = ContinuousBatchGenerator(model, max_sentences=max_sentences)
+        assert_same_hypos(expected, generator.generate_all(sources))
+
+    def test_only_decode_occupied_slots(self, tiny_bart):
+        model = build_token_enc_dec(
+            tiny_bart, weight_std=1.0, eos_bias=6.0, beam_size=2
+        )
+        sources = random_sources(3)
+        slot_forward = model.decoder.slot_forward
+        num_rows = []
+
+        def record_slot_forward(inputs_embeds, steps, cache, rows=None):
+            num_rows.append(inputs_embeds.size(0))
+            if rows is not None:
+                assert rows.numel() == inputs_embeds.size(0)
+            return slot_forward(inputs_embeds, steps, cache, rows)
+
+        model.decoder.slot_forward = record_slot_forward
+        generator = ContinuousBatchGenerator(model, max_sentences=8)
+        outputs = generator.generate_all(sources)
+        del model.decoder.slot_forward
+
+        assert max(num_rows) == len(sources) * 2
+        # the rows are freed when the sentences are finished
+        assert min(num_rows) < len(sources) * 2
+        expected = [
+            model.generate(generate_inputs([source]))["generated"][0]
+            for source in sources
+        ]
+        assert_same_hypos(expected, outputs)
@@ -0,0 +1,50 @@
+import itertools
+
+import pytest
+import torch
+
+from dlk.nn.module.crf import ConditionalRandomField, CRFConfig
+
+
+def brute_force_decode(crf, emissions, length):
+    """the best path of one sample by scoring all the tag sequences
+
+    Args:
+        crf: the crf module
+        emissions: the emissions of the sample, shape: (seq_length, num_tags)
+        length: the real length of the sample
+
+    Returns:
+        the best tags
+    """
+    best_score, best_tags = None, None
+    for tags in itertools.product(range(crf.num_tags), repeat=length):
+        score = crf.start_transitions[tags[0]] + emissions[0, tags[0]]
+        for i in range(1, length):
+            score = (
+                score + crf.transitions[tags[i - 1], tags[i]] + emissions[i, tags[i]]
+            )
+        score = score + crf.end_transitions[tags[-1]]
+        if best_score is None or score > best_score:
+            best_score, best_tags = score, list(tags)
+    return best_tags
+
+
+class TestConditionalRandomField(object):
+    @pytest.mark.parametrize("seed", range(5))
+    def test_viterbi_decode(self, seed):
+        torch.manual_seed(seed)
+        batch_size, seq_length, num_tags = 6, 5, 3
+        crf = ConditionalRandomField(CRFConfig._from_dict({"output_size": num_tags}))
+        logits = torch.randn(batch_size, seq_length, num_tags)
+        lengths = torch.randint(1, seq_length + 1, (batch_size,))
+        lengths[0] = seq_length
+        lengths[1] = 1
+        mask = (torch.arange(seq_length)[None, :] < lengths[:, None]).long()
+
+        with torch.no_grad():
+            predicts = crf(logits, mask)
+        assert predicts.shape == (batch_size, seq_length)
+        for logit, length, predict in zip(logits, lengths.tolist(), predicts):
+            expected = brute_force_decode(crf, logit, length)
+            assert predict.tolist() == expected + [-1] * (seq_length - length)
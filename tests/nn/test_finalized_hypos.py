@@ -0,0 +1,102 @@
+import pytest
+import torch
+
+from dlk.nn.token_gen_base import FinalizedHypos
+
+
+class ReferenceFinalized(object):
+    """the list of dicts finalization before the tensorized FinalizedHypos"""
+
+    def __init__(self, bsz, beam_size):
+        self.beam_size = beam_size
+        self.finalized = [[] for _ in range(bsz)]
+
+    def add(self, sent, step, tokens, positional_scores, scores):
+        for i, s in enumerate(sent.tolist()):
+            if len(self.finalized[s]) < self.beam_size:
+                self.finalized[s].append(
+                    {
+                        "tokens": tokens[i],
+                        "score": scores[i],
+                        "positional_scores": positional_scores[i],
+                    }
+                )
+
+    def hypos(self):
+        result = []
+        for hypos in self.finalized:
+            scores = torch.tensor([float(hypo["score"].item()) for hypo in hypos])
+            _, order = torch.sort(scores, descending=True, stable=True)
+            result.append([hypos[i] for i in order])
+        return result
+
+
+def random_add(finalized, reference, sent, step, generator):
+    num = len(sent)
+    sent = torch.tensor(sent)
+    tokens = torch.randint(4, 50, (num, step + 1), generator=generator)
+    positional_scores = torch.randn(num, step + 1, generator=generator)
+    scores = torch.randn(num, generator=generator)
+    finalized.add(sent, step, tokens, positional_scores, scores)
+    reference.add(sent, step, tokens, positional_scores, scores)
+
+
+def assert_same(finalized, reference):
+    outputs = finalized.hypos()
+    expected = reference.hypos()
+    assert finalized.counts.tolist() == [len(hypos) for hypos in expected]
+    assert len(outputs) == len(expected)
+    for hypos, expected_hypos in zip(outputs, expected):
+        assert len(hypos) == len(expected_hypos)
+        for hypo, expected_hypo in zip(hypos, expected_hypos):
+            assert torch.equal(hypo["tokens"], expected_hypo["tokens"])
+            assert torch.equal(hypo["score"], expected_hypo["score"])
+            assert torch.equal(
+                hypo["positional_scores"], expected_hypo["positional_scores"]
+            )
+            assert hypo["attention"].numel() == 0
+
+
+class TestFinalizedHypos(object):
+    @pytest.mark.parametrize("beam_size", [1, 2, 3])
+    def test_same_as_list(self, beam_size):
+        """add several hypotheses of one sentence in one call and across calls, more than the beam_size"""
+        generator = torch.Generator().manual_seed(0)
+        finalized = FinalizedHypos(4, beam_size, 8, "cpu")
+        reference = ReferenceFinalized(4, beam_size)
+        random_add(finalized, reference, [0, 2, 0, 0], 1, generator)
+        assert_same(finalized, reference)
+        random_add(finalized, reference, [2, 1, 0, 2, 2], 3, generator)
+        random_add(finalized, reference, [1, 1, 1, 1], 5, generator)
+        random_add(finalized, reference, [3], 7, generator)
+        assert_same(finalized, reference)
+
+    def test_same_scores(self):
+        """the hypotheses with the same score keep the finalized order"""
+        finalized = FinalizedHypos(1, 3, 4, "cpu")
+        for i in range(3):
+            finalized.add(
+                torch.tensor([0]),
+                i,
+                torch.full((1, i + 1), i),
+                torch.zeros(1, i + 1),
+                torch.tensor([1.0]),
+            )
+        hypos = finalized.hypos()[0]
+        assert [len(hypo["tokens"]) for hypo in hypos] == [1, 2, 3]
+
+    def test_reset(self):
+        generator = torch.Generator().manual_seed(1)
+        finalized = FinalizedHypos(3, 2, 6, "cpu")
+        reference = ReferenceFinalized(3, 2)
+        random_add(finalized, reference, [0, 1, 1, 1], 2, generator)
+        hypos = finalized.hypos([1])[0]
+        expected = reference.hypos()[1]
+        finalized.reset(1)
+        reference.finalized[1] = []
+        assert finalized.counts.tolist() == [1, 0, 0]
+        # the fetched hypotheses are copies, they are not changed by the new sentence
+        random_add(finalized, reference, [1, 1], 4, generator)
+        for hypo, expected_hypo in zip(hypos, expected):
+            assert torch.equal(hypo["tokens"], expected_hypo["tokens"])
+        assert_same(finalized, reference)
@@ -0,0 +1,131 @@
+import pytest
+import torch
+
+from dlk.nn.token_sample.sampling import Sampling, SamplingConfig
+
+from .conftest import build_token_enc_dec, generate_inputs, random_sources
+
+
+def generate(model, sources):
+    return model.generate(generate_inputs(sources))["generated"]
+
+
+def assert_same_hypos(expected, outputs):
+    assert len(expected) == len(outputs)
+    for expected_hypos, hypos in zip(expected, outputs):
+        assert len(expected_hypos) == len(hypos)
+        for expected_hypo, hypo in zip(expected_hypos, hypos):
+            assert torch.equal(expected_hypo["tokens"], hypo["tokens"])
+            assert torch.allclose(expected_hypo["score"], hypo["score"], atol=1e-4)
+            assert torch.allclose(
+                expected_hypo["positional_scores"],
+                hypo["positional_scores"],
+                atol=1e-4,
+            )
+
+
+def build_speculative(tiny_bart, base_model, speculative_steps, **kwargs):
+    """the speculative model with the same weights as the `base_model`, the draft decoder is the same as the decoder"""
+    model = build_token_enc_dec(
+        tiny_bart,
+        speculative_steps=speculative_steps,
+        **{
+            "@token_gen_decoder@bart_like_decoder#draft": {
+                "from_pretrain": False,
+                "pretrained_model_path": str(tiny_bart),
+            }
+        },
+        **kwargs,
+    )
+    model.load_state_dict(base_model.state_dict(), strict=True)
+    model.draft_decoder.load_state_dict(model.decoder.state_dict())
+    return model
+
+
+class TestSpeculativeDecoding(object):
+    @pytest.mark.parametrize("speculative_steps", [1, 3])
+    @pytest.mark.parametrize("no_repeat_ngram_size", [0, 2])
+    def test_greedy_same_as_decoder(
+        self, tiny_bart, speculative_steps, no_repeat_ngram_size
+    ):
+        """the greedy speculative decoding outputs are the same as the decoder only generation"""
+        kwargs = dict(
+            weight_std=1.0, eos_bias=6.0, no_repeat_ngram_size=no_repeat_ngram_size
+        )
+        sources = random_sources(6)
+        base_model = build_token_enc_dec(tiny_bart, **kwargs)
+        expected = generate(base_model, sources)
+        # the sentences are finished at the different steps
+        assert len(set(len(hypos[0]["tokens"]) for hypos in expected)) > 1
+
+        model = build_speculative(tiny_bart, base_model, speculative_steps, **kwargs)
+        assert_same_hypos(expected, generate(model, sources))
+
+    def test_disagreed_draft(self, tiny_bart):
+        """all the drafts are rejected, the outputs are still the same"""
+        kwargs = dict(weight_std=1.0, eos_bias=6.0)
+        sources = random_sources(6)
+        base_model = build_token_enc_dec(tiny_bart, **kwargs)
+        expected = generate(base_model, sources)
+
+        model = build_speculative(tiny_bart, base_model, 3, **kwargs)
+        decode_logits = model._decode_logits
+
+        def disagreed_decode_logits(decoder, *args):
+            logits = decode_logits(decoder, *args)
+            # the draft proposes the worst token of the decoder
+            return -logits if decoder is model.draft_decoder else logits
+
+        model._decode_logits = disagreed_decode_logits
+        assert_same_hypos(expected, generate(model, sources))
+
+    def test_draft_not_in_state_dict(self, tiny_bart):
+        """the draft decoder is not saved or loaded by the state dict, so it could be added to a trained model"""
+        base_model = build_token_enc_dec(tiny_bart)
+        model = build_speculative(tiny_bart, base_model, 2)
+        assert not any("draft" in key for key in model.state_dict())
+        assert not any("draft" in name for name, _ in model.named_parameters())
+        draft_fc = model.draft_decoder.bart_like_decoder.bart_decoder.layers[0].fc1
+        draft_weight = draft_fc.weight.clone()
+        model.load_state_dict(build_token_enc_dec(tiny_bart, seed=1).state_dict())
+        assert torch.equal(draft_fc.weight, draft_weight)
+
+    def test_draft_moved_with_model(self, tiny_bart):
+        model = build_speculative(tiny_bart, build_token_enc_dec(tiny_bart), 2)
+        model.double()
+        draft_fc = model.draft_decoder.bart_like_decoder.bart_decoder.layers[0].fc1
+        assert draft_fc.weight.dtype == torch.float64
+
+    def test_legacy_cache_not_supported(self, tiny_bart):
+        """the decoder which does not update the preallocated cache in place is rejected"""
+        model = build_token_enc_dec(
+            tiny_bart,
+            speculative_steps=2,
+            **{
+                "@token_gen_decoder@bart_like_decoder#draft": {
+                    "from_pretrain": False,
+                    "pretrained_model_path": str(tiny_bart),
+                    "output_attentions": True,
+                }
+            },
+        )
+        with pytest.raises(ValueError):
+            generate(model, random_sources(2))
+
+
+class TestSampleProbs(object):
+    @pytest.mark.parametrize(
+        "config", [{"sampling_topk": 5}, {"sampling_topp": 0.5}, {}]
+    )
+    def test_normalized(self, tiny_bart, config):
+        model = build_token_enc_dec(tiny_bart)
+        sampling = Sampling(model.tgt_dict, SamplingConfig._from_dict(config))
+        lprobs = torch.randn(3, 2, model.tgt_vocab_size)
+        origin = lprobs.clone()
+        probs = sampling.sample_probs(lprobs)
+        assert torch.equal(lprobs, origin)
+        assert probs.shape == lprobs.shape
+        assert torch.allclose(probs.sum(dim=-1), torch.ones(3, 2))
+        assert (probs >= 0).all()
+        if "sampling_topk" in config:
+            assert ((probs > 0).sum(dim=-1) <= 5).all()
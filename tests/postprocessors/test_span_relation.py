@@ -0,0 +1,104 @@
+import pandas as pd
+import pytest
+import torch
+from tokenizers import Tokenizer, models
+
+from dlk.data.postprocessor.span_relation import (
+    SpanRelationPostProcessor,
+    SpanRelationPostProcessorConfig,
+)
+from dlk.utils.vocab import Vocabulary
+
+SENTENCE = "John works at Google"
+ENTITY_LABELS = ["PER", "ORG"]
+RELATION_LABELS = ["work_for"]
+
+
+@pytest.fixture
+def postprocessor(tmp_path):
+    entity_vocab = Vocabulary(do_strip=True, pad="[PAD]", unknown="[UNK]")
+    entity_vocab.auto_update(ENTITY_LABELS)
+    entity_vocab.dump(str(tmp_path / "entity_vocab.json"))
+    relation_vocab = Vocabulary(do_strip=True, pad="[PAD]", unknown="[UNK]")
+    relation_vocab.auto_update(RELATION_LABELS)
+    relation_vocab.dump(str(tmp_path / "relation_vocab.json"))
+    vocab = {"[UNK]": 0}
+    for word in SENTENCE.split():
+        vocab[word] = len(vocab)
+    Tokenizer(models.WordLevel(vocab, unk_token="[UNK]")).save(
+        str(tmp_path / "tokenizer.json")
+    )
+    config = SpanRelationPostProcessorConfig._from_dict(
+        {
+            "meta_dir": str(tmp_path),
+            "entity_label_vocab": "entity_vocab.json",
+            "relation_label_vocab": "relation_vocab.json",
+            "tokenizer_path": str(tmp_path / "tokenizer.json"),
+        }
+    )
+    return SpanRelationPostProcessor(config)
+
+
+def predict(postprocessor, tail_label):
+    """predict the `John`(PER) `work_for` `Google`(ORG) with the given tail-to-tail label
+
+    Args:
+        postprocessor: the span relation postprocessor
+        tail_label: the tail-to-tail predict of (John, Google)
+
+    Returns:
+        the predict of the sentence
+    """
+    entity_vocab = postprocessor.entity_label_vocab
+    relation_vocab = postprocessor.relation_label_vocab
+    token_len = len(SENTENCE.split())
+
+    # all the other spans and pairs are predicted as pad
+    entity_logits = torch.zeros(token_len, token_len, len(entity_vocab))
+    entity_logits[..., entity_vocab.get_index("[PAD]")] = 1
+    entity_logits[0, 0, entity_vocab.get_index("PER")] = 2
+    entity_logits[3, 3, entity_vocab.get_index("ORG")] = 2
+    relation_logits = torch.zeros(2, token_len, token_len, len(relation_vocab))
+    relation_logits[..., relation_vocab.get_index("[PAD]")] = 1
+    relation_logits[0, 0, 3, relation_vocab.get_index("work_for")] = 2
+    relation_logits[1, 0, 3, relation_vocab.get_index(tail_label)] = 2
+
+    origin_data = pd.DataFrame(
+        data={
+            "sentence": [SENTENCE],
+            "uuid": ["0"],
+            "word_ids": [list(range(token_len))],
+            "offsets": [[(0, 4), (5, 10), (11, 13), (14, 20)]],
+        }
+    )
+    outputs = {
+        "entity_logits": entity_logits[None],
+        "relation_logits": relation_logits[None],
+        "_index": torch.tensor([0]),
+    }
+    return postprocessor.do_predict("valid", [outputs], origin_data, {})[0]
+
+
+class TestSpanRelationPostProcessor(object):
+    def test_relation(self, postprocessor):
+        result = predict(postprocessor, "work_for")
+        entities = {
+            entity["entity_id"]: (entity["start"], entity["end"], entity["labels"])
+            for entity in result["predict_entities_info"]
+        }
+        assert sorted(entities.values()) == [(0, 4, ["PER"]), (14, 20, ["ORG"])]
+        assert [
+            (
+                entities[relation["from"]][2],
+                entities[relation["to"]][2],
+                relation["labels"],
+            )
+            for relation in result["predict_relations_info"]
+        ] == [(["PER"], ["ORG"], ["work_for"])]
+
+    @pytest.mark.parametrize("tail_label", ["[PAD]", "[UNK]"])
+    def test_ignore_tail_label(self, postprocessor, tail_label):
+        """the pair is dropped if the tail-to-tail predict is a pad/unknown label"""
+        result = predict(postprocessor, tail_label)
+        assert len(result["predict_entities_info"]) == 2
+        assert result["predict_relations_info"] == []
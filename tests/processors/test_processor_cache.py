@@ -0,0 +1,114 @@
+import os
+
+import pandas as pd
+import pytest
+from intc import Parser
+
+import dlk.data.processor
+import dlk.data.subprocessor
+from dlk.data.processor.default import DefaultProcessor
+from dlk.utils.vocab import Vocabulary
+
+
+def dump_vocab(meta_dir, name, words):
+    vocab = Vocabulary(unknown="[UNK]")
+    vocab.auto_update(words)
+    vocab.dump(os.path.join(meta_dir, name))
+
+
+@pytest.fixture
+def meta_dir(tmp_path):
+    meta_dir = tmp_path / "meta"
+    meta_dir.mkdir()
+    dump_vocab(str(meta_dir), "token_vocab.json", ["a", "b", "c"])
+    dump_vocab(str(meta_dir), "label_vocab.json", ["pos", "neg"])
+    return str(meta_dir)
+
+
+def get_processor(cache_dir, meta_dir, label_output="label_ids"):
+    config = {
+        "@processor@default": {
+            "feed_order": ["token2id", "token2id-label"],
+            "cache_dir": cache_dir,
+            "meta_dir": meta_dir,
+            "@subprocessor@token2id": {"predict_data_set": ["predict"]},
+            "@subprocessor@token2id-label": {
+                "predict_data_set": ["predict"],
+                "output_map": {"token_ids": label_output},
+            },
+        }
+    }
+    processor_config = Parser(config).parser_init()[0]["@processor"]
+    processor = DefaultProcessor("predict", processor_config)
+    calls = []
+    for name, subprocessor in processor.subprocessors.items():
+
+        def process(data, deliver_meta, name=name, origin=subprocessor.process):
+            calls.append(name)
+            return origin(data=data, deliver_meta=deliver_meta)
+
+        subprocessor.process = process
+    return processor, calls
+
+
+def get_data(tokens=("a", "b")):
+    return pd.DataFrame({"tokens": [list(tokens), ["c"]], "labels": [["pos"], ["neg"]]})
+
+
+class TestProcessorCache(object):
+    def test_rerun_uses_the_cache(self, tmp_path, meta_dir):
+        cache_dir = str(tmp_path / "cache")
+        processor, calls = get_processor(cache_dir, meta_dir)
+        first = processor.process_part(get_data(), deliver_meta=False)
+        assert calls == ["token2id", "token2id-label"]
+
+        processor, calls = get_processor(cache_dir, meta_dir)
+        second = processor.process_part(get_data(), deliver_meta=False)
+        assert calls == []
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_late_stage_change_reruns_only_the_late_stage(self, tmp_path, meta_dir):
+        cache_dir = str(tmp_path / "cache")
+        processor, calls = get_processor(cache_dir, meta_dir)
+        processor.process_part(get_data(), deliver_meta=False)
+
+        processor, calls = get_processor(cache_dir, meta_dir, label_output="label")
+        result = processor.process_part(get_data(), deliver_meta=False)
+        assert calls == ["token2id-label"]
+        assert result["token_ids"].tolist() == [[1, 2], [3]]
+        assert result["label"].tolist() == [[1], [2]]
+        assert "label_ids" not in result
+
+    def test_data_change_reruns_all_the_stages(self, tmp_path, meta_dir):
+        cache_dir = str(tmp_path / "cache")
+        processor, calls = get_processor(cache_dir, meta_dir)
+        processor.process_part(get_data(), deliver_meta=False)
+
+        processor, calls = get_processor(cache_dir, meta_dir)
+        result = processor.process_part(get_data(("b", "a")), deliver_meta=False)
+        assert calls == ["token2id", "token2id-label"]
+        assert result["token_ids"].tolist() == [[2, 1], [3]]
+
+    def test_meta_change_reruns_all_the_stages(self, tmp_path, meta_dir):
+        cache_dir = str(tmp_path / "cache")
+        processor, calls = get_processor(cache_dir, meta_dir)
+        processor.process_part(get_data(), deliver_meta=False)
+
+        dump_vocab(meta_dir, "token_vocab.json", ["c", "b", "a"])
+        processor, calls = get_processor(cache_dir, meta_dir)
+        result = processor.process_part(get_data(), deliver_meta=False)
+        assert calls == ["token2id", "token2id-label"]
+        assert result["token_ids"].tolist() == [[3, 2], [1]]
+
+    def test_meta_dir_change_reruns_all_the_stages(self, tmp_path, meta_dir):
+        cache_dir = str(tmp_path / "cache")
+        processor, calls = get_processor(cache_dir, meta_dir)
+        processor.process_part(get_data(), deliver_meta=False)
+
+        other_meta_dir = str(tmp_path / "other_meta")
+        os.makedirs(other_meta_dir)
+        dump_vocab(other_meta_dir, "token_vocab.json", ["a", "b", "c", "d"])
+        dump_vocab(other_meta_dir, "label_vocab.json", ["pos", "neg"])
+        processor, calls = get_processor(cache_dir, other_meta_dir)
+        processor.process_part(get_data(), deliver_meta=False)
+        assert calls == ["token2id", "token2id-label"]
@@ -0,0 +1,46 @@
+import math
+
+import pytest
+import torch
+
+from dlk.utils.ngram_repeat_block import NGramRepeatBlock
+
+
+def reference_no_repeat_ngram(tokens, lprobs, ngram_size):
+    """the python implementation of fairseq, gather the ngrams of every hypothesis to a dict and ban the ones with the same prefix as the last tokens"""
+    lprobs = lprobs.clone()
+    step = tokens.size(1) - 1
+    for i, hypo in enumerate(tokens.tolist()):
+        gen_ngrams = {}
+        for ngram in zip(*[hypo[j:] for j in range(ngram_size)]):
+            gen_ngrams.setdefault(tuple(ngram[:-1]), []).append(ngram[-1])
+        if step + 2 - ngram_size < 0:
+            continue
+        prefix = tuple(hypo[step + 2 - ngram_size : step + 1])
+        for token in gen_ngrams.get(prefix, []):
+            lprobs[i, token] = -math.inf
+    return lprobs
+
+
+class TestNGramRepeatBlock(object):
+    @pytest.mark.parametrize("ngram_size", [1, 2, 3])
+    @pytest.mark.parametrize("step", [0, 1, 2, 5, 19])
+    def test_same_as_reference(self, ngram_size, step):
+        torch.manual_seed(step)
+        bsz, beam_size, vocab_size = 3, 2, 4
+        # the small vocab makes the repeated ngrams
+        tokens = torch.randint(0, vocab_size, (bsz * beam_size, step + 1))
+        lprobs = torch.randn(bsz * beam_size, vocab_size)
+        expected = reference_no_repeat_ngram(tokens, lprobs, ngram_size)
+
+        blocker = NGramRepeatBlock(ngram_size)
+        outputs = blocker(tokens, lprobs.clone(), bsz, beam_size, step)
+        assert torch.equal(outputs, expected)
+
+    def test_repeated_ngram(self):
+        tokens = torch.tensor([[5, 1, 2, 5, 1], [1, 2, 3, 4, 1]])
+        lprobs = torch.zeros(2, 6)
+        outputs = NGramRepeatBlock(3)(tokens, lprobs, 2, 1, 4)
+        # `5 1 2` is repeated for the first, `1 2 3` is not, the last two tokens are `4 1`
+        assert outputs[0].tolist() == [0, 0, -math.inf, 0, 0, 0]
+        assert outputs[1].tolist() == [0] * 6
@@ -0,0 +1,146 @@
+import json
+import os
+import pickle as pkl
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from dlk.data.processed_data import (
+    MANIFEST,
+    MATRIX_COLUMNS_KEY,
+    PICKLED_COLUMNS_KEY,
+    load_manifest,
+    load_processed_data,
+    save_manifest,
+    save_shards,
+)
+
+
+def processed_data(num, start=0):
+    """the processed data with the native, the string and the complex columns"""
+    return pd.DataFrame(
+        data={
+            "uuid": [str(i) for i in range(start, start + num)],
+            "label_id": list(range(start, start + num)),
+            "input_ids": [list(range(i % 5 + 1)) for i in range(start, start + num)],
+            "large_ids": [[2**40 + i] for i in range(start, start + num)],
+            "scores": [[0.5 * i, 1.0] for i in range(start, start + num)],
+            "offsets": [[(0, 1), (2, i)] for i in range(start, start + num)],
+            "word_ids": [
+                [None] + list(range(i % 3)) + [None] for i in range(start, start + num)
+            ],
+            "label_ids": [
+                [[i] * (i % 3 + 1)] * (i % 3 + 1) for i in range(start, start + num)
+            ],
+            "entities_info": [
+                [{"start": 0, "end": i, "labels": ["PER"]}]
+                for i in range(start, start + num)
+            ],
+        }
+    )
+
+
+def to_python(value):
+    """the numpy arrays loaded from the parquet and the tuples are compared as lists"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [to_python(cell) for cell in value]
+    return value
+
+
+def assert_same_data(expected: pd.DataFrame, data: pd.DataFrame):
+    assert list(data.columns) == list(expected.columns)
+    assert len(data) == len(expected)
+    for name in expected.columns:
+        assert [to_python(cell) for cell in data[name]] == [
+            to_python(cell) for cell in expected[name]
+        ]
+
+
+class TestProcessedData(object):
+    @pytest.mark.parametrize("data_format", ["pickle", "parquet"])
+    @pytest.mark.parametrize("max_rows_per_shard", [-1, 4])
+    def test_save_and_load(self, tmp_path, data_format, max_rows_per_shard):
+        parts = [processed_data(10), processed_data(3, start=10)]
+        shards = []
+        for part, data in enumerate(parts):
+            shards.extend(
+                save_shards(data, str(tmp_path), part, max_rows_per_shard, data_format)
+            )
+        save_manifest(str(tmp_path), shards)
+
+        if max_rows_per_shard > 0:
+            assert [shard["rows"] for shard in shards] == [4, 4, 2, 3]
+        else:
+            assert [shard["rows"] for shard in shards] == [10, 3]
+        assert load_manifest(str(tmp_path)) == {"shards": shards}
+        for shard in shards:
+            assert shard["format"] == data_format
+            assert os.path.exists(os.path.join(tmp_path, shard["path"]))
+        assert_same_data(
+            pd.concat(parts, ignore_index=True), load_processed_data(str(tmp_path))
+        )
+
+    def test_parquet_restores_the_complex_columns(self, tmp_path):
+        data = processed_data(5)
+        save_manifest(
+            str(tmp_path), save_shards(data, str(tmp_path), 0, data_format="parquet")
+        )
+        with open(os.path.join(tmp_path, "0.parquet"), "rb") as f:
+            metadata = pq.read_schema(f).metadata
+        # only the arbitrary objects are pickled
+        assert json.loads(metadata[PICKLED_COLUMNS_KEY]) == ["entities_info"]
+        assert json.loads(metadata[MATRIX_COLUMNS_KEY]) == ["label_ids"]
+
+        loaded = load_processed_data(str(tmp_path))
+        assert list(loaded.columns) == list(data.columns)
+        assert isinstance(loaded["input_ids"][0], np.ndarray)
+        assert loaded["input_ids"][0].dtype == np.int32
+        assert loaded["large_ids"][0].dtype == np.int64
+        assert loaded["offsets"][1].dtype == np.int32
+        assert loaded["offsets"][1].tolist() == [[0, 1], [2, 1]]
+        assert loaded["word_ids"][2] == [None, 0, 1, None]
+        assert loaded["label_ids"][2].shape == (3, 3)
+        assert loaded["label_ids"][2].tolist() == [[2] * 3] * 3
+        assert loaded["entities_info"][1] == [{"start": 0, "end": 1, "labels": ["PER"]}]
+
+    def test_parquet_offsets_arrays_and_empty_cells(self, tmp_path):
+        """the `offsets` of the `pack_to_numpy` tokenizer and the empty instances"""
+        data = pd.DataFrame(
+            data={
+                "offsets": [
+                    np.array([[0, 1], [2, 4]], dtype=np.int32),
+                    np.zeros((0, 2), dtype=np.int32),
+                    [],
+                ],
+                "label_ids": [[[1, 2], [3, 4]], [], [[5]]],
+            }
+        )
+        save_manifest(
+            str(tmp_path), save_shards(data, str(tmp_path), 0, data_format="parquet")
+        )
+        loaded = load_processed_data(str(tmp_path))
+        assert [cell.shape for cell in loaded["offsets"]] == [(2, 2), (0, 2), (0, 2)]
+        assert [cell.tolist() for cell in loaded["label_ids"]] == [
+            [[1, 2], [3, 4]],
+            [],
+            [[5]],
+        ]
+
+    def test_legacy_without_manifest(self, tmp_path):
+        """the data processed by the old version only has the `0.pkl`"""
+        data = processed_data(6)
+        with open(os.path.join(tmp_path, "0.pkl"), "wb") as f:
+            pkl.dump(data, f)
+        assert not os.path.exists(os.path.join(tmp_path, MANIFEST))
+
+        manifest = load_manifest(str(tmp_path))
+        assert [shard["path"] for shard in manifest["shards"]] == ["0.pkl"]
+        assert_same_data(data, load_processed_data(str(tmp_path)))
+
+    def test_no_data(self, tmp_path):
+        assert load_manifest(str(tmp_path)) is None
+        assert load_processed_data(str(tmp_path)) is None
@@ -0,0 +1,97 @@
+import pickle as pkl
+
+import pytest
+
+import dlk.utils.result_cache
+from dlk.utils.result_cache import ResultCache
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(dlk.utils.result_cache, "time", fake)
+    return fake
+
+
+class TestResultCache(object):
+    def test_lru_eviction(self):
+        cache = ResultCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # "a" is the most recently used now, so "b" is evicted
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        assert len(cache) == 2
+        assert cache.stats()["evictions"] == 1
+
+    def test_put_existing_key_refreshes_it(self):
+        cache = ResultCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.put("a", 10)
+        cache.put("c", 3)
+        assert cache.get("a") == 10
+        assert cache.get("b") is None
+
+    def test_get_returns_a_copy(self):
+        cache = ResultCache(max_size=2)
+        cache.put("a", {"labels": ["pos"]})
+        cache.get("a")["labels"].append("neg")
+        assert cache.get("a") == {"labels": ["pos"]}
+
+    def test_ttl_expire(self, fake_time):
+        cache = ResultCache(max_size=10, ttl=5)
+        cache.put("a", 1)
+        fake_time.now += 3
+        cache.put("b", 2)
+        fake_time.now += 3
+        # "a" lived 6 seconds, "b" lived 3 seconds
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        assert len(cache) == 1
+        fake_time.now += 3
+        assert cache.get("b") is None
+        assert cache.stats()["bytes"] == 0
+
+    def test_never_expire(self, fake_time):
+        cache = ResultCache(max_size=10, ttl=-1)
+        cache.put("a", 1)
+        fake_time.now += 1e9
+        assert cache.get("a") == 1
+
+    def test_bytes_bound_eviction(self):
+        value = "x" * 100
+        size = len(pkl.dumps(value, protocol=pkl.HIGHEST_PROTOCOL))
+        cache = ResultCache(max_size=100, max_bytes=size * 2)
+        cache.put("a", value)
+        cache.put("b", value)
+        assert cache.stats()["bytes"] == size * 2
+        cache.put("c", value)
+        assert cache.get("a") is None
+        assert cache.get("b") == value and cache.get("c") == value
+        assert cache.stats()["bytes"] == size * 2
+        # the value larger than the whole bound is not cached and evicts nothing
+        cache.put("d", "x" * 1000)
+        assert cache.get("d") is None
+        assert len(cache) == 2
+
+    def test_stats_and_clear(self):
+        cache = ResultCache(max_size=10)
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("b")
+        cache.clear()
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+        assert (stats["size"], stats["bytes"]) == (0, 0)
+        assert cache.get("a") is None
@@ -0,0 +1,221 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+
+from dlk.server import MicroBatchServer
+
+
+class StubProcessor(object):
+    def fit(self, input_df):
+        return input_df
+
+    def input_columns(self):
+        return {"sentence"}
+
+
+class StubPostProcessor(object):
+    class config:
+        @staticmethod
+        def _to_dict():
+            return {"origin_input_map": {"uuid": "uuid", "sentence": "sentence"}}
+
+
+class StubPredictor(object):
+    """one predict for one row, the 'long' sentence is expanded to 2 predicts, the empty sentence is dropped and the 'bad' sentence raises"""
+
+    imodel = type("IModel", (), {"postprocessor": StubPostProcessor})
+
+    def __init__(self, name="model"):
+        self.name = name
+        self.batch_sizes = []
+        self.gate = None
+        self.entered = threading.Event()
+
+    def predict(self, processed_data):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.batch_sizes.append(len(processed_data))
+        predicts = []
+        for uuid, sentence in zip(processed_data["uuid"], processed_data["sentence"]):
+            if sentence == "bad":
+                raise ValueError("bad sentence")
+            num = 2 if sentence == "long" else int(sentence != "")
+            predicts.extend(
+                {"uuid": uuid, "sentence": sentence, "model": self.name, "piece": i}
+                for i in range(num)
+            )
+        return predicts
+
+
+class StubServer(MicroBatchServer):
+    def get_processor(self, config):
+        return StubProcessor()
+
+    def get_predictor(self, config, checkpoint):
+        return StubPredictor(checkpoint)
+
+
+def get_request(*sentences, prefix="r"):
+    return pd.DataFrame(
+        {
+            "uuid": [f"{prefix}{i}" for i in range(len(sentences))],
+            "sentence": list(sentences),
+        }
+    )
+
+
+async def fit_all(server, requests):
+    try:
+        return await asyncio.gather(
+            *(server.async_fit(request) for request in requests),
+            return_exceptions=True,
+        )
+    finally:
+        await server.stop()
+
+
+class TestMicroBatchServer(object):
+    def test_coalesce_up_to_max_batch_size(self):
+        server = StubServer(max_batch_size=4, max_wait_ms=50)
+        requests = [get_request("a", "b", prefix=f"r{i}") for i in range(5)]
+        results = asyncio.run(fit_all(server, requests))
+        assert server.predictor.batch_sizes == [4, 4, 2]
+        for i, result in enumerate(results):
+            assert [predict["uuid"] for predict in result] == [f"r{i}0", f"r{i}1"]
+
+    def test_pending_request_starts_the_next_batch(self):
+        server = StubServer(max_batch_size=4, max_wait_ms=50)
+        requests = [
+            get_request("a", "b", "c", prefix="x"),
+            get_request("d", "e", prefix="y"),
+            get_request("f", "g", prefix="z"),
+        ]
+        results = asyncio.run(fit_all(server, requests))
+        # the second request makes the first batch exceed the max_batch_size, it is carried over to the next batch
+        assert server.predictor.batch_sizes == [3, 4]
+        assert server._pending is None
+        assert [[predict["sentence"] for predict in result] for result in results] == [
+            ["a", "b", "c"],
+            ["d", "e"],
+            ["f", "g"],
+        ]
+
+    def test_flush_after_max_wait(self):
+        server = StubServer(max_batch_size=32, max_wait_ms=30)
+
+        async def fit_one_by_one():
+            results = []
+            try:
+                for prefix in ["x", "y"]:
+                    start = time.monotonic()
+                    results.append(
+                        await server.async_fit(get_request("a", prefix=prefix))
+                    )
+                    results.append(time.monotonic() - start)
+            finally:
+                await server.stop()
+            return results
+
+        first, first_time, second, second_time = asyncio.run(fit_one_by_one())
+        # the batch is not full, so every request waits for the max_wait_ms and is predicted alone
+        assert server.predictor.batch_sizes == [1, 1]
+        assert 0.025 <= first_time < 1 and 0.025 <= second_time < 1
+        assert first[0]["uuid"] == "x0" and second[0]["uuid"] == "y0"
+
+    def test_scatter_the_expanded_and_dropped_rows(self):
+        server = StubServer(max_batch_size=32, max_wait_ms=30)
+        requests = [
+            get_request("long", "a", prefix="x"),
+            get_request("", prefix="y"),
+            get_request("b", "", "long", prefix="z"),
+        ]
+        results = asyncio.run(fit_all(server, requests))
+        assert server.predictor.batch_sizes == [6]
+        assert [[(p["uuid"], p["piece"]) for p in result] for result in results] == [
+            [("x0", 0), ("x0", 1), ("x1", 0)],
+            [],
+            [("z0", 0), ("z2", 0), ("z2", 1)],
+        ]
+
+    def test_only_the_failed_request_gets_the_exception(self):
+        server = StubServer(max_batch_size=32, max_wait_ms=30)
+        requests = [
+            get_request("a", prefix="x"),
+            get_request("bad", prefix="y"),
+            get_request("b", prefix="z"),
+        ]
+        results = asyncio.run(fit_all(server, requests))
+        assert [p["uuid"] for p in results[0]] == ["x0"]
+        assert isinstance(results[1], ValueError)
+        assert [p["uuid"] for p in results[2]] == ["z0"]
+
+    def test_stop_cancels_the_running_and_queued_requests(self):
+        server = StubServer(max_batch_size=2, max_wait_ms=10)
+        gate = threading.Event()
+        server.predictor.gate = gate
+
+        async def fit_and_stop():
+            tasks = [
+                asyncio.create_task(server.async_fit(get_request("a", prefix=p)))
+                for p in ["x", "y", "z"]
+            ]
+            try:
+                # wait until the first batch is predicting, the third request is pending or queued
+                while not server._running:
+                    await asyncio.sleep(0.005)
+                await server.stop()
+            finally:
+                gate.set()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        results = asyncio.run(asyncio.wait_for(fit_and_stop(), 5))
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert server._worker is None and server._pending is None
+
+
+class TestServerCache(object):
+    def test_cache_hit_keeps_the_current_uuid(self):
+        server = StubServer(cache_size=10)
+        server.fit(get_request("a", "b", prefix="x"))
+        result = server.fit(get_request("b", "c", prefix="y"))
+        # only "c" is predicted, the predict of "b" is from the cache
+        assert server.predictor.batch_sizes == [2, 1]
+        assert [(p["uuid"], p["sentence"]) for p in result] == [
+            ("y0", "b"),
+            ("y1", "c"),
+        ]
+
+    def test_predicts_started_before_reload_are_not_cached(self):
+        server = StubServer(checkpoint="old", cache_size=10)
+        gate = threading.Event()
+        server.predictor.gate = gate
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(server.fit(get_request("a")))
+        )
+        thread.start()
+        assert server.predictor.entered.wait(5)
+        server.reload("new")
+        gate.set()
+        thread.join(5)
+        assert results[0][0]["model"] == "old"
+        assert len(server.cache) == 0
+        assert server.fit(get_request("a"))[0]["model"] == "new"
+        assert server.fit(get_request("a"))[0]["model"] == "new"
+        assert server.predictor.batch_sizes == [1]
+
+    def test_expanded_rows_are_not_cached(self):
+        server = StubServer(cache_size=10)
+        server.fit(get_request("a"))
+        result = server.fit(get_request("a", "long"))
+        assert [(p["sentence"], p["piece"]) for p in result] == [
+            ("a", 0),
+            ("long", 0),
+            ("long", 1),
+        ]
+        # the rows can not be mapped to the predicts, so all the rows are predicted again and none is cached
+        assert server.predictor.batch_sizes == [1, 1, 2]
+        assert len(server.cache) == 1